@@ -0,0 +1,77 @@
+"""Compare per-request greedy matching with windowed batch assignment.
+
+Run from the services directory:
+
+    python -m benchmarks.batch_assignment --drivers 3000 --requests 50 200 800
+"""
+
+import argparse
+import random
+import time
+
+from ride_match.app import RideMatcher
+from ride_match.spatial_index import DriverGridIndex
+
+# Central London, where peak demand is concentrated
+REGION = ((51.48, 51.54), (-0.18, -0.06))
+
+
+def random_location(rng):
+    (lat_min, lat_max), (lon_min, lon_max) = REGION
+    return {
+        "latitude": rng.uniform(lat_min, lat_max),
+        "longitude": rng.uniform(lon_min, lon_max),
+    }
+
+
+def build_matcher(drivers):
+    matcher = RideMatcher(DriverGridIndex())
+    for driver_id, location in drivers.items():
+        matcher.update_driver_location(
+            driver_id, location["latitude"], location["longitude"]
+        )
+    return matcher
+
+
+def total_distance(matches):
+    return sum(match["distanceKm"] for match in matches if match)
+
+
+def run(driver_count, request_count, seed=42):
+    rng = random.Random(seed)
+    drivers = {f"driver-{i}": random_location(rng) for i in range(driver_count)}
+    locations = [random_location(rng) for _ in range(request_count)]
+
+    matcher = build_matcher(drivers)
+    start = time.perf_counter()
+    greedy = [matcher.match(location) for location in locations]
+    greedy_elapsed = time.perf_counter() - start
+
+    matcher = build_matcher(drivers)
+    start = time.perf_counter()
+    batched = matcher.match_batch(locations, deadline=time.monotonic() + 1.0)
+    batch_elapsed = time.perf_counter() - start
+
+    greedy_km = total_distance(greedy)
+    batch_km = total_distance(batched)
+    print(
+        f"requests: {request_count:5d}  "
+        f"greedy: {greedy_km:8.1f} km in {greedy_elapsed * 1000:7.1f} ms  "
+        f"batch: {batch_km:8.1f} km in {batch_elapsed * 1000:7.1f} ms  "
+        f"saved: {(1 - batch_km / greedy_km) * 100:5.1f}%"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drivers", type=int, default=3000)
+    parser.add_argument("--requests", type=int, nargs="+", default=[50, 200, 800])
+    args = parser.parse_args()
+
+    print(f"drivers: {args.drivers}")
+    for request_count in args.requests:
+        run(args.drivers, request_count)
+
+
+if __name__ == "__main__":
+    main()
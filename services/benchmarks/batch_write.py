@@ -0,0 +1,64 @@
+"""Compare per-item put_item with store_many against a fake DynamoDB client.
+
+Run from the services directory:
+
+    python -m benchmarks.batch_write --records 2000 --latency-ms 5
+"""
+
+import argparse
+import time
+
+from ride_request.app_old_v11 import RideRequestDynamoDBStorage
+
+
+class LatencyDynamoDBClient:
+    """Charges a fixed round-trip latency per call, like a warm HTTPS connection."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def put_item(self, TableName, Item):
+        time.sleep(self.latency)
+
+    def batch_write_item(self, RequestItems):
+        time.sleep(self.latency)
+        return {"UnprocessedItems": {}}
+
+
+def ride_request_body(index):
+    return {
+        "customerId": f"customer-{index}",
+        "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+        "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+    }
+
+
+def run(records, latency):
+    bodies = [ride_request_body(i) for i in range(records)]
+    storage = RideRequestDynamoDBStorage(LatencyDynamoDBClient(latency))
+
+    start = time.perf_counter()
+    for body in bodies:
+        storage.store(body)
+    single_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    storage.store_many(bodies)
+    batch_elapsed = time.perf_counter() - start
+
+    print(f"records: {records}, round trip: {latency * 1000:.1f} ms")
+    print(f"put_item:   {records / single_elapsed:10.0f} records/s")
+    print(f"store_many: {records / batch_elapsed:10.0f} records/s")
+    print(f"speedup:    {single_elapsed / batch_elapsed:10.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    run(args.records, args.latency_ms / 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Store writes and throughput of the driver location ingestion pipeline.
+
+Simulates --drivers drivers sending a GPS ping every --interval seconds for
+--minutes minutes. Each message carries one ping, so a batch can hold
+several pings from one driver. A share of drivers is parked with a few
+metres of GPS jitter; the others drive at city speeds. Some messages are
+delivered twice, and some only after the next ping. The pings are fed in
+SQS-sized batches through DriverLocationBatchHandler, which writes to the
+in-memory DynamoDB stand-in and updates a DriverGridIndex. Run from the
+services directory:
+
+    python -m benchmarks.driver_locations --drivers 5000 --minutes 5
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+
+from common.driver_ingestion import DriverLocationBatchHandler, DriverLocationIngestor
+from common.geo import KM_PER_DEGREE
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from common.write_behind import WriteBehindBuffer
+from ride_match.spatial_index import DriverGridIndex
+
+# Central London
+CENTER = (51.5074, -0.1278)
+GPS_JITTER_KM = 0.005
+
+
+def ping_stream(args):
+    # Yields messages in the order the stream delivers them
+    rng = random.Random(args.seed)
+    drivers = []
+    for n in range(args.drivers):
+        drivers.append(
+            {
+                "driverId": f"driver-{n}",
+                "latitude": CENTER[0] + rng.uniform(-0.1, 0.1),
+                "longitude": CENTER[1] + rng.uniform(-0.15, 0.15),
+                "parked": rng.random() < args.parked,
+                "heading": rng.uniform(0, 2 * math.pi),
+                "offset": rng.uniform(0, args.interval),
+            }
+        )
+
+    late = []
+    steps = int(args.minutes * 60 / args.interval)
+    for step in range(steps):
+        # Late messages arrive after the driver's next ping
+        batch, late, delayed = [], [], late
+        for driver in drivers:
+            if driver["parked"]:
+                move_km = rng.gauss(0, GPS_JITTER_KM)
+            else:
+                driver["heading"] += rng.gauss(0, 0.3)
+                move_km = args.speed_kmh * args.interval / 3600
+            driver["latitude"] += move_km * math.cos(driver["heading"]) / KM_PER_DEGREE
+            driver["longitude"] += (
+                move_km
+                * math.sin(driver["heading"])
+                / (KM_PER_DEGREE * math.cos(math.radians(driver["latitude"])))
+            )
+
+            timestamp = int((step * args.interval + driver["offset"]) * 1000)
+            message = {
+                "driverId": driver["driverId"],
+                "pings": [
+                    {
+                        "latitude": driver["latitude"],
+                        "longitude": driver["longitude"],
+                        "timestamp": timestamp,
+                    }
+                ],
+            }
+            roll = rng.random()
+            if roll < args.late:
+                late.append(message)
+            else:
+                batch.append(message)
+                if roll < args.late + args.duplicates:
+                    batch.append(message)
+        yield from batch
+        yield from delayed
+    yield from late
+
+
+def batches(messages, batch_size):
+    records = []
+    for number, message in enumerate(messages):
+        records.append({"messageId": str(number), "body": json.dumps(message)})
+        if len(records) == batch_size:
+            yield {"Records": records}
+            records = []
+    if records:
+        yield {"Records": records}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drivers", type=int, default=5000)
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--interval", type=float, default=4, help="seconds")
+    parser.add_argument("--parked", type=float, default=0.4)
+    parser.add_argument("--speed-kmh", type=float, default=25)
+    parser.add_argument("--duplicates", type=float, default=0.01)
+    parser.add_argument("--late", type=float, default=0.01)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    events = list(batches(ping_stream(args), args.batch_size))
+    client = InMemoryDynamoDBClient()
+    index = DriverGridIndex()
+    ingestor = DriverLocationIngestor(
+        index, WriteBehindBuffer(client, "Drivers", "driverId")
+    )
+    handler = DriverLocationBatchHandler(ingestor)
+
+    started = time.perf_counter()
+    for event in events:
+        handler.handle(event, None)
+    elapsed = time.perf_counter() - started
+
+    stats = ingestor.stats
+    pings = stats["received"]
+    print(
+        f"{args.drivers} drivers, {pings} pings in {len(events)} batches, "
+        f"{len(index)} drivers indexed"
+    )
+    for name in ("superseded", "duplicate", "out_of_order", "indexed", "written"):
+        print(f"{name:13s} {stats[name]:9d} {stats[name] / pings:7.1%}")
+    print(f"BatchWriteItem calls: {client.call_counts.get('BatchWriteItem', 0)}")
+    print(f"store writes saved vs one per ping: {1 - stats['written'] / pings:.0%}")
+    print(f"throughput: {pings / elapsed:,.0f} pings/s ({elapsed:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Memory and full-scan time of DriverRegistry against DynamoDB-shaped dicts.
+
+Fills a DriverRegistry with --drivers drivers, and a dict of DRIVER_ITEM
+items (the shape the Drivers table stores) with --baseline-drivers, then
+times --scans full scans of each for available drivers seen in the last
+minute, and nearest-driver scans of the registry. Memory is what
+tracemalloc sees allocated while filling, not counting the driver id
+strings both hold. Run from the services directory:
+
+    python -m benchmarks.driver_registry --drivers 1000000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmarks.regions import GREATER_LONDON
+from common.item_schema import DRIVER_ITEM
+from ride_match.driver_registry import DRIVER_STATUSES, DriverRegistry
+
+NOW_MS = 1_700_000_000_000
+
+
+def random_drivers(count, rng):
+    (lat_min, lat_max), (lon_min, lon_max) = GREATER_LONDON
+    return [
+        (
+            f"driver-{n}",
+            rng.uniform(lat_min, lat_max),
+            rng.uniform(lon_min, lon_max),
+            rng.choice(DRIVER_STATUSES),
+            NOW_MS - rng.randrange(5 * 60 * 1000),
+        )
+        for n in range(count)
+    ]
+
+
+def traced(build):
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        result = build()
+        elapsed = time.perf_counter() - started
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size, elapsed
+
+
+def build_registry(drivers):
+    registry = DriverRegistry()
+    for driver_id, latitude, longitude, status, last_seen in drivers:
+        registry.upsert(driver_id, latitude, longitude, status, last_seen)
+    return registry
+
+
+def build_items(drivers):
+    return {
+        driver_id: DRIVER_ITEM.marshal(
+            {
+                "driverId": driver_id,
+                "status": status,
+                "location": {"latitude": latitude, "longitude": longitude},
+                "lastSeen": last_seen,
+            }
+        )
+        for driver_id, latitude, longitude, status, last_seen in drivers
+    }
+
+
+def scan_items(items, seen_since):
+    return [
+        driver_id
+        for driver_id, item in items.items()
+        if item["status"]["S"] == "available"
+        and int(item["lastSeen"]["N"]) >= seen_since
+    ]
+
+
+def best_of(scans, scan):
+    best = float("inf")
+    for _ in range(scans):
+        started = time.perf_counter()
+        scan()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drivers", type=int, default=1_000_000)
+    parser.add_argument("--baseline-drivers", type=int, default=100_000)
+    parser.add_argument("--scans", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    drivers = random_drivers(args.drivers, rng)
+    seen_since = NOW_MS - 60 * 1000
+
+    registry, registry_bytes, registry_fill = traced(lambda: build_registry(drivers))
+    items, items_bytes, items_fill = traced(
+        lambda: build_items(drivers[: args.baseline_drivers])
+    )
+
+    registry_scan = best_of(
+        args.scans, lambda: registry.select("available", seen_since=seen_since)
+    )
+    items_scan = best_of(args.scans, lambda: scan_items(items, seen_since))
+    nearest_scan = best_of(
+        args.scans, lambda: registry.nearest(51.5074, -0.1278, 5, seen_since=seen_since)
+    )
+
+    print(
+        f"{'':16s} {'drivers':>9s} {'bytes/driver':>13s} {'fill us':>8s} "
+        f"{'scan ms':>8s} {'scan ns/driver':>15s}"
+    )
+    rows = (
+        ("registry", args.drivers, registry_bytes, registry_fill, registry_scan),
+        ("DynamoDB items", len(items), items_bytes, items_fill, items_scan),
+    )
+    for label, count, size, fill, scan in rows:
+        print(
+            f"{label:16s} {count:9d} {size / count:13.0f} "
+            f"{fill / count * 1e6:8.2f} {scan * 1000:8.1f} {scan / count * 1e9:15.1f}"
+        )
+    print(
+        f"registry nearest (k=5): {nearest_scan * 1000:.1f} ms, "
+        f"{nearest_scan / args.drivers * 1e9:.1f} ns/driver"
+    )
+    print(
+        f"registry uses {items_bytes / len(items) / (registry_bytes / args.drivers):.1f}x "
+        f"less memory and scans "
+        f"{(items_scan / len(items)) / (registry_scan / args.drivers):.0f}x faster"
+    )
+
+
+if __name__ == "__main__":
+    main()
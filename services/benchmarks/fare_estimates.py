@@ -0,0 +1,123 @@
+"""Hit rate and latency of memoized fare quotes.
+
+Simulates --customers customers who each ask for --quotes quotes a few
+seconds apart before booking. Every quote moves the pickup by up to
+--jitter-m metres of GPS noise. Quotes arrive at --rate per second on a
+simulated clock that also drives a SurgePricer's updates. Every route
+computation waits --route-latency-ms, standing in for a road-network
+lookup. The same stream is timed through a FareEstimator with its caches
+and through one with zero-size caches. Run from the services directory:
+
+    python -m benchmarks.fare_estimates --customers 2000 --route-latency-ms 0.5
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.histogram import LatencyHistogram
+from benchmarks.regions import GREATER_LONDON
+from common.geo import KM_PER_DEGREE
+from ride_request.fares import FareEstimator
+from ride_request.surge import SurgePricer
+
+STARTED_AT = datetime(2024, 8, 30, 17, 0, tzinfo=timezone.utc)
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def quote_stream(args):
+    # (seconds since start, pickup, destination), in arrival order
+    rng = random.Random(args.seed)
+    (lat_min, lat_max), (lon_min, lon_max) = GREATER_LONDON
+    jitter = args.jitter_m / 1000 / KM_PER_DEGREE
+    quotes = []
+
+    for customer in range(args.customers):
+        started = customer / args.rate * args.quotes
+        pickup = (rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max))
+        destination = {
+            "latitude": rng.uniform(lat_min, lat_max),
+            "longitude": rng.uniform(lon_min, lon_max),
+        }
+        for n in range(args.quotes):
+            location = {
+                "latitude": pickup[0] + rng.uniform(-jitter, jitter),
+                "longitude": pickup[1] + rng.uniform(-jitter, jitter) * 1.6,
+            }
+            quotes.append((started + n * rng.uniform(2, 8), location, destination))
+
+    quotes.sort(key=lambda quote: quote[0])
+    return quotes
+
+
+def run(quotes, cache_size, route_latency):
+    clock = SimulatedClock()
+    estimator = FareEstimator(
+        surge_pricer=SurgePricer(clock=clock), cache_size=cache_size, report_every=0
+    )
+    estimate_seconds = estimator.eta_engine.estimate_seconds
+
+    def routed_estimate_seconds(*args):
+        time.sleep(route_latency)
+        return estimate_seconds(*args)
+
+    estimator.eta_engine.estimate_seconds = routed_estimate_seconds
+    histogram = LatencyHistogram()
+
+    started = time.perf_counter()
+    for at, pickup, destination in quotes:
+        clock.now = at
+        departure = STARTED_AT + timedelta(seconds=at)
+        quote_started = time.perf_counter()
+        estimator.estimate(pickup, destination, departure)
+        histogram.record((time.perf_counter() - quote_started) * 1e6)
+    elapsed = time.perf_counter() - started
+
+    return estimator, histogram, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--quotes", type=int, default=4)
+    parser.add_argument("--jitter-m", type=float, default=15)
+    parser.add_argument("--rate", type=float, default=200, help="quotes/s")
+    parser.add_argument("--route-latency-ms", type=float, default=0.5)
+    parser.add_argument("--cache-size", type=int, default=8192)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    quotes = quote_stream(args)
+    print(
+        f"{len(quotes)} quotes from {args.customers} customers, "
+        f"{args.jitter_m} m jitter, {args.rate:g} quotes/s, "
+        f"{args.route_latency_ms} ms per route"
+    )
+    print(
+        f"{'caches':12s} {'quotes hit':>10s} {'routes hit':>10s} "
+        f"{'p50 us':>8s} {'p99 us':>8s} {'quotes/s':>10s}"
+    )
+    for label, cache_size in (("memoized", args.cache_size), ("none", 0)):
+        estimator, histogram, elapsed = run(
+            quotes, cache_size, args.route_latency_ms / 1000
+        )
+        routes = estimator.route_fare.cache_info()
+        print(
+            f"{label:12s} {estimator.quote_cache.hit_rate:10.1%} "
+            f"{routes.hits / (routes.hits + routes.misses):10.1%} "
+            f"{histogram.value_at_percentile(50):8.1f} "
+            f"{histogram.value_at_percentile(99):8.1f} "
+            f"{len(quotes) / elapsed:10,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Per-request cost of every ride_request handler generation, v1 to v11.
+
+Each version's entry point is driven with API Gateway events built from
+events/event.json against a storage client that does no I/O. Run from the
+services directory:
+
+    python -m benchmarks.handlers --requests 20000
+    python -m benchmarks.handlers --check   # exit 1 if v11 regressed
+
+--check compares the current handler with benchmarks/baselines/handlers.json.
+The gate uses v11's median latency relative to v1, whose code is frozen, so
+the baseline mostly holds across machines. The ratio still moves with the
+CPU (from about 2.0 to 2.8 for the same code), so write the baseline with
+--write-baseline on the machine that runs the check. Refresh it after an
+intended change, not to make a regression pass. v10 answers 500 to
+everything; that bug is kept as is.
+"""
+
+import argparse
+import contextlib
+import gc
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+# The old generations build a boto3 client at import, which needs a region
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent
+EVENT_PATH = SERVICES_DIR / "events" / "event.json"
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "handlers.json"
+VERSIONS = [f"v{number}" for number in range(1, 12)]
+CURRENT_VERSION = "v11"
+REFERENCE_VERSION = "v1"
+DEFAULT_THRESHOLD = 0.25
+
+
+class NullDynamoDBClient:
+    """Accepts every write without storing it, so only handler code is timed."""
+
+    def __init__(self):
+        self.writes = 0
+
+    def put_item(self, **kwargs):
+        self.writes += 1
+        return {}
+
+    def batch_write_item(self, RequestItems):
+        self.writes += sum(len(requests) for requests in RequestItems.values())
+        return {"UnprocessedItems": {}}
+
+    def query(self, **kwargs):
+        # The surge pricer's supply reads; nothing is ever stored
+        return {"Items": []}
+
+
+def create_client(backend):
+    if backend == "memory":
+        from common.in_memory_dynamodb import InMemoryDynamoDBClient
+
+        return InMemoryDynamoDBClient()
+    return NullDynamoDBClient()
+
+
+def build_events(count, invalid_ratio=0.0, seed=42):
+    with open(EVENT_PATH, encoding="utf-8") as event_file:
+        template = json.load(event_file)
+    template.update(httpMethod="POST", path="/ride-requests", resource="/ride-requests")
+
+    rng = random.Random(seed)
+    events = []
+    for index in range(count):
+        body = {
+            "customerId": f"customer-{index}",
+            "pickupLocation": {
+                "latitude": round(rng.uniform(51.3, 51.7), 6),
+                "longitude": round(rng.uniform(-0.5, 0.2), 6),
+            },
+            "destinationLocation": {
+                "latitude": round(rng.uniform(51.3, 51.7), 6),
+                "longitude": round(rng.uniform(-0.5, 0.2), 6),
+            },
+        }
+        if rng.random() < invalid_ratio:
+            del body["destinationLocation"]
+        events.append({**template, "body": json.dumps(body)})
+    return events
+
+
+@contextlib.contextmanager
+def installed(version, client):
+    """Import a handler generation with `client` in place of DynamoDB."""
+    module = importlib.import_module(f"ride_request.app_old_{version}")
+
+    if hasattr(module, "resources"):
+        module.resources.register("dynamodb_client", lambda r: client)
+        try:
+            yield module.wrapped_lambda_handler
+        finally:
+            module.register_resources(module.resources)
+    elif hasattr(module, "dynamodb"):
+        original = module.dynamodb
+        module.dynamodb = client
+        try:
+            yield getattr(module, "wrapped_lambda_handler", module.lambda_handler)
+        finally:
+            module.dynamodb = original
+    else:
+        # v10 builds a fresh boto3 client inside every invocation
+        original = module.boto3
+        module.boto3 = SimpleNamespace(client=lambda *args, **kwargs: client)
+        try:
+            yield module.wrapped_lambda_handler
+        finally:
+            module.boto3 = original
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def measure(handler, events, warmup, allocation_samples):
+    # Old generations print() on failure paths; keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for event in events[:warmup]:
+            handler(event, None)
+
+        statuses = {}
+        timings = []
+        gc.collect()
+        started = time.perf_counter()
+        for event in events:
+            before = time.perf_counter_ns()
+            response = handler(event, None)
+            timings.append(time.perf_counter_ns() - before)
+            statuses[response["statusCode"]] = (
+                statuses.get(response["statusCode"], 0) + 1
+            )
+        elapsed = time.perf_counter() - started
+
+        # tracemalloc slows every allocation down, so it gets its own pass
+        tracemalloc.start()
+        peaks = []
+        for event in events[:allocation_samples]:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            handler(event, None)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "p50_us": percentile(timings, 0.50) / 1000,
+        "p90_us": percentile(timings, 0.90) / 1000,
+        "p99_us": percentile(timings, 0.99) / 1000,
+        "max_us": timings[-1] / 1000,
+        "throughput_rps": len(events) / elapsed,
+        "peak_alloc_kib": statistics.median(peaks) / 1024 if peaks else 0.0,
+        "statuses": statuses,
+    }
+
+
+def run(versions, events, backend, warmup, allocation_samples):
+    results = {}
+    for version in versions:
+        client = create_client(backend)
+        with installed(version, client) as handler:
+            results[version] = measure(handler, events, warmup, allocation_samples)
+    return results
+
+
+def relative_cost(events, backend, warmup, rounds):
+    """Median over rounds of the current handler's p50 divided by v1's.
+
+    Both versions are timed back to back on the same slice of events in each
+    round, so machine-wide slowdowns hit both sides of every ratio.
+    """
+    slice_size = max(1, len(events) // rounds)
+    ratios = []
+    with installed(REFERENCE_VERSION, create_client(backend)) as reference, installed(
+        CURRENT_VERSION, create_client(backend)
+    ) as current:
+        for start in range(0, slice_size * rounds, slice_size):
+            chunk = events[start : start + slice_size]
+            reference_p50 = measure(reference, chunk, warmup, 0)["p50_us"]
+            current_p50 = measure(current, chunk, warmup, 0)["p50_us"]
+            ratios.append(current_p50 / reference_p50)
+    return statistics.median(ratios)
+
+
+def print_report(results):
+    print(
+        f"{'version':8s} {'p50 us':>8s} {'p90 us':>8s} {'p99 us':>8s} "
+        f"{'max us':>9s} {'req/s':>9s} {'peak KiB':>9s}  statuses"
+    )
+    for version, result in results.items():
+        statuses = ", ".join(
+            f"{status}x{count}" for status, count in sorted(result["statuses"].items())
+        )
+        print(
+            f"{version:8s} {result['p50_us']:8.1f} {result['p90_us']:8.1f} "
+            f"{result['p99_us']:8.1f} {result['max_us']:9.1f} "
+            f"{result['throughput_rps']:9.0f} {result['peak_alloc_kib']:9.1f}  "
+            f"{statuses}"
+        )
+
+
+def check_regression(relative, baseline, threshold):
+    limit = baseline["relative_p50"] * (1 + threshold)
+    regressed = relative > limit
+    print(
+        f"{CURRENT_VERSION} p50 relative to {REFERENCE_VERSION}: {relative:.2f} "
+        f"(baseline {baseline['relative_p50']:.2f}, limit {limit:.2f}) "
+        f"{'REGRESSED' if regressed else 'ok'}"
+    )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--warmup", type=int, default=1_000)
+    parser.add_argument("--allocation-samples", type=int, default=200)
+    parser.add_argument("--invalid-ratio", type=float, default=0.0)
+    parser.add_argument("--backend", choices=("null", "memory"), default="null")
+    parser.add_argument("--versions", nargs="+", default=VERSIONS, choices=VERSIONS)
+    parser.add_argument("--rounds", type=int, default=15)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--write-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    events = build_events(args.requests, args.invalid_ratio)
+
+    if args.check or args.write_baseline:
+        relative = relative_cost(events, args.backend, args.warmup, args.rounds)
+        if args.write_baseline:
+            args.baseline.parent.mkdir(parents=True, exist_ok=True)
+            baseline = {"requests": args.requests, "relative_p50": relative}
+            args.baseline.write_text(json.dumps(baseline, indent=2) + "\n")
+            print(f"Wrote {args.baseline}")
+        if args.check:
+            baseline = json.loads(args.baseline.read_text())
+            if check_regression(relative, baseline, args.threshold):
+                sys.exit(1)
+        return
+
+    results = run(
+        args.versions, events, args.backend, args.warmup, args.allocation_samples
+    )
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
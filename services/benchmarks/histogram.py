@@ -0,0 +1,128 @@
+"""Log-linear latency histogram in the style of HdrHistogram.
+
+Values are non-negative integers (microseconds by convention). Every value
+is recorded with at most 10**-significant_digits relative error, in O(1)
+time and with memory bounded by the number of distinct buckets touched.
+"""
+
+import math
+import threading
+
+
+class LatencyHistogram:
+    def __init__(self, significant_digits=3):
+        sub_bucket_count = 2 * 10**significant_digits
+        self.sub_bucket_bits = math.ceil(math.log2(sub_bucket_count))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count // 2
+        self.counts = {}
+        self.total_count = 0
+        self.min_value = None
+        self.max_value = 0
+        self.lock = threading.Lock()
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        index = self.__index_of(value)
+
+        with self.lock:
+            self.counts[index] = self.counts.get(index, 0) + count
+            self.total_count += count
+            if self.min_value is None or value < self.min_value:
+                self.min_value = value
+            if value > self.max_value:
+                self.max_value = value
+
+    def merge(self, other):
+        with self.lock:
+            for index, count in other.counts.items():
+                self.counts[index] = self.counts.get(index, 0) + count
+            self.total_count += other.total_count
+            if other.min_value is not None and (
+                self.min_value is None or other.min_value < self.min_value
+            ):
+                self.min_value = other.min_value
+            self.max_value = max(self.max_value, other.max_value)
+
+    def value_at_percentile(self, percentile):
+        if not self.total_count:
+            return 0
+
+        threshold = max(1, math.ceil(percentile / 100 * self.total_count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return min(self.__highest_equivalent(index), self.max_value)
+        return self.max_value
+
+    def mean(self):
+        if not self.total_count:
+            return 0.0
+        total = sum(
+            (self.__lowest_equivalent(index) + self.__highest_equivalent(index))
+            / 2
+            * count
+            for index, count in self.counts.items()
+        )
+        return total / self.total_count
+
+    def percentile_distribution(self, ticks_per_half_distance=5, scale=1.0):
+        """Rows of (value / scale, percentile, total count, 1 / (1 - percentile)).
+
+        Percentile steps halve the remaining distance to 100%, as in the
+        .hgrm output of HdrHistogram, so the tail gets as many rows as the
+        body.
+        """
+        rows = []
+        if not self.total_count:
+            return rows
+
+        step = 0
+        while True:
+            fraction = 1 - 0.5 ** (step / ticks_per_half_distance)
+            count_at = max(1, math.ceil(fraction * self.total_count))
+            if count_at >= self.total_count:
+                break
+            value = self.value_at_percentile(fraction * 100)
+            inverted = 1 / (1 - fraction)
+            rows.append((value / scale, fraction, count_at, inverted))
+            step += 1
+
+        rows.append((self.max_value / scale, 1.0, self.total_count, math.inf))
+        return rows
+
+    def format_hgrm(self, scale=1.0):
+        lines = [
+            f"{'Value':>12s} {'Percentile':>14s} {'TotalCount':>10s} "
+            f"{'1/(1-Percentile)':>16s}",
+            "",
+        ]
+        for value, fraction, count, inverted in self.percentile_distribution(
+            scale=scale
+        ):
+            inverted_text = "" if math.isinf(inverted) else f"{inverted:16.2f}"
+            lines.append(f"{value:12.3f} {fraction:14.12f} {count:10d} {inverted_text}")
+        lines.append(
+            f"#[Mean = {self.mean() / scale:.3f}, Max = {self.max_value / scale:.3f}, "
+            f"Total count = {self.total_count}]"
+        )
+        return "\n".join(lines)
+
+    def __index_of(self, value):
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return shift * self.sub_bucket_half + (value >> shift)
+
+    def __lowest_equivalent(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        shift = index // self.sub_bucket_half - 1
+        return (index - shift * self.sub_bucket_half) << shift
+
+    def __highest_equivalent(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        shift = index // self.sub_bucket_half - 1
+        return ((index - shift * self.sub_bucket_half + 1) << shift) - 1
@@ -0,0 +1,133 @@
+"""Per-module import cost of a handler module, as paid on a Lambda cold start.
+
+Imports the module in fresh interpreters with `python -X importtime`, keeps
+the fastest of --repeat runs for every module and reports the slowest ones.
+Run from the services directory:
+
+    python -m benchmarks.import_time ride_request.app_old_v11
+    python -m benchmarks.import_time --check   # exit 1 on a regression
+
+--check fails when the module's cumulative import time exceeds --budget-ms,
+or when any --forbid module (boto3 and botocore by default) is loaded by
+the import at all, which is the regression that matters most.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+SERVICES_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_MODULE = "ride_request.app_old_v11"
+DEFAULT_FORBIDDEN = ("boto3", "botocore")
+DEFAULT_BUDGET_MS = 75.0
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+class ImportRecord:
+    def __init__(self, name, depth, self_us, cumulative_us):
+        self.name = name
+        self.depth = depth
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+
+
+def parse_importtime(output, module):
+    """Return the records for `module` and everything it imported.
+
+    -X importtime lists children before their parent, so the subtree of a
+    top-level import is everything since the previous top-level line.
+    """
+    records = []
+    for line in output.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append(
+                ImportRecord(
+                    name, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)
+                )
+            )
+
+    subtree = []
+    for record in records:
+        subtree.append(record)
+        if record.depth == 0:
+            if record.name == module:
+                return subtree
+            subtree = []
+    raise ValueError(f"{module} not found in the -X importtime output")
+
+
+def measure(module, repeat):
+    best = {}
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=SERVICES_DIR,
+            env={**os.environ, "AWS_DEFAULT_REGION": "us-east-1"},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        for record in parse_importtime(completed.stderr, module):
+            current = best.get(record.name)
+            if current is None or record.cumulative_us < current.cumulative_us:
+                best[record.name] = record
+    return best
+
+
+def print_report(records, module, top):
+    total = records[module].cumulative_us
+    print(f"{module}: {total / 1000:.1f} ms cumulative, {len(records)} modules")
+    print()
+    print(f"{'self ms':>8s} {'cumul ms':>9s} {'share':>6s}  module")
+    slowest = sorted(records.values(), key=lambda record: -record.self_us)[:top]
+    for record in slowest:
+        print(
+            f"{record.self_us / 1000:8.2f} {record.cumulative_us / 1000:9.2f} "
+            f"{record.self_us / total:6.1%}  {record.name}"
+        )
+
+
+def check(records, module, budget_ms, forbidden):
+    failures = []
+    total_ms = records[module].cumulative_us / 1000
+    if total_ms > budget_ms:
+        failures.append(f"{module} takes {total_ms:.1f} ms, budget {budget_ms} ms")
+
+    for name in sorted(records):
+        if name.split(".")[0] in forbidden:
+            failures.append(f"{module} imports {name} at module load")
+            break
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("module", nargs="?", default=DEFAULT_MODULE)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument(
+        "--forbid", nargs="*", default=list(DEFAULT_FORBIDDEN), metavar="MODULE"
+    )
+    args = parser.parse_args()
+
+    records = measure(args.module, args.repeat)
+    print_report(records, args.module, args.top)
+
+    if args.check:
+        failures = check(records, args.module, args.budget_ms, set(args.forbid))
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if failures:
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
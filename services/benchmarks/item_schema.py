@@ -0,0 +1,55 @@
+"""Compare the handwritten ride-request builder with the schema marshaller.
+
+Run from the services directory:
+
+    python -m benchmarks.item_schema --number 200000
+"""
+
+import argparse
+import timeit
+
+from common.item_schema import RIDE_REQUEST_ITEM, build_ride_request_item
+
+BODY = {
+    "customerId": "customer-1",
+    "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+    "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+}
+RIDE_ID = "0b7e4c1e-7d55-4f31-9a7f-0c4b1b3c1c55"
+TIMESTAMP = "2024-08-31T12:00:00+00:00"
+
+
+def schema_build_item(body, ride_id, status, timestamp):
+    # The generic marshaller build_ride_request_item stands in for
+    return RIDE_REQUEST_ITEM.marshal(
+        {**body, "rideId": ride_id, "status": status, "timestamp": timestamp}
+    )
+
+
+def measure(label, function, number):
+    elapsed = min(timeit.repeat(function, number=number, repeat=5))
+    print(f"{label:22s} {elapsed / number * 1e9:8.0f} ns/item")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+    item = build_ride_request_item(BODY, RIDE_ID, "requested", TIMESTAMP)
+
+    assert item == schema_build_item(BODY, RIDE_ID, "requested", TIMESTAMP)
+    measure(
+        "handwritten marshal",
+        lambda: build_ride_request_item(BODY, RIDE_ID, "requested", TIMESTAMP),
+        args.number,
+    )
+    measure(
+        "schema marshal",
+        lambda: schema_build_item(BODY, RIDE_ID, "requested", TIMESTAMP),
+        args.number,
+    )
+    measure("schema unmarshal", lambda: RIDE_REQUEST_ITEM.unmarshal(item), args.number)
+
+
+if __name__ == "__main__":
+    main()
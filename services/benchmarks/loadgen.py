@@ -0,0 +1,406 @@
+"""Open-loop load generator for the ride request API.
+
+Requests are issued on a Poisson schedule at --rate per second whether or
+not earlier ones have finished, as real riders do. Latency is measured from
+each request's *intended* start time, so time spent queued behind a slow
+request counts (the coordinated-omission correction); plain service time is
+reported alongside it. Run from the services directory:
+
+    # in-process, against the in-memory DynamoDB stand-in
+    python -m benchmarks.loadgen run --rate 500 --duration 30 \\
+        --storage-latency-ms 4 --throttle-rate 0.01
+
+    # over HTTP, e.g. against the local adapter below
+    python -m benchmarks.loadgen serve --port 8080
+    python -m benchmarks.loadgen run --url http://127.0.0.1:8080/ride-requests
+
+Events are synthesized around --hotspot LAT,LON,WEIGHT,RADIUS_KM (repeatable)
+or replayed from --replay, a JSON-lines file of API Gateway events or plain
+request bodies.
+"""
+
+import argparse
+import http.client
+import importlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from benchmarks.histogram import LatencyHistogram
+
+DEFAULT_HANDLER = "ride_request.app_old_v11:wrapped_lambda_handler"
+KM_PER_DEGREE = 111.32
+# Central London, Heathrow and Canary Wharf: (lat, lon, weight, radius km)
+DEFAULT_HOTSPOTS = [
+    (51.5074, -0.1278, 0.6, 3.0),
+    (51.4700, -0.4543, 0.15, 1.5),
+    (51.5054, -0.0235, 0.25, 1.5),
+]
+
+
+def parse_hotspot(text):
+    try:
+        latitude, longitude, weight, radius_km = map(float, text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"expected LAT,LON,WEIGHT,RADIUS_KM, got {text!r}"
+        )
+    return latitude, longitude, weight, radius_km
+
+
+class HotspotEventSource:
+    """Ride request events with pickups and drop-offs clustered on hot-spots."""
+
+    def __init__(self, hotspots, seed=None):
+        self.hotspots = hotspots
+        self.weights = [hotspot[2] for hotspot in hotspots]
+        self.rng = random.Random(seed)
+        self.sequence = 0
+
+    def __call__(self):
+        self.sequence += 1
+        body = {
+            "customerId": f"load-{self.sequence % 100_000}",
+            "pickupLocation": self.__point(),
+            "destinationLocation": self.__point(),
+        }
+        return {
+            "httpMethod": "POST",
+            "path": "/ride-requests",
+            "body": json.dumps(body),
+        }
+
+    def __point(self):
+        latitude, longitude, _, radius_km = self.rng.choices(
+            self.hotspots, self.weights
+        )[0]
+        # Gaussian scatter with `radius_km` as the standard deviation
+        north_km = self.rng.gauss(0, radius_km)
+        east_km = self.rng.gauss(0, radius_km)
+        return {
+            "latitude": round(latitude + north_km / KM_PER_DEGREE, 6),
+            "longitude": round(
+                longitude
+                + east_km / (KM_PER_DEGREE * math.cos(math.radians(latitude))),
+                6,
+            ),
+        }
+
+
+class ReplayEventSource:
+    """Cycles through a JSON-lines file of events or request bodies."""
+
+    def __init__(self, path):
+        self.events = []
+        with open(path, encoding="utf-8") as replay_file:
+            for line in replay_file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "body" not in record:
+                    record = {"httpMethod": "POST", "body": json.dumps(record)}
+                self.events.append(record)
+        if not self.events:
+            raise ValueError(f"No events in {path}")
+        self.position = 0
+
+    def __call__(self):
+        event = self.events[self.position]
+        self.position = (self.position + 1) % len(self.events)
+        return event
+
+
+def load_handler(spec):
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def in_process_target(handler):
+    def invoke(event):
+        return handler(event, None)["statusCode"]
+
+    return invoke
+
+
+def http_target(url):
+    parts = urlsplit(url)
+    connection_class = (
+        http.client.HTTPSConnection
+        if parts.scheme == "https"
+        else http.client.HTTPConnection
+    )
+    path = parts.path or "/"
+    local = threading.local()
+
+    def invoke(event):
+        # One keep-alive connection per worker thread
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = connection_class(parts.netloc, timeout=30)
+        try:
+            connection.request(
+                "POST",
+                path,
+                # bytes go out in the same packet as the headers; a str body
+                # is sent separately and stalls on delayed ACKs
+                body=event["body"].encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            local.connection = None
+            raise
+
+    return invoke
+
+
+def poisson_schedule(rate, duration, rng):
+    # Exponential inter-arrival gaps give a Poisson arrival process
+    offset = rng.expovariate(rate)
+    while offset < duration:
+        yield offset
+        offset += rng.expovariate(rate)
+
+
+class LoadResult:
+    def __init__(self):
+        self.response_time = LatencyHistogram()
+        self.service_time = LatencyHistogram()
+        self.statuses = {}
+        self.exceptions = {}
+        self.max_dispatch_lag = 0.0
+        self.sent = 0
+        self.elapsed = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, intended, started, finished, status=None, error=None):
+        self.response_time.record((finished - intended) * 1e6)
+        self.service_time.record((finished - started) * 1e6)
+        with self.lock:
+            if error is not None:
+                name = type(error).__name__
+                self.exceptions[name] = self.exceptions.get(name, 0) + 1
+            else:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    @property
+    def completed(self):
+        return self.response_time.total_count
+
+    @property
+    def errors(self):
+        server_errors = sum(
+            count for status, count in self.statuses.items() if status >= 500
+        )
+        return server_errors + sum(self.exceptions.values())
+
+
+def run_load(invoke, next_event, rate, duration, concurrency, warmup=0.0, seed=None):
+    """Issue requests open-loop and return a LoadResult for the measured part.
+
+    Requests in the first `warmup` seconds are sent but not recorded.
+    """
+    rng = random.Random(seed)
+    result = LoadResult()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def call(event, intended, measured):
+        started = time.perf_counter()
+        try:
+            status = invoke(event)
+        except Exception as error:
+            if measured:
+                result.record(intended, started, time.perf_counter(), error=error)
+            return
+        if measured:
+            result.record(intended, started, time.perf_counter(), status)
+
+    begin = time.perf_counter()
+    try:
+        for offset in poisson_schedule(rate, warmup + duration, rng):
+            event = next_event()
+            intended = begin + offset
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                result.max_dispatch_lag = max(result.max_dispatch_lag, -delay)
+
+            measured = offset >= warmup
+            result.sent += measured
+            executor.submit(call, event, intended, measured)
+    finally:
+        executor.shutdown(wait=True)
+
+    result.elapsed = time.perf_counter() - begin - warmup
+    return result
+
+
+def print_summary(result, rate, histogram_path=None):
+    completed = result.completed
+    print(f"target rate       {rate:10.1f} req/s")
+    print(f"achieved rate     {completed / result.elapsed:10.1f} req/s")
+    print(f"requests          {completed:10d}")
+    print(
+        f"error rate        {result.errors / completed if completed else 0:10.2%}"
+        "  (5xx and exceptions)"
+    )
+    print(f"statuses          {dict(sorted(result.statuses.items()))}")
+    if result.exceptions:
+        print(f"exceptions        {result.exceptions}")
+    print(f"max dispatch lag  {result.max_dispatch_lag * 1000:10.2f} ms")
+    print()
+    print(f"{'percentile':>10s} {'response ms':>12s} {'service ms':>12s}")
+    for percentile in (50, 90, 99, 99.9, 100):
+        print(
+            f"{percentile:>10} "
+            f"{result.response_time.value_at_percentile(percentile) / 1000:12.3f} "
+            f"{result.service_time.value_at_percentile(percentile) / 1000:12.3f}"
+        )
+    print()
+    print("response time is measured from the scheduled start and is corrected")
+    print("for coordinated omission; service time starts when a worker picks up")
+    print("the request.")
+
+    if histogram_path:
+        with open(histogram_path, "w", encoding="utf-8") as histogram_file:
+            histogram_file.write(result.response_time.format_hgrm(scale=1000))
+            histogram_file.write("\n")
+        print(f"Wrote response time distribution (ms) to {histogram_path}")
+
+
+class AdapterRequestHandler(BaseHTTPRequestHandler):
+    """Turns an HTTP POST into an API Gateway proxy event for the handler."""
+
+    lambda_handler = None
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        event = {
+            "httpMethod": "POST",
+            "path": self.path,
+            "headers": dict(self.headers),
+            "body": self.rfile.read(length).decode("utf-8"),
+            "isBase64Encoded": False,
+        }
+        response = type(self).lambda_handler(event, None)
+        payload = response["body"].encode("utf-8")
+
+        self.send_response(response["statusCode"])
+        for name, value in response.get("headers", {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def configure_storage(args):
+    # Read by common.resources when the handler first builds its client
+    if args.backend == "memory":
+        os.environ["DYNAMODB_BACKEND"] = "memory"
+        os.environ["MEMORY_DYNAMODB_LATENCY_SECONDS"] = str(
+            args.storage_latency_ms / 1000
+        )
+        os.environ["MEMORY_DYNAMODB_JITTER_SECONDS"] = str(
+            args.storage_jitter_ms / 1000
+        )
+        os.environ["MEMORY_DYNAMODB_THROTTLE_RATE"] = str(args.throttle_rate)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+
+def add_storage_arguments(parser):
+    parser.add_argument("--handler", default=DEFAULT_HANDLER)
+    parser.add_argument("--backend", choices=("memory", "aws"), default="memory")
+    parser.add_argument("--storage-latency-ms", type=float, default=0.0)
+    parser.add_argument("--storage-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+
+
+def command_run(args):
+    if args.replay:
+        next_event = ReplayEventSource(args.replay)
+    else:
+        next_event = HotspotEventSource(args.hotspot or DEFAULT_HOTSPOTS, args.seed)
+
+    if args.url:
+        invoke = http_target(args.url)
+    else:
+        configure_storage(args)
+        invoke = in_process_target(load_handler(args.handler))
+
+    result = run_load(
+        invoke,
+        next_event,
+        args.rate,
+        args.duration,
+        args.concurrency,
+        args.warmup,
+        args.seed,
+    )
+    print_summary(result, args.rate, args.histogram)
+
+    if args.max_p99_ms is not None:
+        p99_ms = result.response_time.value_at_percentile(99) / 1000
+        if p99_ms > args.max_p99_ms:
+            print(f"p99 {p99_ms:.3f} ms exceeds --max-p99-ms {args.max_p99_ms}")
+            sys.exit(1)
+
+
+def command_serve(args):
+    configure_storage(args)
+    AdapterRequestHandler.lambda_handler = staticmethod(load_handler(args.handler))
+    server = ThreadingHTTPServer((args.host, args.port), AdapterRequestHandler)
+    print(f"Serving {args.handler} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate load")
+    run_parser.add_argument("--rate", type=float, default=100.0)
+    run_parser.add_argument("--duration", type=float, default=10.0)
+    run_parser.add_argument("--warmup", type=float, default=1.0)
+    run_parser.add_argument("--concurrency", type=int, default=64)
+    run_parser.add_argument("--url")
+    run_parser.add_argument("--replay")
+    run_parser.add_argument("--hotspot", type=parse_hotspot, action="append")
+    run_parser.add_argument("--seed", type=int)
+    run_parser.add_argument("--histogram", help="write an .hgrm-style file")
+    run_parser.add_argument("--max-p99-ms", type=float)
+    add_storage_arguments(run_parser)
+    run_parser.set_defaults(function=command_run)
+
+    serve_parser = commands.add_parser("serve", help="local HTTP adapter")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    add_storage_arguments(serve_parser)
+    serve_parser.set_defaults(function=command_serve)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Merge sampled ride_request profiles into one flame graph.
+
+Reads the profiles InvocationProfiler wrote for RIDE_REQUEST_PROFILE:
+.prof and .folded files, and log files (CloudWatch Logs exports, `sam
+logs` output) with PROFILE lines in them. It prints folded stacks, one
+"frame;frame;frame value" line per call path. These are the input of
+flamegraph.pl, inferno-flamegraph and speedscope. cProfile values are
+microseconds of CPU time; tracemalloc values are bytes left allocated. Run
+from the services directory:
+
+    python -m benchmarks.merge_profiles profiles/*.prof > cpu.folded
+    python -m benchmarks.merge_profiles --mode tracemalloc lambda.log > mem.folded
+    flamegraph.pl cpu.folded > cpu.svg
+"""
+
+import argparse
+import sys
+
+from ride_request.profiling import (
+    CPROFILE,
+    DEFAULT_MIN_MICROSECONDS,
+    MODES,
+    format_folded,
+    merge_profiles,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="profile or log files")
+    parser.add_argument("--mode", choices=MODES, default=CPROFILE)
+    parser.add_argument(
+        "--min-us",
+        type=float,
+        default=DEFAULT_MIN_MICROSECONDS,
+        help="drop cProfile call paths cheaper than this",
+    )
+    args = parser.parse_args()
+
+    stacks = merge_profiles(args.paths, args.mode, args.min_us)
+    if not stacks:
+        sys.exit(f"No {args.mode} profiles in {', '.join(args.paths)}")
+    sys.stdout.write(format_folded(stacks))
+
+
+if __name__ == "__main__":
+    main()
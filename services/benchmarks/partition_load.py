@@ -0,0 +1,152 @@
+"""Partition load on the RideRequests indexes in a surge, with and without sharding.
+
+Simulates --rides ride requests arriving evenly over --duration seconds from
+a Zipf-distributed customer base (a few business accounts book far more
+than anyone else). Each ride is then accepted, picked up and completed, or
+cancelled. The simulator counts the write units that each index partition
+key receives in each second. Every write of a ride rewrites its
+CustomerRides entry; a status change deletes the RidesByStatus entry under
+the old status and writes one under the new. A key above 1,000 write units
+a second is throttled. Run from the services directory:
+
+    python -m benchmarks.partition_load --rides 120000 --duration 20
+"""
+
+import argparse
+import itertools
+import random
+import uuid
+from collections import Counter
+
+from ride_request.app_old_v11 import create_ride_indexes
+from ride_request.sharding import ShardedIndex
+
+# DynamoDB's write limit for a single partition key value
+PARTITION_WRITE_UNITS = 1000
+# Seconds after the request: (low, high) for each step of a completed ride
+RIDE_STEPS = [
+    ("matched", (2, 20)),
+    ("arriving", (60, 240)),
+    ("in_progress", (240, 600)),
+    ("completed", (900, 2400)),
+]
+CANCEL_DELAY = (5, 120)
+
+
+def customer_picker(customers, exponent, rng):
+    weights = [1 / rank**exponent for rank in range(1, customers + 1)]
+    cum_weights = list(itertools.accumulate(weights))
+    population = [f"customer-{rank}" for rank in range(customers)]
+    return lambda: rng.choices(population, cum_weights=cum_weights)[0]
+
+
+def ride_writes(args):
+    # Yields (second, ride id, customer id, old status, new status)
+    rng = random.Random(args.seed)
+    pick_customer = customer_picker(args.customers, args.zipf, rng)
+
+    for n in range(args.rides):
+        requested_at = args.duration * n / args.rides
+        ride_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        customer_id = pick_customer()
+        yield int(requested_at), ride_id, customer_id, None, "requested"
+
+        if rng.random() < args.cancel_rate:
+            steps = [("cancelled", CANCEL_DELAY)]
+        else:
+            steps = RIDE_STEPS
+
+        status = "requested"
+        for next_status, (low, high) in steps:
+            at = requested_at + rng.uniform(low, high)
+            if at >= args.duration:
+                break
+            yield int(at), ride_id, customer_id, status, next_status
+            status = next_status
+
+
+def index_load(writes, customer_index, status_index):
+    # {index name: Counter of (second, partition key) -> write units}
+    load = {customer_index.name: Counter(), status_index.name: Counter()}
+    customers = load[customer_index.name]
+    statuses = load[status_index.name]
+
+    for second, ride_id, customer_id, old_status, new_status in writes:
+        customers[second, customer_index.shard_key(customer_id, ride_id)] += 1
+        if old_status is not None:
+            statuses[second, status_index.shard_key(old_status, ride_id)] += 1
+        statuses[second, status_index.shard_key(new_status, ride_id)] += 1
+    return load
+
+
+def summarize(counter):
+    total = sum(counter.values())
+    keys = {key for _, key in counter}
+    (_, hottest_key), peak = counter.most_common(1)[0]
+    throttled = sum(
+        units - PARTITION_WRITE_UNITS
+        for units in counter.values()
+        if units > PARTITION_WRITE_UNITS
+    )
+    return {
+        "keys": len(keys),
+        "hottest": hottest_key,
+        "peak": peak,
+        "throttled": throttled / total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rides", type=int, default=120_000)
+    parser.add_argument("--duration", type=int, default=20, help="seconds")
+    parser.add_argument("--customers", type=int, default=200_000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--cancel-rate", type=float, default=0.1)
+    parser.add_argument("--customer-shards", type=int)
+    parser.add_argument("--status-shards", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    customer_index, status_index = create_ride_indexes()
+    sharded = (
+        ShardedIndex(
+            customer_index.name,
+            customer_index.attribute,
+            customer_index.sort_key,
+            args.customer_shards or customer_index.shard_count,
+        ),
+        ShardedIndex(
+            status_index.name,
+            status_index.attribute,
+            status_index.sort_key,
+            args.status_shards or status_index.shard_count,
+        ),
+    )
+    unsharded = tuple(
+        ShardedIndex(index.name, index.attribute, index.sort_key) for index in sharded
+    )
+
+    writes = list(ride_writes(args))
+    print(
+        f"{args.rides} rides over {args.duration}s "
+        f"({args.rides / args.duration:.0f}/s), {len(writes)} ride writes"
+    )
+    print(
+        f"{'index':14s} {'shards':>6s} {'keys':>7s} {'peak WCU/s':>11s} "
+        f"{'throttled':>10s}  hottest key"
+    )
+
+    for indexes in (unsharded, sharded):
+        load = index_load(writes, *indexes)
+        for index in indexes:
+            summary = summarize(load[index.name])
+            print(
+                f"{index.name:14s} {index.shard_count:6d} {summary['keys']:7d} "
+                f"{summary['peak']:11d} {summary['throttled']:10.1%}  "
+                f"{summary['hottest']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""Areas the benchmarks scatter synthetic drivers and riders over."""
+
+# ((latitude min, max), (longitude min, max)), roughly Greater London
+GREATER_LONDON = ((51.28, 51.70), (-0.51, 0.33))
@@ -0,0 +1,130 @@
+"""Latency of the ride history endpoint for customers with long histories.
+
+Seeds the in-memory DynamoDB stand-in with --rides rides for one customer,
+among rides of --other-customers others, then adds --storage-latency-ms
+(+/- --storage-jitter-ms) to every call and times three kinds of request:
+- first pages with a cold cache
+- first pages served from the per-container cache
+- the page --depth pages deep, reached by following cursors
+Run from the services directory:
+
+    python -m benchmarks.ride_history --rides 5000 --max-p99-ms 50
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.histogram import LatencyHistogram
+from common.cache import TTLCache
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from ride_request.app_old_v11 import (
+    RIDE_REQUESTS_TABLE,
+    RideHistoryHandler,
+    RideRequestDynamoDBStorage,
+    create_ride_indexes,
+)
+from ride_request.sharding import ScatterGatherReader
+
+
+def ride_request_body(customer_id):
+    return {
+        "customerId": customer_id,
+        "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+        "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+    }
+
+
+def seed(client, indexes, rides, other_customers):
+    storage = RideRequestDynamoDBStorage(client, indexes=indexes)
+    started_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for n in range(rides):
+        requested_at = started_at + timedelta(minutes=n)
+        storage.store(ride_request_body("customer-0"), requested_at)
+        storage.store(ride_request_body(f"customer-{1 + n % other_customers}"))
+
+
+def history_event(limit, cursor=None):
+    parameters = {"limit": str(limit)}
+    if cursor is not None:
+        parameters["cursor"] = cursor
+    return {
+        "pathParameters": {"customerId": "customer-0"},
+        "queryStringParameters": parameters,
+    }
+
+
+def timed(handler, event, requests):
+    histogram = LatencyHistogram()
+    for _ in range(requests):
+        started = time.perf_counter()
+        result = handler.handle(event, None)
+        histogram.record((time.perf_counter() - started) * 1e6)
+        if result.status_code != 200:
+            raise RuntimeError(f"History request failed: {result.error_message}")
+    return histogram
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rides", type=int, default=5000)
+    parser.add_argument("--other-customers", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=50, help="pages")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--storage-latency-ms", type=float, default=4.0)
+    parser.add_argument("--storage-jitter-ms", type=float, default=2.0)
+    parser.add_argument("--max-p99-ms", type=float)
+    args = parser.parse_args()
+
+    client = InMemoryDynamoDBClient()
+    indexes = create_ride_indexes()
+    customer_rides = next(index for index in indexes if index.attribute == "customerId")
+    seed(client, indexes, args.rides, args.other_customers)
+    client.latency = args.storage_latency_ms / 1000
+    client.latency_jitter = args.storage_jitter_ms / 1000
+
+    reader = ScatterGatherReader(client, RIDE_REQUESTS_TABLE, customer_rides)
+    # A zero TTL makes every first page a cache miss
+    uncached = RideHistoryHandler(reader, TTLCache(maxsize=1, ttl=0))
+    cached = RideHistoryHandler(reader, TTLCache())
+
+    cursor = None
+    for _ in range(args.depth):
+        cursor = uncached.handle(history_event(args.limit, cursor), None).data[
+            "nextCursor"
+        ]
+        if cursor is None:
+            sys.exit(f"Fewer than {args.depth + 1} pages; raise --rides")
+
+    print(
+        f"{args.rides} rides, {customer_rides.shard_count} shards, "
+        f"limit {args.limit}, storage {args.storage_latency_ms} ms "
+        f"+/- {args.storage_jitter_ms} ms"
+    )
+    print(f"{'request':16s} {'p50 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}")
+
+    results = {
+        "first page": timed(uncached, history_event(args.limit), args.requests),
+        "cached": timed(cached, history_event(args.limit), args.requests),
+        f"page {args.depth + 1}": timed(
+            uncached, history_event(args.limit, cursor), args.requests
+        ),
+    }
+    for label, histogram in results.items():
+        print(
+            f"{label:16s} {histogram.value_at_percentile(50) / 1000:8.2f} "
+            f"{histogram.value_at_percentile(99) / 1000:8.2f} "
+            f"{histogram.max_value / 1000:8.2f}"
+        )
+
+    if args.max_p99_ms is not None:
+        worst = max(histogram.value_at_percentile(99) for histogram in results.values())
+        if worst / 1000 > args.max_p99_ms:
+            print(f"p99 {worst / 1000:.2f} ms exceeds --max-p99-ms {args.max_p99_ms}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Per-response cost of the previous and current response formatting paths.
+
+Run from the services directory:
+
+    python -m benchmarks.serialization --number 200000
+"""
+
+import argparse
+import json
+import timeit
+
+from ride_request import serialization
+from ride_request.app_old_v11 import (
+    BadRequestResponse,
+    SuccessResponse,
+    format_lambda_response,
+)
+
+SUCCESS_DATA = {
+    "rideId": "0b7e4c1e-7d55-4f31-9a7f-0c4b1b3c1c55",
+    "status": "requested",
+    "estimatedArrivalTime": "2024-08-31T12:00:00Z",
+}
+ERROR_MESSAGE = "Missing required fields: pickupLocation"
+
+
+class LegacyHttpResponse:
+    # The response class as it was before the serializer layer
+    def __init__(self, status_code, data=None, error_message=None):
+        self.status_code = status_code
+        self.data = data
+        self.error_message = error_message
+        self.is_success = status_code < 400
+
+
+def legacy_format_lambda_response(result):
+    return {
+        "statusCode": result.status_code,
+        "body": json.dumps(
+            result.data if result.data else {"message": result.error_message}
+        ),
+        "headers": {"Content-Type": "application/json"},
+    }
+
+
+def measure(label, function, number):
+    elapsed = min(timeit.repeat(function, number=number, repeat=5))
+    print(f"{label:28s} {elapsed / number * 1e9:8.0f} ns/response")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+
+    backend = "orjson" if serialization.orjson is not None else "json"
+    print(f"backend: {backend}")
+    measure(
+        "legacy success",
+        lambda: legacy_format_lambda_response(LegacyHttpResponse(200, SUCCESS_DATA)),
+        args.number,
+    )
+    measure(
+        "current success",
+        lambda: format_lambda_response(SuccessResponse(SUCCESS_DATA)),
+        args.number,
+    )
+    measure(
+        "legacy error",
+        lambda: legacy_format_lambda_response(
+            LegacyHttpResponse(400, error_message=ERROR_MESSAGE)
+        ),
+        args.number,
+    )
+    measure(
+        "current error",
+        lambda: format_lambda_response(BadRequestResponse(ERROR_MESSAGE)),
+        args.number,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare DriverGridIndex nearest-driver queries with a brute-force scan.
+
+Run from the services directory:
+
+    python -m benchmarks.spatial_index --drivers 100000 --queries 1000
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.regions import GREATER_LONDON
+from ride_match.spatial_index import DriverGridIndex, brute_force_nearest
+
+
+def random_location(rng):
+    (lat_min, lat_max), (lon_min, lon_max) = GREATER_LONDON
+    return rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max)
+
+
+def run(driver_count, query_count, k, brute_force_queries):
+    rng = random.Random(42)
+    drivers = {f"driver-{i}": random_location(rng) for i in range(driver_count)}
+    queries = [random_location(rng) for _ in range(query_count)]
+    index = DriverGridIndex()
+
+    start = time.perf_counter()
+    for driver_id, (latitude, longitude) in drivers.items():
+        index.insert(driver_id, latitude, longitude)
+    insert_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for driver_id in drivers:
+        latitude, longitude = random_location(rng)
+        index.move(driver_id, latitude, longitude)
+        drivers[driver_id] = (latitude, longitude)
+    move_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for latitude, longitude in queries:
+        index.nearest(latitude, longitude, k)
+    grid_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for latitude, longitude in queries[:brute_force_queries]:
+        brute_force_nearest(drivers, latitude, longitude, k)
+    brute_elapsed = time.perf_counter() - start
+
+    grid_us = grid_elapsed / query_count * 1e6
+    brute_us = brute_elapsed / min(query_count, brute_force_queries) * 1e6
+    print(f"drivers: {driver_count}, k: {k}")
+    print(f"insert:      {insert_elapsed / driver_count * 1e6:10.2f} us/driver")
+    print(f"move:        {move_elapsed / driver_count * 1e6:10.2f} us/driver")
+    print(f"grid query:  {grid_us:10.1f} us")
+    print(f"brute force: {brute_us:10.1f} us")
+    print(f"speedup:     {brute_us / grid_us:10.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drivers", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--brute-force-queries", type=int, default=20)
+    args = parser.parse_args()
+    run(args.drivers, args.queries, args.k, args.brute_force_queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Event, update and lookup cost of SurgePricer.
+
+Spreads --drivers drivers and --requests ride requests over a square
+region of about --cells grid cells, then times recording the events, a
+full update of every cell's multiplier with NumPy and with the pure-Python
+fallback, and multiplier lookups. Run from the services directory:
+
+    python -m benchmarks.surge_pricing --cells 10000 --drivers 200000
+"""
+
+import argparse
+import math
+import random
+import time
+
+from ride_request.surge import SurgePricer, load_numpy
+
+
+class SteppingClock:
+    # Advances one second every `every` calls, so events span many buckets
+    def __init__(self, every):
+        self.every = every
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls // self.every
+
+
+def per_event_ns(function, items):
+    started = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - started) / len(items) * 1e9
+
+
+def timed_update(pricer, updates):
+    best = float("inf")
+    for _ in range(updates):
+        started = time.perf_counter()
+        pricer.update()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cells", type=int, default=10_000)
+    parser.add_argument("--drivers", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--updates", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    pricer = SurgePricer(clock=SteppingClock(every=5000))
+    side = math.sqrt(args.cells) * pricer.cell_size
+
+    def random_location():
+        return {
+            "latitude": 40.0 + rng.random() * side,
+            "longitude": -4.0 + rng.random() * side,
+        }
+
+    pings = [
+        (f"driver-{n % args.drivers}", random_location())
+        for n in range(args.drivers * 2)
+    ]
+    requests = [random_location() for _ in range(args.requests)]
+
+    upsert_ns = per_event_ns(
+        lambda ping: pricer.upsert(ping[0], ping[1]["latitude"], ping[1]["longitude"]),
+        pings,
+    )
+    request_ns = per_event_ns(pricer.record_request, requests)
+
+    # Loaded up front, since the pricer only does so from NUMPY_MIN_ROWS cells
+    pricer.numpy = load_numpy()
+    pricer.numpy_loaded = True
+    numpy_update = timed_update(pricer, args.updates)
+    numpy_multipliers = pricer.multipliers
+    pricer.numpy = None
+    python_update = timed_update(pricer, args.updates)
+    assert pricer.multipliers == numpy_multipliers
+
+    # Far enough out that no update is due during the lookups
+    pricer.next_update_at = float("inf")
+    lookup_ns = per_event_ns(pricer.multiplier, requests[:100_000])
+
+    surging = sum(1 for multiplier in numpy_multipliers if multiplier > 1.0)
+    print(
+        f"{len(pricer.cells)} cells, {len(pricer.drivers)} drivers, "
+        f"{args.requests} requests, {pricer.bucket_count} buckets per window"
+    )
+    print(f"upsert driver:         {upsert_ns:10.0f} ns")
+    print(f"record request:        {request_ns:10.0f} ns")
+    print(f"update (NumPy):        {numpy_update * 1000:10.2f} ms")
+    print(f"update (pure Python):  {python_update * 1000:10.2f} ms")
+    print(f"multiplier lookup:     {lookup_ns:10.0f} ns")
+    print(f"cells surging:         {surging:10d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Cost of the compiled request validator under valid and invalid load mixes.
+
+Run from the services directory:
+
+    python -m benchmarks.validation --number 200000
+"""
+
+import argparse
+import random
+import timeit
+
+from common.validation import validate_ride_request
+from ride_request.app_old_v11 import BadRequestResponse, RequestValidator
+
+VALID_BODY = {
+    "customerId": "customer-1",
+    "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+    "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+}
+INVALID_BODIES = [
+    {"customerId": "customer-1"},
+    {**VALID_BODY, "customerId": "not an id!"},
+    {**VALID_BODY, "pickupLocation": {"latitude": "51.5", "longitude": -0.1}},
+    {**VALID_BODY, "destinationLocation": {"latitude": 95, "longitude": 200}},
+]
+
+
+def legacy_validate(body):
+    # Key-presence check used before the compiled validator
+    required_fields = ["customerId", "pickupLocation", "destinationLocation"]
+    missing_fields = [field for field in required_fields if field not in body]
+
+    if missing_fields:
+        return BadRequestResponse(
+            f"Missing required fields: {', '.join(missing_fields)}"
+        )
+    return None
+
+
+def build_mix(invalid_ratio, size=1000, seed=42):
+    rng = random.Random(seed)
+    return [
+        rng.choice(INVALID_BODIES) if rng.random() < invalid_ratio else VALID_BODY
+        for _ in range(size)
+    ]
+
+
+def measure(label, function, bodies, number):
+    def run():
+        for body in bodies:
+            function(body)
+
+    loops = max(1, number // len(bodies))
+    elapsed = min(timeit.repeat(run, number=loops, repeat=5))
+    print(f"{label:34s} {elapsed / (loops * len(bodies)) * 1e9:8.0f} ns/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200_000)
+    args = parser.parse_args()
+    validator = RequestValidator()
+
+    for invalid_ratio in (0.0, 0.1, 0.5):
+        bodies = build_mix(invalid_ratio)
+        label = f"{invalid_ratio:.0%} invalid"
+        measure(f"{label} legacy presence check", legacy_validate, bodies, args.number)
+        measure(
+            f"{label} compiled function", validate_ride_request, bodies, args.number
+        )
+        measure(f"{label} RequestValidator", validator.validate, bodies, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Write units saved by coalescing bursty ride status updates.
+
+Replays a synthetic status stream through SQS-sized batches, once with an
+UpdateItem per event and once through RideStatusBatchHandler's write-behind
+buffer, against the in-memory DynamoDB stand-in. Run from the services
+directory:
+
+    python -m benchmarks.write_behind --rides 2000 --batch-size 100
+"""
+
+import argparse
+import json
+import random
+import time
+
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from common.item_schema import RIDE_STATUS_ITEM
+from common.write_behind import WriteBehindBuffer
+from ride_request.app_old_v11 import RideStatusBatchHandler
+from ride_request.ride_lifecycle import RideLifecycle
+
+LIFECYCLE = ["requested", "matched", "arriving", "in_progress", "completed"]
+
+
+def status_stream(rides, pings, concurrent_rides, seed=42):
+    # Rides progress in interleaved bursts; "arriving" repeats once per
+    # driver location ping, as apps do while the driver approaches
+    rng = random.Random(seed)
+    active = {}
+    next_ride = 0
+    clock_ms = 0
+    events = []
+
+    while next_ride < rides or active:
+        while len(active) < concurrent_rides and next_ride < rides:
+            steps = LIFECYCLE[:2] + ["arriving"] * pings + LIFECYCLE[3:]
+            active[f"ride-{next_ride}"] = iter(steps)
+            next_ride += 1
+
+        ride_id = rng.choice(list(active))
+        status = next(active[ride_id], None)
+        if status is None:
+            del active[ride_id]
+            continue
+
+        clock_ms += rng.randint(1, 50)
+        events.append({"rideId": ride_id, "status": status, "updatedAt": clock_ms})
+    return events
+
+
+def sqs_batches(events, batch_size):
+    for start in range(0, len(events), batch_size):
+        yield {
+            "Records": [
+                {"messageId": str(start + offset), "body": json.dumps(event)}
+                for offset, event in enumerate(events[start : start + batch_size])
+            ]
+        }
+
+
+def create_rides(events):
+    # Statuses update existing rides, so the rides are stored first
+    client = InMemoryDynamoDBClient()
+    for ride_id in {event["rideId"] for event in events}:
+        client.put_item(
+            TableName="RideRequests",
+            Item={"rideId": {"S": ride_id}, "status": {"S": "requested"}},
+        )
+    client.call_counts.clear()
+    return client, RideLifecycle(client)
+
+
+def run_direct(events, batch_size):
+    client, lifecycle = create_rides(events)
+    for batch in sqs_batches(events, batch_size):
+        for record in batch["Records"]:
+            body = json.loads(record["body"])
+            item = RIDE_STATUS_ITEM.marshal({**body, "reportedAt": body["updatedAt"]})
+            lifecycle.record_status(item)
+    return client, len(events)
+
+
+def run_buffered(events, batch_size):
+    client, lifecycle = create_rides(events)
+    buffer = WriteBehindBuffer(
+        client,
+        "RideRequests",
+        "rideId",
+        max_items=batch_size,
+        write_item=lifecycle.record_status,
+    )
+    handler = RideStatusBatchHandler(buffer)
+    for batch in sqs_batches(events, batch_size):
+        handler.handle(batch, None)
+    return client, buffer.stats["written"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rides", type=int, default=2000)
+    parser.add_argument("--pings", type=int, default=6)
+    parser.add_argument("--concurrent-rides", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    events = status_stream(args.rides, args.pings, args.concurrent_rides)
+    print(f"{len(events)} status events for {args.rides} rides")
+    print(f"{'strategy':12s} {'requests':>9s} {'items':>9s} {'ms':>8s}")
+
+    results = {}
+    for label, run in (("update_item", run_direct), ("write-behind", run_buffered)):
+        started = time.perf_counter()
+        client, items = run(events, args.batch_size)
+        elapsed = time.perf_counter() - started
+        requests = sum(client.call_counts.values())
+        results[label] = items
+        print(f"{label:12s} {requests:9d} {items:9d} {elapsed * 1000:8.1f}")
+
+    # Items under 1 KB cost one write unit each, batched or not
+    saved = 1 - results["write-behind"] / results["update_item"]
+    print(f"write units saved: {saved:.0%}")
+
+
+if __name__ == "__main__":
+    main()
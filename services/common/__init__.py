@@ -0,0 +1,6 @@
+"""Code shared by the ride_request, ride_match and driver_location functions.
+
+Modules here import nothing from the service packages, and the service
+packages never import each other, so each function deploys with just its
+own package and this one.
+"""
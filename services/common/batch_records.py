@@ -0,0 +1,52 @@
+import base64
+import json
+
+
+class BatchRecordHandler:
+    """Base for Lambda handlers of SQS or Kinesis record batches.
+
+    handle() parses the JSON body of each record and drops malformed ones,
+    which a redelivery would not fix. Subclasses implement process(), which
+    takes the remaining (record id, body) pairs and returns the ids of the
+    records to report in batchItemFailures for redelivery.
+    """
+
+    def handle(self, event, context):
+        records = []
+
+        for record in event.get("Records", []):
+            record_id = self.get_record_id(record)
+
+            try:
+                body = self.get_record_body(record)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Dropping malformed record {record_id}: {e}")
+                continue
+
+            records.append((record_id, body))
+
+        return {
+            "batchItemFailures": [
+                {"itemIdentifier": record_id} for record_id in self.process(records)
+            ]
+        }
+
+    def process(self, records):
+        raise NotImplementedError
+
+    @staticmethod
+    def get_record_id(record):
+        if "kinesis" in record:
+            return record["kinesis"]["sequenceNumber"]
+        return record["messageId"]
+
+    @staticmethod
+    def get_record_body(record):
+        if "kinesis" in record:
+            body = json.loads(base64.b64decode(record["kinesis"]["data"]))
+        else:
+            body = json.loads(record["body"])
+
+        if not isinstance(body, dict):
+            raise ValueError("Record body must be a JSON object")
+        return body
@@ -0,0 +1,35 @@
+import random
+import time
+
+# DynamoDB rejects BatchWriteItem calls with more than 25 put requests
+BATCH_WRITE_MAX_ITEMS = 25
+
+
+def batch_write(
+    dynamodb_client,
+    table_name,
+    requests,
+    max_retries=5,
+    base_retry_delay=0.05,
+    max_retry_delay=1.0,
+    sleep=time.sleep,
+):
+    """Writes up to BATCH_WRITE_MAX_ITEMS requests with one BatchWriteItem.
+
+    Unprocessed requests are retried up to `max_retries` times with
+    exponential backoff; those still unprocessed are returned. Errors
+    raised by the call itself propagate.
+    """
+    attempt = 0
+
+    while True:
+        response = dynamodb_client.batch_write_item(RequestItems={table_name: requests})
+        requests = response.get("UnprocessedItems", {}).get(table_name, [])
+
+        if not requests or attempt >= max_retries:
+            return requests
+
+        # Full jitter keeps concurrent retries from hitting the table together
+        delay = min(max_retry_delay, base_retry_delay * 2**attempt)
+        sleep(random.uniform(0, delay))
+        attempt += 1
@@ -0,0 +1,225 @@
+import math
+
+from common.batch_records import BatchRecordHandler
+from common.cache import TTLCache
+from common.geo import DRIVER_GRID_CELL_SIZE_DEGREES, haversine_km
+from common.item_schema import DRIVER_ITEM
+from common.validation import is_valid_id, validate_driver_ping
+from common.write_behind import FlushError
+
+# Smaller moves are GPS jitter or a crawl in traffic, not worth a write
+DEFAULT_MIN_MOVE_KM = 0.05
+# A parked driver is still written this often, so that lastSeen tells
+# drivers whose app is running from ones whose app went away
+DEFAULT_HEARTBEAT_SECONDS = 60
+DEFAULT_STATE_CACHE_SIZE = 200_000
+DEFAULT_STATE_TTL_SECONDS = 60 * 60
+
+
+class DriverState:
+    __slots__ = ("seen_at", "written_at", "latitude", "longitude", "available")
+
+    def __init__(self):
+        self.seen_at = None
+        # Last location put into the store
+        self.written_at = None
+        self.latitude = None
+        self.longitude = None
+        self.available = None
+
+
+class DriverLocationIngestor:
+    """Reduces batches of driver GPS pings to the changes that matter.
+
+    A message carries one driver's pings, {"driverId", "available",
+    "pings": [{"latitude", "longitude", "timestamp"}, ...]}. Per driver only
+    the newest ping of a batch is kept, and pings no newer than the last
+    one accepted (a retried message, or one delivered late) are dropped.
+
+    Accepted positions go to `driver_index`, e.g. ride_match's
+    DriverGridIndex, as they arrive: upserted while the driver is
+    available, removed when not. The last-known location is put into
+    `location_buffer`, a WriteBehindBuffer on the Drivers table, only when
+    the driver moved `min_move_km` or into another grid cell, changed
+    availability, or was last written `heartbeat_seconds` before. Either
+    destination may be left out.
+
+    Ordering state is per container, bounded and expiring. A stream
+    partitioned by driverId delivers each driver to one consumer, which is
+    what makes that enough.
+    """
+
+    def __init__(
+        self,
+        driver_index=None,
+        location_buffer=None,
+        min_move_km=DEFAULT_MIN_MOVE_KM,
+        heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS,
+        cell_size=None,
+        state_cache_size=DEFAULT_STATE_CACHE_SIZE,
+    ):
+        self.driver_index = driver_index
+        self.location_buffer = location_buffer
+        self.min_move_km = min_move_km
+        self.heartbeat_ms = heartbeat_seconds * 1000
+        if cell_size is None:
+            cell_size = getattr(
+                driver_index, "cell_size", DRIVER_GRID_CELL_SIZE_DEGREES
+            )
+        self.cell_size = cell_size
+        self.states = TTLCache(state_cache_size, DEFAULT_STATE_TTL_SECONDS)
+        self.stats = {
+            "received": 0,
+            "invalid": 0,
+            "superseded": 0,
+            "duplicate": 0,
+            "out_of_order": 0,
+            "indexed": 0,
+            "written": 0,
+        }
+
+    def ingest(self, messages):
+        """Applies a batch; returns the ids of drivers that could not be written."""
+        latest = self.__latest_pings(messages)
+
+        for driver_id, (timestamp, latitude, longitude, available) in latest.items():
+            state = self.states.get(driver_id)
+
+            if state is None:
+                state = DriverState()
+            elif timestamp == state.seen_at:
+                self.stats["duplicate"] += 1
+                continue
+            elif timestamp < state.seen_at:
+                self.stats["out_of_order"] += 1
+                continue
+
+            state.seen_at = timestamp
+            # Re-put on every ping so that active drivers never expire
+            self.states.put(driver_id, state)
+
+            if self.driver_index is not None:
+                if available:
+                    self.driver_index.upsert(driver_id, latitude, longitude)
+                else:
+                    self.driver_index.remove(driver_id)
+                self.stats["indexed"] += 1
+
+            if self.location_buffer is not None and self.__should_write(
+                state, timestamp, latitude, longitude, available
+            ):
+                item = DRIVER_ITEM.marshal(
+                    {
+                        "driverId": driver_id,
+                        "available": available,
+                        "location": {"latitude": latitude, "longitude": longitude},
+                        "lastSeen": timestamp,
+                    }
+                )
+                self.location_buffer.put(item, order=timestamp)
+                self.stats["written"] += 1
+                state.written_at = timestamp
+                state.latitude = latitude
+                state.longitude = longitude
+                state.available = available
+
+        return self.__flush()
+
+    def __latest_pings(self, messages):
+        # {driver id: (timestamp, latitude, longitude, available)}
+        latest = {}
+
+        for message in messages:
+            pings = message.get("pings")
+            if type(pings) is not list:
+                self.stats["received"] += 1
+                self.stats["invalid"] += 1
+                continue
+
+            self.stats["received"] += len(pings)
+            driver_id = message.get("driverId")
+            available = message.get("available", True)
+            if not is_valid_id(driver_id) or type(available) is not bool:
+                self.stats["invalid"] += len(pings)
+                continue
+
+            for ping in pings:
+                if validate_driver_ping(ping) is not None:
+                    self.stats["invalid"] += 1
+                    continue
+
+                current = latest.get(driver_id)
+                if current is not None:
+                    self.stats["superseded"] += 1
+                    if ping["timestamp"] <= current[0]:
+                        continue
+
+                latest[driver_id] = (
+                    ping["timestamp"],
+                    ping["latitude"],
+                    ping["longitude"],
+                    available,
+                )
+
+        return latest
+
+    def __should_write(self, state, timestamp, latitude, longitude, available):
+        if state.written_at is None or available != state.available:
+            return True
+        if timestamp - state.written_at >= self.heartbeat_ms:
+            return True
+        if self.__cell_of(latitude, longitude) != self.__cell_of(
+            state.latitude, state.longitude
+        ):
+            return True
+        distance = haversine_km(state.latitude, state.longitude, latitude, longitude)
+        return distance >= self.min_move_km
+
+    def __cell_of(self, latitude, longitude):
+        # Same grid as ride_match's DriverGridIndex
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def __flush(self):
+        if self.location_buffer is None:
+            return set()
+
+        try:
+            self.location_buffer.flush()
+            return set()
+        except FlushError as e:
+            # The buffer dropped them for redelivery; forgetting the pings
+            # keeps the redelivered records from counting as duplicates
+            for driver_id in e.keys:
+                self.states.delete(driver_id)
+            return set(e.keys)
+
+
+class DriverLocationBatchHandler(BatchRecordHandler):
+    """Feeds SQS or Kinesis records of driver pings to an ingestor.
+
+    Records of drivers whose location could not be written are reported in
+    batchItemFailures; malformed records are dropped.
+    """
+
+    def __init__(self, ingestor: DriverLocationIngestor):
+        self.ingestor = ingestor
+
+    def process(self, records):
+        messages = []
+        driver_by_record = {}
+
+        for record_id, body in records:
+            messages.append(body)
+            if isinstance(body.get("driverId"), str):
+                driver_by_record[record_id] = body["driverId"]
+
+        failed = self.ingestor.ingest(messages)
+
+        return [
+            record_id
+            for record_id, driver_id in driver_by_record.items()
+            if driver_id in failed
+        ]
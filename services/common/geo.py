@@ -0,0 +1,17 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+# Length of one degree of latitude (and of longitude at the equator)
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Cell size of ride_match's driver grid, which driver location ingestion
+# uses to tell moves worth writing
+DRIVER_GRID_CELL_SIZE_DEGREES = 0.01
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
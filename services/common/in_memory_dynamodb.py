@@ -0,0 +1,931 @@
+import copy
+import random
+import re
+import threading
+import time
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+
+class TableSchema:
+    def __init__(self, partition_key, sort_key=None, indexes=None):
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        # {index name: (partition key, sort key or None)}
+        self.indexes = indexes or {}
+
+
+# Tables the ride_request service uses, for DYNAMODB_BACKEND=memory
+LOCAL_TABLES = {
+    "RideRequests": TableSchema(
+        "rideId",
+        indexes={
+            "CustomerRides": ("customerIdShard", "timestamp"),
+            "RidesByStatus": ("statusShard", "timestamp"),
+        },
+    ),
+    "IdempotencyKeys": TableSchema("idempotencyKey"),
+    "Drivers": TableSchema("driverId"),
+    "SurgeSupply": TableSchema("region", "cell"),
+}
+
+
+def client_error(code, message, operation):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+def to_python(attribute):
+    # Comparable Python value for a low-level attribute value
+    if "S" in attribute:
+        return attribute["S"]
+    if "N" in attribute:
+        return Decimal(attribute["N"])
+    if "BOOL" in attribute:
+        return attribute["BOOL"]
+    if "NULL" in attribute:
+        return None
+    return attribute
+
+
+def get_path(item, path):
+    value = item.get(path[0])
+    for part in path[1:]:
+        if value is None or "M" not in value:
+            return None
+        value = value["M"].get(part)
+    return value
+
+
+class _Table:
+    def __init__(self, schema):
+        self.schema = schema
+        # {partition value: {sort value (None without a sort key): item}}
+        self.partitions = {}
+        # {index name: {partition value: {(sort value, primary key): item}}}
+        self.indexes = {name: {} for name in schema.indexes}
+        # {(index name or None, partition value): items in key order}, kept
+        # for queries until a write touches the partition
+        self.ordered = {}
+
+    def primary_key(self, item):
+        partition = item.get(self.schema.partition_key)
+        if partition is None:
+            raise client_error(
+                "ValidationException",
+                f"Missing the key {self.schema.partition_key} in the item",
+                "PutItem",
+            )
+        sort = None
+        if self.schema.sort_key is not None:
+            sort_value = item.get(self.schema.sort_key)
+            if sort_value is None:
+                raise client_error(
+                    "ValidationException",
+                    f"Missing the key {self.schema.sort_key} in the item",
+                    "PutItem",
+                )
+            sort = to_python(sort_value)
+        return to_python(partition), sort
+
+    def get(self, key):
+        partition, sort = key
+        return self.partitions.get(partition, {}).get(sort)
+
+    def put(self, key, item):
+        self.delete(key)
+        partition, sort = key
+        self.partitions.setdefault(partition, {})[sort] = item
+        self.ordered.pop((None, partition), None)
+
+        for name, (index_partition, index_sort) in self.schema.indexes.items():
+            if index_partition not in item:
+                continue
+            index_sort_value = (
+                to_python(item[index_sort]) if index_sort in item else None
+            )
+            index_partition_value = to_python(item[index_partition])
+            self.indexes[name].setdefault(index_partition_value, {})[
+                (index_sort_value, key)
+            ] = item
+            self.ordered.pop((name, index_partition_value), None)
+
+    def delete(self, key):
+        partition, sort = key
+        items = self.partitions.get(partition)
+        if not items or sort not in items:
+            return None
+
+        item = items.pop(sort)
+        if not items:
+            del self.partitions[partition]
+        self.ordered.pop((None, partition), None)
+
+        for name, (index_partition, index_sort) in self.schema.indexes.items():
+            if index_partition not in item:
+                continue
+            index_partition_value = to_python(item[index_partition])
+            index_items = self.indexes[name][index_partition_value]
+            index_sort_value = (
+                to_python(item[index_sort]) if index_sort in item else None
+            )
+            del index_items[(index_sort_value, key)]
+            if not index_items:
+                del self.indexes[name][index_partition_value]
+            self.ordered.pop((name, index_partition_value), None)
+
+        return item
+
+
+class _ExpressionParser:
+    """Recursive-descent parser for the DynamoDB expression subset we use.
+
+    Conditions: comparisons (= <> < <= > >=), BETWEEN, IN, attribute_exists,
+    attribute_not_exists, begins_with, AND, OR, NOT and parentheses.
+    Updates: SET path = operand [+|- operand], if_not_exists, and REMOVE.
+    """
+
+    TOKEN = re.compile(
+        r"\s*(?:(?P<name>#\w+)|(?P<value>:\w+)|(?P<op><>|<=|>=|[=<>(),+\-.])"
+        r"|(?P<word>[A-Za-z_]\w*))"
+    )
+
+    def __init__(self, expression, names=None, values=None):
+        self.tokens = self.__tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def __tokenize(self, expression):
+        tokens = []
+        position = 0
+        expression = expression.strip()
+        while position < len(expression):
+            match = self.TOKEN.match(expression, position)
+            if not match or match.end() == position:
+                raise client_error(
+                    "ValidationException",
+                    f"Invalid expression near: {expression[position:]}",
+                    "Expression",
+                )
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        return tokens
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token[0] is None or (expected is not None and token[1] != expected):
+            raise client_error(
+                "ValidationException",
+                f"Expected {expected!r} but found {token[1]!r}",
+                "Expression",
+            )
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        kind, text = self.peek()
+        if kind == "word" and text.upper() == word:
+            self.position += 1
+            return True
+        return False
+
+    def parse_condition(self):
+        node = self.__or()
+        if self.peek()[0] is not None:
+            raise client_error(
+                "ValidationException",
+                f"Unexpected token {self.peek()[1]!r}",
+                "Expression",
+            )
+        return node
+
+    def parse_update(self):
+        actions = []
+        while self.peek()[0] is not None:
+            if self.keyword("SET"):
+                while True:
+                    path = self.__path()
+                    self.take("=")
+                    actions.append(("set", path, self.__update_value()))
+                    if self.peek()[1] != ",":
+                        break
+                    self.take(",")
+            elif self.keyword("REMOVE"):
+                while True:
+                    actions.append(("remove", self.__path()))
+                    if self.peek()[1] != ",":
+                        break
+                    self.take(",")
+            else:
+                raise client_error(
+                    "ValidationException",
+                    f"Unsupported update clause {self.peek()[1]!r}",
+                    "UpdateItem",
+                )
+        return actions
+
+    def __or(self):
+        node = self.__and()
+        while self.keyword("OR"):
+            node = ("or", node, self.__and())
+        return node
+
+    def __and(self):
+        node = self.__not()
+        while self.keyword("AND"):
+            node = ("and", node, self.__not())
+        return node
+
+    def __not(self):
+        if self.keyword("NOT"):
+            return ("not", self.__not())
+        return self.__primary()
+
+    def __primary(self):
+        kind, text = self.peek()
+
+        if text == "(":
+            self.take("(")
+            node = self.__or()
+            self.take(")")
+            return node
+
+        if kind == "word" and text in (
+            "attribute_exists",
+            "attribute_not_exists",
+            "begins_with",
+        ):
+            self.take()
+            self.take("(")
+            arguments = [self.__operand()]
+            while self.peek()[1] == ",":
+                self.take(",")
+                arguments.append(self.__operand())
+            self.take(")")
+            return ("function", text, arguments)
+
+        left = self.__operand()
+        if self.keyword("BETWEEN"):
+            low = self.__operand()
+            if not self.keyword("AND"):
+                raise client_error(
+                    "ValidationException", "BETWEEN needs AND", "Expression"
+                )
+            return ("between", left, low, self.__operand())
+
+        if self.keyword("IN"):
+            self.take("(")
+            candidates = [self.__operand()]
+            while self.peek()[1] == ",":
+                self.take(",")
+                candidates.append(self.__operand())
+            self.take(")")
+            return ("in", left, candidates)
+
+        _, operator = self.take()
+        if operator not in ("=", "<>", "<", "<=", ">", ">="):
+            raise client_error(
+                "ValidationException", f"Unknown operator {operator!r}", "Expression"
+            )
+        return ("compare", operator, left, self.__operand())
+
+    def __update_value(self):
+        node = self.__update_operand()
+        if self.peek()[1] in ("+", "-"):
+            _, operator = self.take()
+            return ("arithmetic", operator, node, self.__update_operand())
+        return node
+
+    def __update_operand(self):
+        kind, text = self.peek()
+        if kind == "word" and text == "if_not_exists":
+            self.take()
+            self.take("(")
+            path = self.__path()
+            self.take(",")
+            default = self.__operand()
+            self.take(")")
+            return ("if_not_exists", path, default)
+        return self.__operand()
+
+    def __operand(self):
+        kind, text = self.peek()
+        if kind == "value":
+            self.take()
+            if text not in self.values:
+                raise client_error(
+                    "ValidationException",
+                    f"Value {text} is not defined in ExpressionAttributeValues",
+                    "Expression",
+                )
+            return ("value", self.values[text])
+        return self.__path()
+
+    def __path(self):
+        parts = [self.__path_part()]
+        while self.peek()[1] == ".":
+            self.take(".")
+            parts.append(self.__path_part())
+        return ("path", parts)
+
+    def __path_part(self):
+        kind, text = self.take()
+        if kind == "name":
+            if text not in self.names:
+                raise client_error(
+                    "ValidationException",
+                    f"Name {text} is not defined in ExpressionAttributeNames",
+                    "Expression",
+                )
+            return self.names[text]
+        if kind == "word":
+            return text
+        raise client_error(
+            "ValidationException", f"Expected an attribute, got {text!r}", "Expression"
+        )
+
+
+def resolve(operand, item):
+    if operand[0] == "value":
+        return operand[1]
+    return get_path(item, operand[1])
+
+
+def evaluate(node, item):
+    kind = node[0]
+
+    if kind == "and":
+        return evaluate(node[1], item) and evaluate(node[2], item)
+    if kind == "or":
+        return evaluate(node[1], item) or evaluate(node[2], item)
+    if kind == "not":
+        return not evaluate(node[1], item)
+    if kind == "function":
+        name, arguments = node[1], node[2]
+        if name == "attribute_exists":
+            return resolve(arguments[0], item) is not None
+        if name == "attribute_not_exists":
+            return resolve(arguments[0], item) is None
+        value = resolve(arguments[0], item)
+        prefix = resolve(arguments[1], item)
+        return (
+            value is not None
+            and "S" in value
+            and prefix is not None
+            and value["S"].startswith(prefix["S"])
+        )
+    if kind == "between":
+        value = resolve(node[1], item)
+        if value is None:
+            return False
+        low = to_python(resolve(node[2], item))
+        high = to_python(resolve(node[3], item))
+        return low <= to_python(value) <= high
+    if kind == "in":
+        value = resolve(node[1], item)
+        if value is None:
+            return False
+        value = to_python(value)
+        return any(
+            to_python(resolve(candidate, item)) == value for candidate in node[2]
+        )
+
+    operator, left, right = node[1], resolve(node[2], item), resolve(node[3], item)
+    if left is None or right is None:
+        return operator == "<>" and (left is None) != (right is None)
+
+    left, right = to_python(left), to_python(right)
+    try:
+        if operator == "=":
+            return left == right
+        if operator == "<>":
+            return left != right
+        if operator == "<":
+            return left < right
+        if operator == "<=":
+            return left <= right
+        if operator == ">":
+            return left > right
+        return left >= right
+    except TypeError:
+        return False
+
+
+def conjuncts(node):
+    if node[0] == "and":
+        return conjuncts(node[1]) + conjuncts(node[2])
+    return [node]
+
+
+class InMemoryDynamoDBClient:
+    """Thread-safe in-process stand-in for the low-level DynamoDB client.
+
+    Implements put_item, get_item, delete_item, update_item, query,
+    batch_write_item and transact_write_items (puts, deletes and condition
+    checks) with condition expressions, raising the same ClientError codes
+    as botocore. `latency` (plus up to `latency_jitter`)
+    seconds are slept per call outside the lock, and `throttle_rate` is the
+    chance that a call (or, for batch writes, an item) is throttled.
+    """
+
+    def __init__(
+        self,
+        tables=None,
+        latency=0.0,
+        latency_jitter=0.0,
+        throttle_rate=0.0,
+        seed=None,
+        sleep=time.sleep,
+    ):
+        self.tables = {
+            name: _Table(schema) for name, schema in (tables or LOCAL_TABLES).items()
+        }
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        self.call_counts = {}
+        self.lock = threading.RLock()
+
+    def create_table(self, name, schema):
+        with self.lock:
+            self.tables[name] = _Table(schema)
+
+    def put_item(
+        self,
+        TableName,
+        Item,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        ReturnValuesOnConditionCheckFailure="NONE",
+    ):
+        self.__call("PutItem")
+        condition = self.__condition(
+            ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues
+        )
+
+        with self.lock:
+            table = self.__table(TableName, "PutItem")
+            key = table.primary_key(Item)
+            existing = table.get(key)
+            self.__check(
+                condition, existing, "PutItem", ReturnValuesOnConditionCheckFailure
+            )
+            table.put(key, copy.deepcopy(Item))
+
+        if ReturnValues == "ALL_OLD" and existing is not None:
+            return {"Attributes": copy.deepcopy(existing)}
+        return {}
+
+    def get_item(
+        self,
+        TableName,
+        Key,
+        ConsistentRead=False,
+        ProjectionExpression=None,
+        ExpressionAttributeNames=None,
+    ):
+        self.__call("GetItem")
+
+        with self.lock:
+            table = self.__table(TableName, "GetItem")
+            item = table.get(table.primary_key(Key))
+            item = copy.deepcopy(item) if item is not None else None
+
+        if item is None:
+            return {}
+        return {
+            "Item": self.__project(item, ProjectionExpression, ExpressionAttributeNames)
+        }
+
+    def delete_item(
+        self,
+        TableName,
+        Key,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        ReturnValuesOnConditionCheckFailure="NONE",
+    ):
+        self.__call("DeleteItem")
+        condition = self.__condition(
+            ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues
+        )
+
+        with self.lock:
+            table = self.__table(TableName, "DeleteItem")
+            key = table.primary_key(Key)
+            self.__check(
+                condition,
+                table.get(key),
+                "DeleteItem",
+                ReturnValuesOnConditionCheckFailure,
+            )
+            existing = table.delete(key)
+
+        if ReturnValues == "ALL_OLD" and existing is not None:
+            return {"Attributes": existing}
+        return {}
+
+    def update_item(
+        self,
+        TableName,
+        Key,
+        UpdateExpression,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+        ReturnValuesOnConditionCheckFailure="NONE",
+    ):
+        self.__call("UpdateItem")
+        condition = self.__condition(
+            ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues
+        )
+        actions = _ExpressionParser(
+            UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues
+        ).parse_update()
+
+        with self.lock:
+            table = self.__table(TableName, "UpdateItem")
+            key = table.primary_key(Key)
+            existing = table.get(key)
+            self.__check(
+                condition, existing, "UpdateItem", ReturnValuesOnConditionCheckFailure
+            )
+
+            item = copy.deepcopy(existing) if existing is not None else dict(Key)
+            for action in actions:
+                self.__apply(action, item)
+
+            if table.primary_key(item) != key:
+                raise client_error(
+                    "ValidationException",
+                    "Cannot update attribute that is part of the key",
+                    "UpdateItem",
+                )
+            table.put(key, item)
+
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": copy.deepcopy(item)}
+        if ReturnValues == "ALL_OLD" and existing is not None:
+            return {"Attributes": copy.deepcopy(existing)}
+        return {}
+
+    def query(
+        self,
+        TableName,
+        KeyConditionExpression,
+        ExpressionAttributeValues,
+        ExpressionAttributeNames=None,
+        IndexName=None,
+        FilterExpression=None,
+        ProjectionExpression=None,
+        ScanIndexForward=True,
+        Limit=None,
+        ExclusiveStartKey=None,
+        ConsistentRead=False,
+        Select=None,
+    ):
+        self.__call("Query")
+        key_condition = _ExpressionParser(
+            KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues
+        ).parse_condition()
+        filter_condition = self.__condition(
+            FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues
+        )
+
+        with self.lock:
+            table = self.__table(TableName, "Query")
+            if IndexName is not None:
+                if IndexName not in table.schema.indexes:
+                    raise client_error(
+                        "ValidationException",
+                        f"The table does not have the specified index: {IndexName}",
+                        "Query",
+                    )
+                partition_key, sort_key = table.schema.indexes[IndexName]
+                partitions = table.indexes[IndexName]
+            else:
+                partition_key, sort_key = (
+                    table.schema.partition_key,
+                    table.schema.sort_key,
+                )
+                partitions = table.partitions
+
+            partition_value, sort_conditions = self.__split_key_condition(
+                key_condition, partition_key
+            )
+            ordered = table.ordered.get((IndexName, partition_value))
+            if ordered is None:
+                entries = partitions.get(partition_value, {})
+                if IndexName is not None:
+                    ordered = sorted(entries.items(), key=self.__index_order)
+                else:
+                    ordered = sorted(
+                        entries.items(), key=lambda entry: self.__sort_order(entry[0])
+                    )
+                ordered = table.ordered[(IndexName, partition_value)] = [
+                    item for _, item in ordered
+                ]
+            # Stored items are replaced, never changed in place, so they are
+            # only copied below once the page is known
+            items = list(ordered)
+
+        if not ScanIndexForward:
+            items.reverse()
+        if sort_conditions:
+            items = [
+                item
+                for item in items
+                if all(evaluate(condition, item) for condition in sort_conditions)
+            ]
+
+        if ExclusiveStartKey is not None:
+            items = self.__after(
+                items, ExclusiveStartKey, table, IndexName, ScanIndexForward
+            )
+
+        # Like DynamoDB, a page that reaches the limit carries a key even
+        # when nothing follows it; the next page is then empty
+        last_evaluated_key = None
+        if Limit is not None and len(items) >= Limit:
+            items = items[:Limit]
+            last = items[-1]
+            key_names = {table.schema.partition_key, table.schema.sort_key}
+            key_names |= {partition_key, sort_key}
+            last_evaluated_key = {
+                name: last[name] for name in key_names if name and name in last
+            }
+
+        scanned = len(items)
+        if filter_condition is not None:
+            items = [item for item in items if evaluate(filter_condition, item)]
+
+        response = {"Count": len(items), "ScannedCount": scanned}
+        if Select != "COUNT":
+            response["Items"] = [
+                copy.deepcopy(
+                    self.__project(item, ProjectionExpression, ExpressionAttributeNames)
+                )
+                for item in items
+            ]
+        if last_evaluated_key is not None:
+            response["LastEvaluatedKey"] = last_evaluated_key
+        return response
+
+    def batch_write_item(self, RequestItems):
+        self.__call("BatchWriteItem")
+        unprocessed = {}
+
+        with self.lock:
+            for table_name, requests in RequestItems.items():
+                table = self.__table(table_name, "BatchWriteItem")
+                if len(requests) > 25:
+                    raise client_error(
+                        "ValidationException",
+                        "Too many items requested for the BatchWriteItem call",
+                        "BatchWriteItem",
+                    )
+                for request in requests:
+                    if self.__throttled():
+                        unprocessed.setdefault(table_name, []).append(request)
+                    elif "PutRequest" in request:
+                        item = request["PutRequest"]["Item"]
+                        table.put(table.primary_key(item), copy.deepcopy(item))
+                    else:
+                        table.delete(table.primary_key(request["DeleteRequest"]["Key"]))
+
+        return {"UnprocessedItems": unprocessed}
+
+    def transact_write_items(self, TransactItems):
+        # Every condition is checked before anything is written, so the
+        # items are written together or not at all
+        self.__call("TransactWriteItems")
+        if len(TransactItems) > 100:
+            raise client_error(
+                "ValidationException",
+                "Member must have length less than or equal to 100",
+                "TransactWriteItems",
+            )
+
+        with self.lock:
+            writes = []
+            reasons = []
+            for entry in TransactItems:
+                ((action, request),) = entry.items()
+                if action not in ("Put", "Delete", "ConditionCheck"):
+                    raise client_error(
+                        "ValidationException",
+                        f"Unsupported transaction action: {action}",
+                        "TransactWriteItems",
+                    )
+                table = self.__table(request["TableName"], "TransactWriteItems")
+                key = table.primary_key(request.get("Item") or request["Key"])
+                condition = self.__condition(
+                    request.get("ConditionExpression"),
+                    request.get("ExpressionAttributeNames"),
+                    request.get("ExpressionAttributeValues"),
+                )
+                if condition is None or evaluate(condition, table.get(key) or {}):
+                    reasons.append({"Code": "None"})
+                else:
+                    reasons.append(
+                        {
+                            "Code": "ConditionalCheckFailed",
+                            "Message": "The conditional request failed",
+                        }
+                    )
+                writes.append((action, request, table, key))
+
+            if any(reason["Code"] != "None" for reason in reasons):
+                error = client_error(
+                    "TransactionCanceledException",
+                    "Transaction cancelled, please refer cancellation reasons for "
+                    "specific reasons",
+                    "TransactWriteItems",
+                )
+                error.response["CancellationReasons"] = reasons
+                raise error
+
+            for action, request, table, key in writes:
+                if action == "Put":
+                    table.put(key, copy.deepcopy(request["Item"]))
+                elif action == "Delete":
+                    table.delete(key)
+
+        return {}
+
+    def item_count(self, table_name):
+        with self.lock:
+            return sum(
+                len(items) for items in self.tables[table_name].partitions.values()
+            )
+
+    def __call(self, operation):
+        with self.lock:
+            self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+            delay = self.latency
+            if self.latency_jitter:
+                delay += self.random.uniform(0, self.latency_jitter)
+            throttled = operation != "BatchWriteItem" and self.__throttled()
+
+        if delay > 0:
+            self.sleep(delay)
+        if throttled:
+            raise client_error(
+                "ProvisionedThroughputExceededException",
+                "The level of configured provisioned throughput for the table "
+                "was exceeded",
+                operation,
+            )
+
+    def __throttled(self):
+        return self.throttle_rate > 0 and self.random.random() < self.throttle_rate
+
+    def __table(self, name, operation):
+        if name not in self.tables:
+            raise client_error(
+                "ResourceNotFoundException",
+                f"Requested resource not found: Table: {name} not found",
+                operation,
+            )
+        return self.tables[name]
+
+    @staticmethod
+    def __condition(expression, names, values):
+        if expression is None:
+            return None
+        return _ExpressionParser(expression, names, values).parse_condition()
+
+    @staticmethod
+    def __check(condition, existing, operation, return_values="NONE"):
+        if condition is not None and not evaluate(condition, existing or {}):
+            error = client_error(
+                "ConditionalCheckFailedException",
+                "The conditional request failed",
+                operation,
+            )
+            if return_values == "ALL_OLD" and existing is not None:
+                error.response["Item"] = copy.deepcopy(existing)
+            raise error
+
+    @staticmethod
+    def __apply(action, item):
+        if action[0] == "remove":
+            parts = action[1][1]
+            target = item
+            for part in parts[:-1]:
+                target = target.get(part, {}).get("M", {})
+            target.pop(parts[-1], None)
+            return
+
+        parts = action[1][1]
+        value = InMemoryDynamoDBClient.__update_value(action[2], item)
+        target = item
+        for part in parts[:-1]:
+            target = target.setdefault(part, {"M": {}})["M"]
+        target[parts[-1]] = copy.deepcopy(value)
+
+    @staticmethod
+    def __update_value(node, item):
+        if node[0] == "if_not_exists":
+            existing = get_path(item, node[1][1])
+            return existing if existing is not None else node[2][1]
+        if node[0] == "arithmetic":
+            left = InMemoryDynamoDBClient.__update_value(node[2], item)
+            right = InMemoryDynamoDBClient.__update_value(node[3], item)
+            if left is None or right is None or "N" not in left or "N" not in right:
+                raise client_error(
+                    "ValidationException",
+                    "An operand in the update expression has an incorrect data type",
+                    "UpdateItem",
+                )
+            left, right = Decimal(left["N"]), Decimal(right["N"])
+            return {"N": str(left + right if node[1] == "+" else left - right)}
+        return resolve(node, item)
+
+    @staticmethod
+    def __split_key_condition(key_condition, partition_key):
+        partition_value = None
+        sort_conditions = []
+        for condition in conjuncts(key_condition):
+            if (
+                condition[0] == "compare"
+                and condition[1] == "="
+                and condition[2] == ("path", [partition_key])
+                and condition[3][0] == "value"
+            ):
+                partition_value = to_python(condition[3][1])
+            else:
+                sort_conditions.append(condition)
+
+        if partition_value is None:
+            raise client_error(
+                "ValidationException",
+                f"Query condition missed key schema element: {partition_key}",
+                "Query",
+            )
+        return partition_value, sort_conditions
+
+    @staticmethod
+    def __sort_order(value):
+        # Items without a sort key share None; keep the sort total
+        return (value is not None, value if value is not None else 0)
+
+    @staticmethod
+    def __index_order(entry):
+        (sort_value, primary_key), _ = entry
+        return (
+            InMemoryDynamoDBClient.__sort_order(sort_value),
+            InMemoryDynamoDBClient.__sort_order(primary_key[0]),
+            InMemoryDynamoDBClient.__sort_order(primary_key[1]),
+        )
+
+    @staticmethod
+    def __key_order(item, table, index_name):
+        # Position of an item (or a key naming one) in query order
+        partition, sort = table.primary_key(item)
+        if index_name is None:
+            return InMemoryDynamoDBClient.__sort_order(sort)
+        index_sort = table.schema.indexes[index_name][1]
+        index_sort_value = to_python(item[index_sort]) if index_sort in item else None
+        return InMemoryDynamoDBClient.__index_order(
+            ((index_sort_value, (partition, sort)), item)
+        )
+
+    @staticmethod
+    def __after(items, start_key, table, index_name, forward):
+        # Compares positions rather than looking the key up, so pages go on
+        # where they left off even if the start key's item was deleted
+        key_order = InMemoryDynamoDBClient.__key_order
+        start = key_order(start_key, table, index_name)
+        if forward:
+            return [
+                item for item in items if key_order(item, table, index_name) > start
+            ]
+        return [item for item in items if key_order(item, table, index_name) < start]
+
+    @staticmethod
+    def __project(item, projection, names):
+        if projection is None:
+            return item
+
+        names = names or {}
+        projected = {}
+        for path in projection.split(","):
+            name = path.strip()
+            name = names.get(name, name)
+            if name in item:
+                projected[name] = item[name]
+        return projected
@@ -0,0 +1,216 @@
+import math
+from decimal import Decimal
+
+
+class StringAttribute:
+    def __init__(self, required=False):
+        self.required = required
+
+    def marshal(self, value, path):
+        if type(value) is str:
+            return {"S": value} if value else None
+        if value is not None or self.required:
+            raise invalid_value(path, value)
+        return None
+
+    def unmarshal(self, value):
+        return value["S"]
+
+
+class NumberAttribute:
+    def __init__(self, required=False):
+        self.required = required
+
+    def marshal(self, value, path):
+        if value is None:
+            if self.required:
+                raise KeyError(path)
+            return None
+        return {"N": format_number(value)}
+
+    def unmarshal(self, value):
+        return parse_number(value["N"])
+
+
+class BooleanAttribute:
+    def __init__(self, required=False):
+        self.required = required
+
+    def marshal(self, value, path):
+        if value is None:
+            if self.required:
+                raise KeyError(path)
+            return None
+        return {"BOOL": bool(value)}
+
+    def unmarshal(self, value):
+        return value["BOOL"]
+
+
+class MapAttribute:
+    def __init__(self, attributes, required=False):
+        self.attributes = attributes
+        self.required = required
+
+    def marshal(self, value, path):
+        # Required maps are entered even when empty so that their required
+        # attributes raise KeyError
+        if value is None and self.required:
+            raise KeyError(path)
+        if not value and not self.required:
+            return None
+        item = marshal_attributes(self.attributes, value, f"{path}.")
+        return {"M": item} if item else None
+
+    def unmarshal(self, value):
+        return unmarshal_attributes(self.attributes, value["M"])
+
+
+def format_number(value):
+    # DynamoDB numbers travel as strings; repr() is the shortest string that
+    # round-trips a float exactly, unlike str() on older Pythons or "%f"
+    value_type = type(value)
+
+    if value_type is float:
+        if not math.isfinite(value):
+            raise ValueError(f"DynamoDB numbers must be finite, got {value!r}")
+        return repr(value)
+    if value_type is int:
+        return str(value)
+    if value_type is Decimal:
+        if not value.is_finite():
+            raise ValueError(f"DynamoDB numbers must be finite, got {value!r}")
+        return str(value)
+    raise TypeError(f"Expected a number, got {value_type.__name__}")
+
+
+def invalid_value(path, value):
+    # The error for a string attribute that is missing or not a string
+    if value is None:
+        return KeyError(path)
+    return TypeError(f"Expected a string for {path}, got {type(value).__name__}")
+
+
+def parse_number(text):
+    if "." in text or "e" in text or "E" in text:
+        return float(text)
+    return int(text)
+
+
+def marshal_attributes(attributes, data, prefix=""):
+    item = {}
+    for name, attribute in attributes.items():
+        value = attribute.marshal(data.get(name), f"{prefix}{name}")
+        if value is not None:
+            item[name] = value
+    return item
+
+
+def unmarshal_attributes(attributes, item):
+    data = {}
+    for name, attribute in attributes.items():
+        value = item.get(name)
+        if value is not None:
+            data[name] = attribute.unmarshal(value)
+    return data
+
+
+class ItemSchema:
+    """Declarative DynamoDB item layout.
+
+    marshal(data) builds the low-level {"S": ...}/{"N": ...} item. None,
+    empty strings and maps with nothing to store are skipped. A missing
+    required attribute raises KeyError, a badly typed string or number
+    TypeError or ValueError. unmarshal(item) reverses it and ignores
+    attributes outside the schema.
+    """
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def marshal(self, data):
+        return marshal_attributes(self.attributes, data)
+
+    def unmarshal(self, item):
+        return unmarshal_attributes(self.attributes, item)
+
+
+LOCATION_ATTRIBUTES = {
+    "latitude": NumberAttribute(required=True),
+    "longitude": NumberAttribute(required=True),
+}
+
+RIDE_REQUEST_ITEM = ItemSchema(
+    {
+        "rideId": StringAttribute(required=True),
+        "customerId": StringAttribute(required=True),
+        "pickupLocation": MapAttribute(LOCATION_ATTRIBUTES, required=True),
+        "destinationLocation": MapAttribute(LOCATION_ATTRIBUTES, required=True),
+        "status": StringAttribute(),
+        "timestamp": StringAttribute(),
+    }
+)
+
+RIDE_STATUS_ITEM = ItemSchema(
+    {
+        "rideId": StringAttribute(required=True),
+        "status": StringAttribute(required=True),
+        # Epoch milliseconds of the status change at the source, kept apart
+        # from the ride's updatedAt, which is the time of the last write
+        "reportedAt": NumberAttribute(required=True),
+        "driverId": StringAttribute(),
+    }
+)
+
+# What a customer sees of a ride in their history. Kept apart from
+# RIDE_REQUEST_ITEM, whose marshaller takes request bodies and so must not
+# accept lifecycle attributes such as driverId from clients
+RIDE_SUMMARY_ITEM = ItemSchema(
+    {
+        "rideId": StringAttribute(required=True),
+        "status": StringAttribute(),
+        "timestamp": StringAttribute(),
+        "pickupLocation": MapAttribute(LOCATION_ATTRIBUTES),
+        "destinationLocation": MapAttribute(LOCATION_ATTRIBUTES),
+        "driverId": StringAttribute(),
+        "version": NumberAttribute(),
+    }
+)
+
+DRIVER_ITEM = ItemSchema(
+    {
+        "driverId": StringAttribute(required=True),
+        "status": StringAttribute(),
+        "available": BooleanAttribute(),
+        "location": MapAttribute(LOCATION_ATTRIBUTES),
+        "lastSeen": NumberAttribute(),
+    }
+)
+
+
+def build_ride_request_item(body, ride_id, status, timestamp):
+    # Written out for the hot path rather than marshalled through
+    # RIDE_REQUEST_ITEM: it runs once per ride request on bodies
+    # RequestValidator has already accepted, so the schema's type checks
+    # would only repeat its work. repr() keeps floats exact, as in
+    # format_number. test_item_schema checks it against the schema
+    pickup = body["pickupLocation"]
+    destination = body["destinationLocation"]
+    return {
+        "rideId": {"S": ride_id},
+        "customerId": {"S": body["customerId"]},
+        "pickupLocation": {
+            "M": {
+                "latitude": {"N": repr(pickup["latitude"])},
+                "longitude": {"N": repr(pickup["longitude"])},
+            }
+        },
+        "destinationLocation": {
+            "M": {
+                "latitude": {"N": repr(destination["latitude"])},
+                "longitude": {"N": repr(destination["longitude"])},
+            }
+        },
+        "status": {"S": status},
+        "timestamp": {"S": timestamp},
+    }
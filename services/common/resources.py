@@ -0,0 +1,136 @@
+import os
+import threading
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+def get_max_pool_connections():
+    return int(
+        os.environ.get("DYNAMODB_MAX_POOL_CONNECTIONS", DEFAULT_MAX_POOL_CONNECTIONS)
+    )
+
+
+def create_dynamodb_client(max_pool_connections=None):
+    # DYNAMODB_BACKEND=memory swaps in the in-process stand-in for local load
+    # tests and failure drills; it honours the same latency/throttle knobs
+    if os.environ.get("DYNAMODB_BACKEND") == "memory":
+        return create_in_memory_client()
+
+    # boto3 and botocore account for most of the import time of a cold start,
+    # so they are only loaded once a client is actually needed
+    import boto3
+    from botocore.config import Config
+
+    # Keep-alive connection pool shared by every invocation in the container
+    config = Config(
+        max_pool_connections=max_pool_connections or get_max_pool_connections(),
+        tcp_keepalive=True,
+        retries={"mode": "standard"},
+    )
+    return boto3.client("dynamodb", config=config)
+
+
+def create_in_memory_client():
+    from common.in_memory_dynamodb import InMemoryDynamoDBClient
+
+    return InMemoryDynamoDBClient(
+        latency=float(os.environ.get("MEMORY_DYNAMODB_LATENCY_SECONDS", 0)),
+        latency_jitter=float(os.environ.get("MEMORY_DYNAMODB_JITTER_SECONDS", 0)),
+        throttle_rate=float(os.environ.get("MEMORY_DYNAMODB_THROTTLE_RATE", 0)),
+    )
+
+
+class LazyClient:
+    """Defers building a client (and importing its SDK) until first use.
+
+    Attribute access is forwarded to the client, which `factory` builds on
+    the first call, so requests that never reach storage (invalid bodies,
+    oversized payloads) do not pay for loading boto3.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._client is not None
+
+    def __getattr__(self, name):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return getattr(client, name)
+
+
+class ResourceRegistry:
+    """Lazily builds resources once per execution environment.
+
+    A factory receives the registry so it can ask for its own dependencies;
+    invalidating a resource also drops everything that was built from it.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._dependents = {}
+        self._local = threading.local()
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self.invalidate(name)
+
+    def get(self, name):
+        instance = self._instances.get(name)
+
+        if instance is not None:
+            # Warm lookups happen outside any factory, with nothing to record
+            if getattr(self._local, "stack", None):
+                self._record_dependency(name)
+            return instance
+
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f"No factory registered for resource: {name}")
+
+                building = self._building_stack()
+                building.append(name)
+                try:
+                    self._instances[name] = self._factories[name](self)
+                finally:
+                    building.pop()
+
+            self._record_dependency(name)
+            return self._instances[name]
+
+    def invalidate(self, name):
+        with self._lock:
+            self._instances.pop(name, None)
+
+            for dependent in self._dependents.pop(name, ()):
+                self.invalidate(dependent)
+
+    def reset(self):
+        with self._lock:
+            self._instances.clear()
+            self._dependents.clear()
+
+    def is_built(self, name):
+        return name in self._instances
+
+    def _building_stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record_dependency(self, name):
+        building = self._building_stack()
+        if building:
+            self._dependents.setdefault(name, set()).add(building[-1])
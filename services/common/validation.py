@@ -0,0 +1,192 @@
+import itertools
+import re
+
+# Longest raw request body accepted, in characters
+MAX_BODY_LENGTH = 8 * 1024
+ID_PATTERN = r"[A-Za-z0-9][A-Za-z0-9_-]{0,127}"
+RIDE_STATUSES = (
+    "requested",
+    "matched",
+    "arriving",
+    "in_progress",
+    "completed",
+    "cancelled",
+)
+# Epoch milliseconds; 2**53 keeps them exact as JSON numbers
+MAX_TIMESTAMP_MS = 2**53
+
+
+class StringField:
+    def __init__(self, pattern=None, description="a string"):
+        self.pattern = pattern
+        self.description = description
+
+
+class NumberField:
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+
+
+class ObjectField:
+    def __init__(self, fields):
+        self.fields = fields
+
+
+LOCATION_SCHEMA = ObjectField(
+    {
+        "latitude": NumberField(-90, 90),
+        "longitude": NumberField(-180, 180),
+    }
+)
+
+RIDE_REQUEST_SCHEMA = ObjectField(
+    {
+        "customerId": StringField(ID_PATTERN, "an id of letters, digits, - or _"),
+        "pickupLocation": LOCATION_SCHEMA,
+        "destinationLocation": LOCATION_SCHEMA,
+    }
+)
+
+RIDE_STATUS_EVENT_SCHEMA = ObjectField(
+    {
+        "rideId": StringField(ID_PATTERN, "an id of letters, digits, - or _"),
+        "status": StringField(
+            "|".join(RIDE_STATUSES), f"one of {', '.join(RIDE_STATUSES)}"
+        ),
+        "updatedAt": NumberField(0, MAX_TIMESTAMP_MS),
+    }
+)
+
+RIDE_ACCEPT_SCHEMA = ObjectField(
+    {
+        "driverId": StringField(ID_PATTERN, "an id of letters, digits, - or _"),
+    }
+)
+
+FARE_ESTIMATE_SCHEMA = ObjectField(
+    {
+        "pickupLocation": LOCATION_SCHEMA,
+        "destinationLocation": LOCATION_SCHEMA,
+    }
+)
+
+DRIVER_PING_SCHEMA = ObjectField(
+    {
+        **LOCATION_SCHEMA.fields,
+        # Epoch milliseconds of the GPS fix on the device
+        "timestamp": NumberField(0, MAX_TIMESTAMP_MS),
+    }
+)
+
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+
+def _add_error(errors, path, message):
+    if errors is None:
+        errors = []
+    errors.append((path, message))
+    return errors
+
+
+def compile_validator(schema):
+    """Compile a schema into one straight-line validation function.
+
+    The generated function takes a parsed body and returns None when it is
+    valid, so the success path allocates nothing. Otherwise it returns every
+    (field path, problem) pair found, with "is required" for missing fields.
+    """
+    namespace = {
+        "MISSING": MISSING,
+        "NUMBER_TYPES": (int, float),
+        "_add_error": _add_error,
+    }
+    lines = [
+        "def validate(body):",
+        "    if type(body) is not dict:",
+        "        return [('body', 'must be a JSON object')]",
+        "    errors = None",
+    ]
+    counter = itertools.count()
+
+    def emit(fields, source, prefix, indent):
+        pad = " " * indent
+        for name, field in fields.items():
+            path = f"{prefix}{name}"
+            value = f"v{next(counter)}"
+            lines.append(f"{pad}{value} = {source}.get({name!r}, MISSING)")
+            lines.append(f"{pad}if {value} is MISSING:")
+            lines.append(
+                f"{pad}    errors = _add_error(errors, {path!r}, 'is required')"
+            )
+
+            if isinstance(field, ObjectField):
+                lines.append(f"{pad}elif type({value}) is not dict:")
+                lines.append(
+                    f"{pad}    errors = _add_error(errors, {path!r}, "
+                    "'must be an object')"
+                )
+                lines.append(f"{pad}else:")
+                emit(field.fields, value, f"{path}.", indent + 4)
+            elif isinstance(field, NumberField):
+                message = (
+                    f"must be a number between {field.minimum} and {field.maximum}"
+                )
+                lines.append(
+                    f"{pad}elif type({value}) not in NUMBER_TYPES or not "
+                    f"({field.minimum!r} <= {value} <= {field.maximum!r}):"
+                )
+                lines.append(
+                    f"{pad}    errors = _add_error(errors, {path!r}, {message!r})"
+                )
+            elif isinstance(field, StringField):
+                condition = f"type({value}) is not str"
+                if field.pattern is not None:
+                    matcher = f"match_{value}"
+                    namespace[matcher] = re.compile(field.pattern).fullmatch
+                    condition += f" or {matcher}({value}) is None"
+                message = f"must be {field.description}"
+                lines.append(f"{pad}elif {condition}:")
+                lines.append(
+                    f"{pad}    errors = _add_error(errors, {path!r}, {message!r})"
+                )
+            else:
+                raise TypeError(f"Unsupported schema field for {path}: {field!r}")
+
+    emit(schema.fields, "body", "", 4)
+    lines.append("    return errors")
+
+    exec(compile("\n".join(lines), f"<validator {id(schema):x}>", "exec"), namespace)
+    return namespace["validate"]
+
+
+def format_errors(errors):
+    missing = [path for path, message in errors if message == "is required"]
+    invalid = [
+        f"{path} {message}" for path, message in errors if message != "is required"
+    ]
+    parts = []
+
+    if missing:
+        parts.append(f"Missing required fields: {', '.join(missing)}")
+    parts.extend(invalid)
+    return "; ".join(parts)
+
+
+def is_valid_id(value):
+    return type(value) is str and ID_MATCHER(value) is not None
+
+
+# Compiled once per container, at import
+ID_MATCHER = re.compile(ID_PATTERN).fullmatch
+validate_ride_request = compile_validator(RIDE_REQUEST_SCHEMA)
+validate_ride_status_event = compile_validator(RIDE_STATUS_EVENT_SCHEMA)
+validate_ride_accept = compile_validator(RIDE_ACCEPT_SCHEMA)
+validate_fare_estimate = compile_validator(FARE_ESTIMATE_SCHEMA)
+validate_driver_ping = compile_validator(DRIVER_PING_SCHEMA)
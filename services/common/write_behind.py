@@ -0,0 +1,179 @@
+import threading
+import time
+
+from common.batch_write import BATCH_WRITE_MAX_ITEMS, batch_write
+from common.cache import TTLCache
+
+DEFAULT_MAX_ITEMS = 100
+DEFAULT_MAX_AGE_SECONDS = 1.0
+# Keys whose latest order is remembered after their items were written
+DEFAULT_ORDER_CACHE_SIZE = 100_000
+DEFAULT_ORDER_TTL_SECONDS = 60 * 60
+
+
+class FlushError(Exception):
+    def __init__(self, items):
+        super().__init__(f"{len(items)} items still unwritten after retries")
+        # {key: item} of the items that were not written
+        self.items = items
+        self.keys = list(items)
+
+
+class WriteBehindBuffer:
+    """Coalesces item writes per key and writes them later in batches.
+
+    put() keeps only the latest item for each value of `key_attribute`
+    (the table's partition key): the last one put, or, with `order`, the
+    one with the highest order. A bounded cache remembers each key's latest
+    order after it is written too, so a late, stale update cannot overwrite
+    newer state. Buffered items are written with
+    BatchWriteItem once `max_items` keys are pending or the oldest has
+    waited `max_age` seconds, and whenever flush() is called. Tables whose
+    items must be updated rather than replaced pass `write_item`, which
+    writes one item and raises if it could not. Lambda freezes the
+    container between invocations, so handlers must call flush() before
+    returning. Items that still fail after retries are dropped and flush()
+    raises FlushError naming them, for the handler to report for
+    redelivery; keeping them too would let the stale copy overwrite what
+    the redelivered record wrote.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name,
+        key_attribute,
+        max_items=DEFAULT_MAX_ITEMS,
+        max_age=DEFAULT_MAX_AGE_SECONDS,
+        max_batch_retries=5,
+        base_retry_delay=0.05,
+        max_retry_delay=1.0,
+        order_cache_size=DEFAULT_ORDER_CACHE_SIZE,
+        write_item=None,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.key_attribute = key_attribute
+        self.max_items = max_items
+        self.max_age = max_age
+        self.max_batch_retries = max_batch_retries
+        self.base_retry_delay = base_retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.write_item = write_item
+        self.clock = clock
+        self.sleep = sleep
+        # {key: latest item}, oldest first
+        self.pending = {}
+        self.oldest_at = None
+        self.latest_orders = TTLCache(
+            order_cache_size, DEFAULT_ORDER_TTL_SECONDS, clock=clock
+        )
+        self.stats = {"received": 0, "coalesced": 0, "stale": 0, "written": 0}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def put(self, item, order=None):
+        key = self.key_of(item)
+
+        with self.lock:
+            self.stats["received"] += 1
+
+            if order is not None:
+                latest = self.latest_orders.get(key)
+                if latest is not None and order < latest:
+                    self.stats["stale"] += 1
+                    return
+                self.latest_orders.put(key, order)
+
+            if key in self.pending:
+                self.stats["coalesced"] += 1
+
+            self.pending[key] = item
+            now = self.clock()
+            if self.oldest_at is None:
+                self.oldest_at = now
+            due = (
+                len(self.pending) >= self.max_items
+                or now - self.oldest_at >= self.max_age
+            )
+
+        if due:
+            try:
+                self.flush()
+            except FlushError as e:
+                # Put back for the flush at the end of the invocation, which
+                # retries them and otherwise reports them
+                print(f"Write-behind flush deferred: {e}")
+                self.__restore(e.items)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.oldest_at = None
+
+            failed = []
+            if self.write_item is not None:
+                failed.extend(self.__write_each(pending))
+            else:
+                entries = list(pending.items())
+                for start in range(0, len(entries), BATCH_WRITE_MAX_ITEMS):
+                    chunk = dict(entries[start : start + BATCH_WRITE_MAX_ITEMS])
+                    failed.extend(self.__write_batch(chunk))
+
+            with self.lock:
+                self.stats["written"] += len(pending) - len(failed)
+
+            if failed:
+                raise FlushError({key: pending[key] for key in failed})
+            return len(pending)
+
+    def key_of(self, item):
+        # The attribute value's one entry, e.g. {"S": "ride-1"} -> "ride-1"
+        (value,) = item[self.key_attribute].values()
+        return value
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __restore(self, items):
+        with self.lock:
+            for key, item in items.items():
+                # A newer update put during the flush takes precedence
+                if key not in self.pending:
+                    self.pending[key] = item
+            if self.pending and self.oldest_at is None:
+                self.oldest_at = self.clock()
+
+    def __write_each(self, pending):
+        # Returns the keys whose items could not be written
+        failed = []
+        for key, item in pending.items():
+            try:
+                self.write_item(item)
+            except Exception as e:
+                print(f"Write-behind write failed for {key}: {e}")
+                failed.append(key)
+        return failed
+
+    def __write_batch(self, chunk):
+        # Returns the keys whose items could not be written
+        put_requests = [{"PutRequest": {"Item": item}} for item in chunk.values()]
+
+        try:
+            unprocessed = batch_write(
+                self.dynamodb_client,
+                self.table_name,
+                put_requests,
+                self.max_batch_retries,
+                self.base_retry_delay,
+                self.max_retry_delay,
+                self.sleep,
+            )
+        except Exception as e:
+            print(f"Write-behind batch failed: {e}")
+            return list(chunk)
+
+        return [self.key_of(request["PutRequest"]["Item"]) for request in unprocessed]
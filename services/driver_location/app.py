@@ -0,0 +1,42 @@
+import os
+
+from common.driver_ingestion import (
+    DEFAULT_HEARTBEAT_SECONDS,
+    DEFAULT_MIN_MOVE_KM,
+    DriverLocationBatchHandler,
+    DriverLocationIngestor,
+)
+from common.resources import LazyClient, create_dynamodb_client
+from common.write_behind import WriteBehindBuffer
+
+DRIVERS_TABLE = "Drivers"
+
+
+def create_ingestor():
+    location_buffer = WriteBehindBuffer(
+        LazyClient(create_dynamodb_client),
+        os.environ.get("DRIVERS_TABLE", DRIVERS_TABLE),
+        "driverId",
+        max_items=int(os.environ.get("DRIVER_LOCATION_BUFFER_MAX_ITEMS", 100)),
+        max_age=float(os.environ.get("DRIVER_LOCATION_BUFFER_MAX_AGE_SECONDS", 1.0)),
+    )
+    return DriverLocationIngestor(
+        location_buffer=location_buffer,
+        min_move_km=float(
+            os.environ.get("DRIVER_LOCATION_MIN_MOVE_KM", DEFAULT_MIN_MOVE_KM)
+        ),
+        heartbeat_seconds=float(
+            os.environ.get(
+                "DRIVER_LOCATION_HEARTBEAT_SECONDS", DEFAULT_HEARTBEAT_SECONDS
+            )
+        ),
+    )
+
+
+# Ordering state and the DynamoDB client live as long as the container
+location_batch_handler = DriverLocationBatchHandler(create_ingestor())
+
+
+def lambda_handler(event, context):
+    # SQS / Kinesis entry point; requires ReportBatchItemFailures on the mapping
+    return location_batch_handler.handle(event, context)
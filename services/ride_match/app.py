@@ -1,12 +1,234 @@
 import json
+import math
+import os
+import time
 
+from common.driver_ingestion import DriverLocationBatchHandler, DriverLocationIngestor
+from common.geo import KM_PER_DEGREE
+from ride_match.assignment import solve_assignment
+from ride_match.distance import haversine_matrix
+from ride_match.spatial_index import DEFAULT_MAX_RADIUS_KM, DriverGridIndex
 
-def lambda_handler(event, context):
+# Batched matching only pairs requests with drivers this close; anything
+# left over falls back to the wider single-request search
+DEFAULT_BATCH_MAX_PICKUP_KM = 5.0
+MATCH_TIME_BUDGET_SECONDS = float(os.environ.get("MATCH_TIME_BUDGET_SECONDS", 1.0))
+# Time kept back from the Lambda timeout for removing drivers and responding
+MATCH_TIME_SAFETY_SECONDS = 0.5
+# SQS rejects SendMessageBatch calls with more than 10 entries
+SEND_MESSAGE_BATCH_MAX_ENTRIES = 10
+
+
+class RideMatcher:
+    def __init__(self, driver_index: DriverGridIndex):
+        self.driver_index = driver_index
+
+    def update_driver_location(self, driver_id, latitude, longitude):
+        self.driver_index.upsert(driver_id, latitude, longitude)
+
+    def remove_driver(self, driver_id):
+        return self.driver_index.remove(driver_id)
+
+    def find_candidates(self, location, k=5, max_radius_km=DEFAULT_MAX_RADIUS_KM):
+        return [
+            {"driverId": driver_id, "distanceKm": round(distance, 3)}
+            for distance, driver_id in self.driver_index.nearest(
+                location["latitude"], location["longitude"], k, max_radius_km
+            )
+        ]
+
+    def candidate_distances(self, locations, rings=1):
+        # Scores a batch of pickups against every nearby driver in one pass;
+        # row i of the matrix holds the distances from locations[i]
+        points = [
+            (location["latitude"], location["longitude"]) for location in locations
+        ]
+        driver_ids, coordinates = self.driver_index.drivers_around(points, rings)
+        return driver_ids, haversine_matrix(points, coordinates)
+
+    def match(self, location, max_radius_km=DEFAULT_MAX_RADIUS_KM):
+        # Greedy: assign the closest available driver and take it off the index
+        nearest = self.driver_index.nearest(
+            location["latitude"], location["longitude"], 1, max_radius_km
+        )
+
+        if not nearest:
+            return None
+
+        distance, driver_id = nearest[0]
+        self.driver_index.remove(driver_id)
+        return {"driverId": driver_id, "distanceKm": round(distance, 3)}
+
+    def match_batch(
+        self, locations, max_pickup_km=DEFAULT_BATCH_MAX_PICKUP_KM, deadline=None
+    ):
+        # Assigns drivers to a window of requests at minimum total pickup
+        # distance; returns one match (or None) per location, in order
+        if not locations:
+            return []
+
+        max_latitude = max(abs(location["latitude"]) for location in locations)
+        cell_km = self.driver_index.cell_size * KM_PER_DEGREE
+        cell_km *= max(math.cos(math.radians(max_latitude)), 0.01)
+        rings = math.ceil(max_pickup_km / cell_km)
+
+        driver_ids, cost = self.candidate_distances(locations, rings)
+        matches = [None] * len(locations)
+
+        if driver_ids:
+            assignment = solve_assignment(
+                cost, max_cost=max_pickup_km, deadline=deadline
+            )
+            for row, column in assignment.items():
+                self.driver_index.remove(driver_ids[column])
+                matches[row] = {
+                    "driverId": driver_ids[column],
+                    "distanceKm": round(float(cost[row][column]), 3),
+                }
+
+        for row, location in enumerate(locations):
+            if matches[row] is None:
+                matches[row] = self.match(location)
+
+        return matches
+
+
+class MatchPublisher:
+    """Sends matches to the queue ride_request accepts them from.
+
+    ride_request owns the ride's status, so a match is only final once its
+    consumer has moved the ride to "matched". The SQS client, and boto3
+    with it, is built on the first publish.
+    """
+
+    def __init__(self, queue_url, sqs_client=None):
+        self.queue_url = queue_url
+        self.sqs_client = sqs_client
+
+    def publish(self, matches):
+        # Returns the ride ids of the matches that could not be sent
+        if self.sqs_client is None:
+            import boto3
+
+            self.sqs_client = boto3.client("sqs")
+
+        failed = set()
+        for start in range(0, len(matches), SEND_MESSAGE_BATCH_MAX_ENTRIES):
+            chunk = matches[start : start + SEND_MESSAGE_BATCH_MAX_ENTRIES]
+            entries = [
+                {"Id": str(index), "MessageBody": json.dumps(match)}
+                for index, match in enumerate(chunk)
+            ]
+            try:
+                response = self.sqs_client.send_message_batch(
+                    QueueUrl=self.queue_url, Entries=entries
+                )
+            except Exception as e:
+                print(f"Failed to publish {len(chunk)} matches: {e}")
+                failed.update(match["rideId"] for match in chunk)
+                continue
+
+            for entry in response.get("Failed", []):
+                failed.add(chunk[int(entry["Id"])]["rideId"])
+        return failed
+
+
+def get_match_deadline(context):
+    budget = MATCH_TIME_BUDGET_SECONDS
+
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        remaining = context.get_remaining_time_in_millis() / 1000
+        budget = min(budget, remaining - MATCH_TIME_SAFETY_SECONDS)
+
+    return time.monotonic() + max(budget, 0.0)
+
+
+def format_response(status_code, body):
     return {
-        "statusCode": 200,
-        "body": json.dumps(
-            {
-                "message": "hello world",
+        "statusCode": status_code,
+        "body": json.dumps(body),
+        "headers": {"Content-Type": "application/json"},
+    }
+
+
+# Available drivers live for as long as the container stays warm
+ride_matcher = RideMatcher(DriverGridIndex())
+match_publisher = MatchPublisher(os.environ.get("RIDE_MATCHES_QUEUE_URL"))
+# Keeps this container's index current from the driver location stream;
+# driver_location's own consumer writes the last-known-location store
+location_batch_handler = DriverLocationBatchHandler(
+    DriverLocationIngestor(driver_index=ride_matcher.driver_index)
+)
+
+
+def lambda_handler(event, context):
+    try:
+        body = json.loads(event["body"])
+        pickup_location = body["pickupLocation"]
+
+        if body.get("candidatesOnly"):
+            candidates = ride_matcher.find_candidates(
+                pickup_location, k=int(body.get("k", 5))
+            )
+            return format_response(200, {"candidates": candidates})
+
+        match = ride_matcher.match(pickup_location)
+
+        if match is None:
+            return format_response(404, {"message": "No available drivers nearby"})
+
+        return format_response(200, match)
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return format_response(400, {"message": "Invalid match request"})
+    except Exception:
+        return format_response(500, {"message": "Internal Server Error"})
+
+
+def batch_lambda_handler(event, context):
+    # SQS entry point; the queue's MaximumBatchingWindowInSeconds acts as the
+    # match window, so each batch is solved jointly. Matches are published
+    # for ride_request to accept; requests left without a driver, or whose
+    # match could not be published, are reported as failures so SQS
+    # redelivers them for a later batch.
+    message_ids = []
+    ride_ids = []
+    locations = []
+
+    for record in event.get("Records", []):
+        try:
+            body = json.loads(record["body"])
+            ride_id = body["rideId"]
+            location = {
+                "latitude": float(body["pickupLocation"]["latitude"]),
+                "longitude": float(body["pickupLocation"]["longitude"]),
             }
-        ),
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            print(f"Dropping invalid match request {record.get('messageId')}: {e}")
+            continue
+
+        message_ids.append(record["messageId"])
+        ride_ids.append(ride_id)
+        locations.append(location)
+
+    matches = ride_matcher.match_batch(locations, deadline=get_match_deadline(context))
+    published = [
+        {"rideId": ride_id, **match}
+        for ride_id, match in zip(ride_ids, matches)
+        if match is not None
+    ]
+    # A driver whose match was not sent is off this container's index until
+    # its next location ping
+    failed = match_publisher.publish(published) if published else set()
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id}
+            for message_id, ride_id, match in zip(message_ids, ride_ids, matches)
+            if match is None or ride_id in failed
+        ]
     }
+
+
+def location_lambda_handler(event, context):
+    # Driver ping stream entry point, alongside the match entry points above
+    return location_batch_handler.handle(event, context)
@@ -0,0 +1,224 @@
+import heapq
+import math
+import time
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - exercised by forcing the fallback
+    numpy = None
+
+# Only the cheapest few drivers per request are considered; this keeps the
+# problem sparse without changing the optimum in practice
+DEFAULT_CANDIDATES_PER_ROW = 8
+# Above this many requests the O(n^2 m) Hungarian method is too slow for a
+# 3 second Lambda, so the greedy heuristic is used instead
+DEFAULT_HUNGARIAN_MAX_ROWS = 60
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def solve_assignment(
+    cost,
+    max_cost=math.inf,
+    candidates_per_row=DEFAULT_CANDIDATES_PER_ROW,
+    hungarian_max_rows=DEFAULT_HUNGARIAN_MAX_ROWS,
+    deadline=None,
+):
+    """Minimum-cost assignment of rows (requests) to columns (drivers).
+
+    `cost` is an N x M matrix (NumPy array or list of lists). Pairs costing
+    more than `max_cost` are never assigned. Returns {row: column}; rows
+    without a feasible column are left out. `deadline` is a
+    time.monotonic() value after which the solver returns its best answer.
+    """
+    candidates = _row_candidates(cost, max_cost, candidates_per_row)
+
+    if not candidates:
+        return {}
+
+    if len(candidates) <= hungarian_max_rows:
+        try:
+            return hungarian(candidates, deadline)
+        except DeadlineExceeded:
+            pass
+
+    return greedy_with_improvement(candidates, deadline)
+
+
+def hungarian(candidates, deadline=None):
+    # Shortest augmenting path Hungarian method over the candidate columns.
+    # Missing pairs get a cost large enough that the solver only uses them
+    # when nothing else fits, and they are dropped from the result.
+    rows = sorted(candidates)
+    columns = sorted({column for row in rows for _, column in candidates[row]})
+    column_index = {column: j for j, column in enumerate(columns)}
+
+    finite = [cost for row in rows for cost, _ in candidates[row]]
+    infeasible = (max(finite) + 1) * (len(rows) + 1)
+    dense = [[infeasible] * len(columns) for _ in rows]
+    for i, row in enumerate(rows):
+        for cost, column in candidates[row]:
+            dense[i][column_index[column]] = cost
+
+    transposed = len(rows) > len(columns)
+    if transposed:
+        dense = [list(column) for column in zip(*dense)]
+
+    pairs = _hungarian_dense(dense, deadline)
+
+    assignment = {}
+    for i, j in pairs:
+        if dense[i][j] >= infeasible:
+            continue
+        if transposed:
+            i, j = j, i
+        assignment[rows[i]] = columns[j]
+    return assignment
+
+
+def greedy_with_improvement(candidates, deadline=None):
+    # Cheapest-pair-first greedy, then pairwise swaps while they lower the total
+    assignment = {}
+    taken = set()
+    pairs = sorted(
+        (cost, row, column)
+        for row, row_candidates in candidates.items()
+        for cost, column in row_candidates
+    )
+    for _, row, column in pairs:
+        if row not in assignment and column not in taken:
+            assignment[row] = column
+            taken.add(column)
+
+    costs = {
+        row: {column: cost for cost, column in row_candidates}
+        for row, row_candidates in candidates.items()
+    }
+    improved = True
+
+    while improved:
+        improved = False
+        assigned = list(assignment)
+
+        for a_index, a in enumerate(assigned):
+            if deadline is not None and time.monotonic() > deadline:
+                return assignment
+
+            x = assignment[a]
+            a_costs = costs[a]
+            for b in assigned[a_index + 1 :]:
+                y = assignment[b]
+                b_costs = costs[b]
+                if y not in a_costs or x not in b_costs:
+                    continue
+
+                delta = a_costs[y] + b_costs[x] - a_costs[x] - b_costs[y]
+                if delta < -1e-12:
+                    assignment[a], assignment[b] = y, x
+                    x = y
+                    improved = True
+
+    return assignment
+
+
+def _row_candidates(cost, max_cost, candidates_per_row):
+    # {row: [(cost, column), ...]} holding the cheapest feasible columns
+    if numpy is not None and isinstance(cost, numpy.ndarray):
+        return _row_candidates_array(cost, max_cost, candidates_per_row)
+
+    candidates = {}
+    for row, row_costs in enumerate(cost):
+        cheapest = heapq.nsmallest(
+            candidates_per_row,
+            (
+                (value, column)
+                for column, value in enumerate(row_costs)
+                if value <= max_cost
+            ),
+        )
+        if cheapest:
+            candidates[row] = cheapest
+    return candidates
+
+
+def _row_candidates_array(cost, max_cost, candidates_per_row):
+    # Same as above, selecting each row's cheapest columns with one partition
+    if cost.size == 0:
+        return {}
+
+    k = min(candidates_per_row, cost.shape[1])
+    if k < cost.shape[1]:
+        columns = cost.argpartition(k - 1, axis=1)[:, :k]
+    else:
+        columns = cost.argsort(axis=1)
+    values = numpy.take_along_axis(cost, columns, axis=1)
+
+    candidates = {}
+    for row, (row_values, row_columns) in enumerate(
+        zip(values.tolist(), columns.tolist())
+    ):
+        cheapest = sorted(
+            (value, column)
+            for value, column in zip(row_values, row_columns)
+            if value <= max_cost
+        )
+        if cheapest:
+            candidates[row] = cheapest
+    return candidates
+
+
+def _hungarian_dense(cost, deadline):
+    # Classic O(n^2 m) formulation for n <= m; returns (row, column) pairs
+    n = len(cost)
+    m = len(cost[0])
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineExceeded()
+
+        p[0] = i
+        j0 = 0
+        minv = [math.inf] * (m + 1)
+        used = [False] * (m + 1)
+
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            u_i0 = u[i0]
+            delta = math.inf
+            j1 = 0
+
+            for j in range(1, m + 1):
+                if not used[j]:
+                    current = row[j - 1] - u_i0 - v[j]
+                    if current < minv[j]:
+                        minv[j] = current
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return [(p[j] - 1, j - 1) for j in range(1, m + 1) if p[j]]
@@ -0,0 +1,149 @@
+import math
+
+from common.geo import EARTH_RADIUS_KM
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - exercised by forcing the fallback
+    numpy = None
+
+# Upper bound on the float64 elements held in one temporary block (8 MiB)
+DEFAULT_CHUNK_ELEMENTS = 1 << 20
+
+
+def haversine_matrix(origins, destinations, chunk_elements=DEFAULT_CHUNK_ELEMENTS):
+    """Great-circle distances in km between every origin and destination.
+
+    Points are (latitude, longitude) pairs in degrees. With NumPy installed
+    the result is an N x M float64 array computed in row blocks of at most
+    `chunk_elements` values; otherwise it is a list of lists.
+    """
+    if numpy is None:
+        return _haversine_matrix_python(origins, destinations)
+
+    origins = _as_radians(origins)
+    destinations = _as_radians(destinations)
+    result = numpy.empty((len(origins), len(destinations)))
+
+    if result.size == 0:
+        return result
+
+    lat2 = destinations[:, 0]
+    lon2 = destinations[:, 1]
+    cos_lat2 = numpy.cos(lat2)
+    cos_lat1 = numpy.cos(origins[:, 0:1])
+    rows = max(1, chunk_elements // len(destinations))
+    scratch = numpy.empty((min(rows, len(origins)), len(destinations)))
+
+    for start in range(0, len(origins), rows):
+        stop = min(start + rows, len(origins))
+        block = result[start:stop]
+        work = scratch[: stop - start]
+
+        # a = sin^2(dlat / 2) + cos(lat1) * cos(lat2) * sin^2(dlon / 2)
+        numpy.subtract(lat2, origins[start:stop, 0:1], out=block)
+        numpy.multiply(block, 0.5, out=block)
+        numpy.sin(block, out=block)
+        numpy.square(block, out=block)
+        numpy.subtract(lon2, origins[start:stop, 1:2], out=work)
+        numpy.multiply(work, 0.5, out=work)
+        numpy.sin(work, out=work)
+        numpy.square(work, out=work)
+        numpy.multiply(work, cos_lat2, out=work)
+        numpy.multiply(work, cos_lat1[start:stop], out=work)
+        numpy.add(block, work, out=block)
+
+        numpy.sqrt(block, out=block)
+        numpy.minimum(block, 1.0, out=block)
+        numpy.arcsin(block, out=block)
+        numpy.multiply(block, 2 * EARTH_RADIUS_KM, out=block)
+
+    return result
+
+
+def equirectangular_matrix(
+    origins, destinations, chunk_elements=DEFAULT_CHUNK_ELEMENTS
+):
+    """Cheaper flat-earth approximation of haversine_matrix.
+
+    Accurate to well under 1% at city scale, which is enough for ranking
+    candidate drivers.
+    """
+    if numpy is None:
+        return _equirectangular_matrix_python(origins, destinations)
+
+    origins = _as_radians(origins)
+    destinations = _as_radians(destinations)
+    result = numpy.empty((len(origins), len(destinations)))
+
+    if result.size == 0:
+        return result
+
+    lat2 = destinations[:, 0]
+    lon2 = destinations[:, 1]
+    rows = max(1, chunk_elements // len(destinations))
+    scratch = numpy.empty((min(rows, len(origins)), len(destinations)))
+
+    for start in range(0, len(origins), rows):
+        stop = min(start + rows, len(origins))
+        block = result[start:stop]
+        work = scratch[: stop - start]
+        lat1 = origins[start:stop, 0:1]
+
+        # x = dlon * cos(mean latitude), y = dlat
+        numpy.add(lat2, lat1, out=work)
+        numpy.multiply(work, 0.5, out=work)
+        numpy.cos(work, out=work)
+        numpy.subtract(lon2, origins[start:stop, 1:2], out=block)
+        numpy.multiply(block, work, out=block)
+        numpy.square(block, out=block)
+        numpy.subtract(lat2, lat1, out=work)
+        numpy.square(work, out=work)
+        numpy.add(block, work, out=block)
+
+        numpy.sqrt(block, out=block)
+        numpy.multiply(block, EARTH_RADIUS_KM, out=block)
+
+    return result
+
+
+def _as_radians(points):
+    points = numpy.ascontiguousarray(points, dtype=numpy.float64).reshape(-1, 2)
+    return numpy.radians(points)
+
+
+def _haversine_matrix_python(origins, destinations):
+    destinations = [
+        (math.radians(lat), math.radians(lon), math.cos(math.radians(lat)))
+        for lat, lon in destinations
+    ]
+    result = []
+
+    for lat, lon in origins:
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        cos_lat1 = math.cos(lat1)
+        row = []
+        for lat2, lon2, cos_lat2 in destinations:
+            a = (
+                math.sin((lat2 - lat1) / 2) ** 2
+                + cos_lat1 * cos_lat2 * math.sin((lon2 - lon1) / 2) ** 2
+            )
+            row.append(2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a))))
+        result.append(row)
+
+    return result
+
+
+def _equirectangular_matrix_python(origins, destinations):
+    destinations = [(math.radians(lat), math.radians(lon)) for lat, lon in destinations]
+    result = []
+
+    for lat, lon in origins:
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        row = []
+        for lat2, lon2 in destinations:
+            x = (lon2 - lon1) * math.cos((lat1 + lat2) / 2)
+            row.append(EARTH_RADIUS_KM * math.hypot(x, lat2 - lat1))
+        result.append(row)
+
+    return result
@@ -0,0 +1,240 @@
+import heapq
+from array import array
+
+from common.geo import haversine_km
+from ride_match.distance import haversine_matrix
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - exercised by forcing the fallback
+    numpy = None
+
+DEFAULT_MAX_RADIUS_KM = 50.0
+# Status code of a slot on the free list
+FREE = 0
+DRIVER_STATUSES = ("offline", "available", "assigned", "on_trip")
+STATUS_CODES = {status: code for code, status in enumerate(DRIVER_STATUSES, 1)}
+
+
+class StaleDriverRecord(LookupError):
+    """The driver a DriverRecord was taken for has left the registry."""
+
+
+class DriverRecord:
+    """View of one registry slot; reads through to the registry's arrays.
+
+    The view remembers the slot's generation, which the registry bumps
+    whenever it frees the slot, so reading a removed driver, or whoever
+    reused its slot, raises StaleDriverRecord.
+    """
+
+    __slots__ = ("registry", "slot", "generation")
+
+    def __init__(self, registry, slot):
+        self.registry = registry
+        self.slot = slot
+        self.generation = registry.generations[slot]
+
+    @property
+    def driver_id(self):
+        return self.registry.driver_ids[self.__live_slot()]
+
+    @property
+    def latitude(self):
+        return self.registry.latitudes[self.__live_slot()]
+
+    @property
+    def longitude(self):
+        return self.registry.longitudes[self.__live_slot()]
+
+    @property
+    def status(self):
+        return DRIVER_STATUSES[self.registry.statuses[self.__live_slot()] - 1]
+
+    @property
+    def last_seen(self):
+        return self.registry.last_seen[self.__live_slot()]
+
+    def __live_slot(self):
+        if self.registry.generations[self.slot] != self.generation:
+            raise StaleDriverRecord(self.slot)
+        return self.slot
+
+    def __repr__(self):
+        return (
+            f"DriverRecord({self.driver_id!r}, {self.latitude}, {self.longitude}, "
+            f"{self.status!r}, {self.last_seen})"
+        )
+
+
+class DriverRegistry:
+    """Position, status and last-seen time of every known driver.
+
+    State is kept as parallel typed arrays indexed by slot: float64
+    latitudes and longitudes, uint8 status codes and int64 last-seen
+    timestamps in epoch milliseconds. `slots` maps driver ids to slots, and
+    slots of removed drivers are reused from a free list, so the arrays
+    only grow to the peak number of drivers. `generations` counts how
+    often each slot has been freed.
+
+    Full scans (`select`, `count`, `nearest`) run over the arrays in place,
+    vectorized with NumPy when it is installed. The arrays cannot grow
+    while a scan holds a view of them, so a registry must not be shared
+    between threads without a lock.
+    """
+
+    def __init__(self):
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.statuses = array("B")
+        self.last_seen = array("q")
+        self.generations = array("Q")
+        # Slot -> driver id, None for free slots
+        self.driver_ids = []
+        self.slots = {}
+        self.free_slots = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, driver_id):
+        return driver_id in self.slots
+
+    def get(self, driver_id):
+        slot = self.slots.get(driver_id)
+        return None if slot is None else DriverRecord(self, slot)
+
+    def upsert(self, driver_id, latitude, longitude, status=None, last_seen=None):
+        # An omitted status or last_seen keeps the driver's current one; new
+        # drivers start "available" and seen at 0
+        code = None if status is None else STATUS_CODES[status]
+        slot = self.slots.get(driver_id)
+
+        if slot is None:
+            slot = self.__allocate(driver_id)
+            if code is None:
+                code = STATUS_CODES["available"]
+            if last_seen is None:
+                last_seen = 0
+
+        self.latitudes[slot] = latitude
+        self.longitudes[slot] = longitude
+        if code is not None:
+            self.statuses[slot] = code
+        if last_seen is not None:
+            self.last_seen[slot] = last_seen
+        return slot
+
+    def set_status(self, driver_id, status):
+        self.statuses[self.slots[driver_id]] = STATUS_CODES[status]
+
+    def remove(self, driver_id):
+        slot = self.slots.pop(driver_id, None)
+
+        if slot is None:
+            return False
+
+        self.statuses[slot] = FREE
+        self.generations[slot] += 1
+        self.driver_ids[slot] = None
+        self.free_slots.append(slot)
+        return True
+
+    def select(self, status=None, seen_since=None):
+        # Ids of drivers with `status` (any, if None) seen at or after
+        # `seen_since`, in slot order
+        driver_ids = self.driver_ids
+        return [driver_ids[slot] for slot in self.__matching_slots(status, seen_since)]
+
+    def count(self, status=None, seen_since=None):
+        return len(self.__matching_slots(status, seen_since))
+
+    def nearest(
+        self,
+        latitude,
+        longitude,
+        k=1,
+        status="available",
+        seen_since=None,
+        max_radius_km=DEFAULT_MAX_RADIUS_KM,
+    ):
+        # Returns up to k (distance_km, driver_id) pairs, closest first, like
+        # DriverGridIndex.nearest but by scanning every matching driver
+        slots = self.__matching_slots(status, seen_since)
+        if k <= 0 or len(slots) == 0:
+            return []
+
+        if numpy is None:
+            candidates = []
+            for slot in slots:
+                distance = haversine_km(
+                    latitude, longitude, self.latitudes[slot], self.longitudes[slot]
+                )
+                if distance <= max_radius_km:
+                    candidates.append((distance, self.driver_ids[slot]))
+            return heapq.nsmallest(k, candidates)
+
+        distances = haversine_matrix([(latitude, longitude)], self.locations(slots))[0]
+
+        within = numpy.flatnonzero(distances <= max_radius_km)
+        if len(within) > k:
+            within = within[numpy.argpartition(distances[within], k - 1)[:k]]
+
+        return sorted(
+            (distance, self.driver_ids[slot])
+            for distance, slot in zip(
+                distances[within].tolist(), slots[within].tolist()
+            )
+        )
+
+    def locations(self, slots):
+        # (latitude, longitude) rows of `slots`: an N x 2 array with NumPy
+        # installed, otherwise a list of pairs
+        if numpy is None:
+            return [(self.latitudes[slot], self.longitudes[slot]) for slot in slots]
+
+        slots = numpy.asarray(slots, dtype=numpy.intp)
+        points = numpy.empty((len(slots), 2))
+        if len(slots) == 0:
+            return points
+        points[:, 0] = numpy.frombuffer(self.latitudes, dtype=numpy.float64)[slots]
+        points[:, 1] = numpy.frombuffer(self.longitudes, dtype=numpy.float64)[slots]
+        return points
+
+    def __allocate(self, driver_id):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.driver_ids[slot] = driver_id
+        else:
+            slot = len(self.driver_ids)
+            self.driver_ids.append(driver_id)
+            self.latitudes.append(0.0)
+            self.longitudes.append(0.0)
+            self.statuses.append(FREE)
+            self.last_seen.append(0)
+            self.generations.append(0)
+
+        self.slots[driver_id] = slot
+        return slot
+
+    def __matching_slots(self, status, seen_since):
+        code = None if status is None else STATUS_CODES[status]
+
+        if numpy is None:
+            statuses = self.statuses
+            last_seen = self.last_seen
+            return [
+                slot
+                for slot in range(len(statuses))
+                if (statuses[slot] != FREE if code is None else statuses[slot] == code)
+                and (seen_since is None or last_seen[slot] >= seen_since)
+            ]
+
+        if not self.statuses:
+            return numpy.empty(0, dtype=numpy.intp)
+
+        statuses = numpy.frombuffer(self.statuses, dtype=numpy.uint8)
+        mask = statuses != FREE if code is None else statuses == code
+        if seen_since is not None:
+            mask &= numpy.frombuffer(self.last_seen, dtype=numpy.int64) >= seen_since
+        return numpy.flatnonzero(mask)
@@ -0,0 +1,186 @@
+import heapq
+import math
+
+from common.geo import (
+    DRIVER_GRID_CELL_SIZE_DEGREES,
+    EARTH_RADIUS_KM,
+    KM_PER_DEGREE,
+    haversine_km,
+)
+from ride_match.driver_registry import DEFAULT_MAX_RADIUS_KM, DriverRegistry
+
+DEFAULT_CELL_SIZE_DEGREES = DRIVER_GRID_CELL_SIZE_DEGREES
+
+
+class DriverGridIndex:
+    """Uniform lat/lon grid of available drivers.
+
+    Insert, move and remove touch at most two cells. Nearest-driver queries
+    scan rings of cells around the query point and stop as soon as no
+    unscanned cell can hold anything closer than the k-th best so far.
+    Cells do not wrap around the antimeridian.
+
+    Positions live in a DriverRegistry's arrays; cells only map driver ids
+    to registry slots.
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE_DEGREES):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.registry = DriverRegistry()
+
+    def __len__(self):
+        return len(self.registry)
+
+    def __contains__(self, driver_id):
+        return driver_id in self.registry
+
+    def cell_of(self, latitude, longitude):
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def location_of(self, driver_id):
+        slot = self.registry.slots[driver_id]
+        return self.registry.latitudes[slot], self.registry.longitudes[slot]
+
+    def upsert(self, driver_id, latitude, longitude, status=None, last_seen=None):
+        # As DriverRegistry.upsert: an omitted status or last_seen is kept
+        cell = self.cell_of(latitude, longitude)
+
+        if driver_id in self.registry:
+            previous = self.cell_of(*self.location_of(driver_id))
+            if previous != cell:
+                self.__remove_from_cell(previous, driver_id)
+
+        slot = self.registry.upsert(driver_id, latitude, longitude, status, last_seen)
+        self.cells.setdefault(cell, {})[driver_id] = slot
+
+    # Inserting and moving a driver are the same operation
+    insert = upsert
+    move = upsert
+
+    def remove(self, driver_id):
+        if driver_id not in self.registry:
+            return False
+
+        self.__remove_from_cell(self.cell_of(*self.location_of(driver_id)), driver_id)
+        return self.registry.remove(driver_id)
+
+    def nearest(self, latitude, longitude, k=1, max_radius_km=DEFAULT_MAX_RADIUS_KM):
+        # Returns up to k (distance_km, driver_id) pairs, closest first
+        if k <= 0 or not self.registry:
+            return []
+
+        ci, cj = self.cell_of(latitude, longitude)
+        cos_latitude = math.cos(math.radians(latitude))
+        # Max-heap of the k best candidates, stored as negated distances
+        best = []
+        seen = 0
+        ring = 0
+        latitudes = self.registry.latitudes
+        longitudes = self.registry.longitudes
+
+        while True:
+            for cell in self.__ring_cells(ci, cj, ring):
+                drivers = self.cells.get(cell)
+                if not drivers:
+                    continue
+
+                seen += len(drivers)
+                for driver_id, slot in drivers.items():
+                    distance = haversine_km(
+                        latitude, longitude, latitudes[slot], longitudes[slot]
+                    )
+                    if distance > max_radius_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, driver_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, driver_id))
+
+            if seen >= len(self.registry):
+                break
+
+            bound = self.__unscanned_distance_bound(
+                latitude, longitude, cos_latitude, ci, cj, ring
+            )
+            if bound > max_radius_km:
+                break
+            if len(best) == k and bound >= -best[0][0]:
+                break
+
+            ring += 1
+
+        return sorted((-distance, driver_id) for distance, driver_id in best)
+
+    def drivers_around(self, locations, rings=1):
+        # All drivers within `rings` cells of any location: their ids, and
+        # their coordinates as DriverRegistry.locations returns them
+        cells = set()
+        for latitude, longitude in locations:
+            ci, cj = self.cell_of(latitude, longitude)
+            for i in range(ci - rings, ci + rings + 1):
+                for j in range(cj - rings, cj + rings + 1):
+                    cells.add((i, j))
+
+        driver_ids = []
+        slots = []
+        for cell in cells:
+            drivers = self.cells.get(cell)
+            if drivers:
+                driver_ids.extend(drivers)
+                slots.extend(drivers.values())
+
+        return driver_ids, self.registry.locations(slots)
+
+    def __remove_from_cell(self, cell, driver_id):
+        drivers = self.cells[cell]
+        del drivers[driver_id]
+
+        if not drivers:
+            del self.cells[cell]
+
+    @staticmethod
+    def __ring_cells(ci, cj, ring):
+        if ring == 0:
+            yield ci, cj
+            return
+
+        for j in range(cj - ring, cj + ring + 1):
+            yield ci - ring, j
+            yield ci + ring, j
+        for i in range(ci - ring + 1, ci + ring):
+            yield i, cj - ring
+            yield i, cj + ring
+
+    def __unscanned_distance_bound(
+        self, latitude, longitude, cos_latitude, ci, cj, ring
+    ):
+        # Lower bound on the distance to any cell outside the scanned square
+        size = self.cell_size
+        latitude_gap = min(
+            latitude - (ci - ring) * size, (ci + ring + 1) * size - latitude
+        )
+        longitude_gap = min(
+            longitude - (cj - ring) * size, (cj + ring + 1) * size - longitude
+        )
+
+        # Distance to a meridian is asin(sin(dlon) * cos(lat)) on the sphere
+        longitude_gap = math.radians(min(longitude_gap, 90.0))
+        longitude_km = EARTH_RADIUS_KM * math.asin(
+            min(1.0, math.sin(longitude_gap) * cos_latitude)
+        )
+        return min(latitude_gap * KM_PER_DEGREE, longitude_km)
+
+
+def brute_force_nearest(drivers, latitude, longitude, k=1):
+    # Reference implementation used by tests and the benchmark
+    return heapq.nsmallest(
+        k,
+        (
+            (haversine_km(latitude, longitude, lat, lon), driver_id)
+            for driver_id, (lat, lon) in drivers.items()
+        ),
+    )
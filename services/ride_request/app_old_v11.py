@@ -1,177 +1,1434 @@
 import json
-import uuid
+import os
+import threading
+import time
 from datetime import datetime, timezone
-import boto3
+
+from common.batch_records import BatchRecordHandler
+from common.batch_write import BATCH_WRITE_MAX_ITEMS, batch_write
+from common.cache import TTLCache
+from common.item_schema import (
+    RIDE_STATUS_ITEM,
+    RIDE_SUMMARY_ITEM,
+    build_ride_request_item,
+)
+from common.resources import (
+    LazyClient,
+    ResourceRegistry,
+    create_dynamodb_client,
+    get_max_pool_connections,
+)
+from common.validation import (
+    MAX_BODY_LENGTH,
+    format_errors,
+    is_valid_id,
+    validate_fare_estimate,
+    validate_ride_accept,
+    validate_ride_request,
+    validate_ride_status_event,
+)
+from common.write_behind import FlushError, WriteBehindBuffer
+from ride_request.eta import EtaEngine
+from ride_request.fares import FareEstimator
+from ride_request.idempotency import (
+    COMPLETED,
+    IdempotencyRecordStorage,
+    error_code,
+    fingerprint,
+    get_idempotency_key,
+    is_valid_idempotency_key,
+)
+from ride_request.metrics import NULL_TIMER, StageMetrics
+from ride_request.profiling import InvocationProfiler
+from ride_request.ride_lifecycle import (
+    TRANSITIONS,
+    InvalidTransition,
+    RideLifecycle,
+    RideNotFound,
+    VersionConflict,
+)
+from ride_request.serialization import dumps, format_response
+from ride_request.sharding import ScatterGatherReader, ShardedIndex
+from ride_request.surge import SurgePricer, SurgeSupplyTable
 
 RIDE_REQUESTS_TABLE = "RideRequests"
+# Secondary indexes on RideRequests, sorted by request time
+CUSTOMER_RIDES_INDEX = "CustomerRides"
+RIDES_BY_STATUS_INDEX = "RidesByStatus"
+
+
+def new_ride_id():
+    # str(uuid.uuid4()) without building a UUID object, which costs more
+    # than the rest of the ride id; sets the same version and variant bits
+    data = bytearray(os.urandom(16))
+    data[6] = data[6] & 0x0F | 0x40
+    data[8] = data[8] & 0x3F | 0x80
+    digits = data.hex()
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
 
 
 class HttpResponse:
+    __slots__ = ("status_code", "data", "error_message")
+
     def __init__(self, status_code, data=None, error_message=None):
         self.status_code = status_code
         self.data = data
         self.error_message = error_message
-        self.is_success = status_code < 400
+
+    @property
+    def is_success(self):
+        return self.status_code < 400
 
     def to_dict(self):
-        return {
-            "statusCode": self.status_code,
-            "body": json.dumps(
-                self.data if self.is_success else {"message": self.error_message}
-            ),
-            "headers": {"Content-Type": "application/json"},
-        }
+        return format_response(self.status_code, self.data, self.error_message)
 
 
 class SuccessResponse(HttpResponse):
+    __slots__ = ()
+
     def __init__(self, data=None):
         super().__init__(status_code=200, data=data)
 
 
 class CreatedResponse(HttpResponse):
+    __slots__ = ()
+
     def __init__(self, data=None):
         super().__init__(status_code=201, data=data)
 
 
 class BadRequestResponse(HttpResponse):
+    __slots__ = ()
+
     def __init__(self, error_message):
         super().__init__(status_code=400, error_message=error_message)
 
 
+class NotFoundResponse(HttpResponse):
+    __slots__ = ()
+
+    def __init__(self, error_message):
+        super().__init__(status_code=404, error_message=error_message)
+
+
+class ConflictResponse(HttpResponse):
+    __slots__ = ()
+
+    def __init__(self, error_message):
+        super().__init__(status_code=409, error_message=error_message)
+
+
+class PayloadTooLargeResponse(HttpResponse):
+    __slots__ = ()
+
+    def __init__(self, error_message):
+        super().__init__(status_code=413, error_message=error_message)
+
+
+class UnprocessableEntityResponse(HttpResponse):
+    __slots__ = ()
+
+    def __init__(self, error_message):
+        super().__init__(status_code=422, error_message=error_message)
+
+
 class InternalServerErrorResponse(HttpResponse):
+    __slots__ = ()
+
     def __init__(self, error_message):
         super().__init__(status_code=500, error_message=error_message)
 
 
 class RequestValidator:
+    # Responses are never mutated, so the success path reuses one instance
+    VALID = SuccessResponse()
+
+    def __init__(self, max_body_length=MAX_BODY_LENGTH):
+        self.max_body_length = max_body_length
+
+    def check_body_size(self, raw_body):
+        if raw_body is not None and len(raw_body) > self.max_body_length:
+            return PayloadTooLargeResponse(
+                f"Request body exceeds {self.max_body_length} characters"
+            )
+
+        return self.VALID
+
     def validate(self, body):
-        required_fields = ["customerId", "pickupLocation", "destinationLocation"]
-        missing_fields = [field for field in required_fields if field not in body]
+        errors = validate_ride_request(body)
 
-        if missing_fields:
-            missing_fields_str = ", ".join(missing_fields)
-            return BadRequestResponse(f"Missing required fields: {missing_fields_str}")
+        if errors is not None:
+            return BadRequestResponse(format_errors(errors))
 
-        return SuccessResponse()
+        return self.VALID
 
 
 class RideRequestDynamoDBStorage:
-    def __init__(self, dynamodb_client):
+    def __init__(
+        self,
+        dynamodb_client,
+        max_batch_retries=5,
+        base_retry_delay=0.05,
+        max_retry_delay=1.0,
+        sleep=time.sleep,
+        indexes=(),
+    ):
+        # Shared across invocations, so no per-request state is kept here
         self.dynamodb_client = dynamodb_client
-        self.ride_id = str(uuid.uuid4())
-        # Get current UTC timestamp with timezone
-        self.timestamp = datetime.now(timezone.utc).isoformat()
-
-    def __build_item(self, body):
-        try:
-            item = {
-                "rideId": {"S": self.ride_id},
-                "customerId": {"S": body["customerId"]},
-                "pickupLocation": {
-                    "M": {
-                        "latitude": {"N": str(body["pickupLocation"]["latitude"])},
-                        "longitude": {"N": str(body["pickupLocation"]["longitude"])},
-                    }
-                },
-                "destinationLocation": {
-                    "M": {
-                        "latitude": {"N": str(body["destinationLocation"]["latitude"])},
-                        "longitude": {
-                            "N": str(body["destinationLocation"]["longitude"])
-                        },
-                    }
-                },
-                "status": {"S": "requested"},
-                "timestamp": {"S": self.timestamp},
-            }
+        # ShardedIndexes whose shard keys are written with each item
+        self.indexes = indexes
+        self.max_batch_retries = max_batch_retries
+        self.base_retry_delay = base_retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.sleep = sleep
+
+    def __build_item(self, body, ride_id, timestamp):
+        try:
+            item = build_ride_request_item(body, ride_id, "requested", timestamp)
+            for index in self.indexes:
+                shard_key = index.shard_key(item[index.attribute]["S"], ride_id)
+                item[index.key_attribute] = {"S": shard_key}
             return SuccessResponse(item)
         except KeyError as e:
             return BadRequestResponse(f"Missing required field: {e}")
+        except (TypeError, ValueError) as e:
+            return BadRequestResponse(f"Invalid field value: {e}")
 
-    def store(self, body):
+    def store(
+        self, body, requested_at=None, timer=NULL_TIMER, ride_id=None, transact_items=()
+    ):
+        # With `transact_items` (TransactWriteItems entries) the ride is
+        # written in one transaction with them, and not at all if any of
+        # their conditions fails, which is answered with 409
         try:
-            item = self.__build_item(body)
+            timer.stage("build_item")
+            ride_id = ride_id or new_ride_id()
+            # Get current UTC timestamp with timezone
+            timestamp = (requested_at or datetime.now(timezone.utc)).isoformat()
+
+            item = self.__build_item(body, ride_id, timestamp)
 
             if item.status_code != 200:
                 return item
 
-            self.dynamodb_client.put_item(TableName=RIDE_REQUESTS_TABLE, Item=item.data)
-            return CreatedResponse()
+            timer.stage("put_item")
+            if transact_items:
+                if not self.__transact_put(item.data, transact_items):
+                    return ConflictResponse(
+                        "The ride request conflicts with a concurrent write"
+                    )
+            else:
+                self.dynamodb_client.put_item(
+                    TableName=RIDE_REQUESTS_TABLE, Item=item.data
+                )
+            return CreatedResponse({"rideId": ride_id, "timestamp": timestamp})
         except Exception as e:
             return InternalServerErrorResponse(
                 f"Failed to store ride request in DynamoDB: {e}"
             )
 
+    def __transact_put(self, item, transact_items):
+        # False when a condition cancelled the transaction
+        try:
+            self.dynamodb_client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Put": {
+                            "TableName": RIDE_REQUESTS_TABLE,
+                            "Item": item,
+                            "ConditionExpression": "attribute_not_exists(rideId)",
+                        }
+                    },
+                    *transact_items,
+                ]
+            )
+            return True
+        except Exception as e:
+            if error_code(e) != "TransactionCanceledException":
+                raise
+            return False
+
+    def store_many(self, bodies):
+        # Returns one result per body, in the same order
+        results = [None] * len(bodies)
+        pending = []
+        timestamp = datetime.now(timezone.utc).isoformat()
+
+        for index, body in enumerate(bodies):
+            ride_id = new_ride_id()
+            item = self.__build_item(body, ride_id, timestamp)
+
+            if item.status_code != 200:
+                results[index] = item
+                continue
+
+            results[index] = CreatedResponse(
+                {"rideId": ride_id, "timestamp": timestamp}
+            )
+            pending.append((index, item.data))
+
+        for start in range(0, len(pending), BATCH_WRITE_MAX_ITEMS):
+            chunk = pending[start : start + BATCH_WRITE_MAX_ITEMS]
+
+            for index, error_message in self.__batch_write(chunk):
+                results[index] = InternalServerErrorResponse(error_message)
+
+        return results
+
+    def __batch_write(self, chunk):
+        # Yields (index, error_message) for every item that could not be written
+        index_by_ride_id = {item["rideId"]["S"]: index for index, item in chunk}
+        put_requests = [{"PutRequest": {"Item": item}} for _, item in chunk]
+
+        try:
+            unprocessed = batch_write(
+                self.dynamodb_client,
+                RIDE_REQUESTS_TABLE,
+                put_requests,
+                self.max_batch_retries,
+                self.base_retry_delay,
+                self.max_retry_delay,
+                self.sleep,
+            )
+            error_message = (
+                "Failed to store ride request in DynamoDB: "
+                f"item still unprocessed after {self.max_batch_retries} retries"
+            )
+        except Exception as e:
+            unprocessed = put_requests
+            error_message = f"Failed to store ride request in DynamoDB: {e}"
+
+        for request in unprocessed:
+            ride_id = request["PutRequest"]["Item"]["rideId"]["S"]
+            yield index_by_ride_id[ride_id], error_message
+
 
 class RideRequestHandler:
     def __init__(
         self,
         request_validator: RequestValidator,
         ride_request_storage: RideRequestDynamoDBStorage,
+        eta_engine: EtaEngine = None,
+        surge_pricer: SurgePricer = None,
+        stage_metrics: StageMetrics = None,
     ):
         self.request_validator = request_validator
         self.ride_request_storage = ride_request_storage
+        self.eta_engine = eta_engine or EtaEngine()
+        self.surge_pricer = surge_pricer
+        # Per-stage latency of every invocation; off unless given
+        self.stage_metrics = stage_metrics or StageMetrics(enabled=False)
 
     def handle(self, event, context):
+        timer = self.stage_metrics.start()
+        error = None
+
         try:
-            # Parse request body
-            body = json.loads(event["body"])
+            body, result = self.parse_request(event, timer)
 
-            validation_result = self.request_validator.validate(body)
+            if result is None:
+                result = self.handle_valid_request(body, timer)
+        except json.JSONDecodeError:
+            result = BadRequestResponse("Invalid JSON in request body")
+        except Exception as e:
+            error = e
+            result = InternalServerErrorResponse("Internal Server Error")
 
-            if validation_result.status_code != 200:
-                return validation_result
+        timer.finish(result.status_code, error)
+        return result
 
-            # Store the ride request in DynamoDB
-            ride_request_store_result = self.ride_request_storage.store()
+    def handle_valid_request(self, body, timer=NULL_TIMER, completion=None):
+        # completion(result), if given, returns the TransactWriteItems
+        # entries to write in one transaction with the ride
+        timer.stage("surge")
+        surge_multiplier = self.record_demand(body)
 
-            if ride_request_store_result.status_code != 201:
-                return ride_request_store_result
+        if completion is not None:
+            result, ride_id, requested_at = self.prepare_response(
+                body, surge_multiplier, timer
+            )
+            if not result.is_success:
+                return result
 
-            ride_id = ride_request_store_result.ride_id
+            stored = self.ride_request_storage.store(
+                body,
+                requested_at,
+                timer,
+                ride_id=ride_id,
+                transact_items=completion(result),
+            )
+            return result if stored.status_code == 201 else stored
 
-            result = self.generate_success_response(ride_id)
+        # Store the ride request in DynamoDB; the request time is kept as a
+        # datetime rather than parsed back out of the stored timestamp
+        requested_at = datetime.now(timezone.utc)
+        ride_request_store_result = self.ride_request_storage.store(
+            body, requested_at, timer
+        )
 
-            return result
-        except json.JSONDecodeError:
-            return BadRequestResponse("Invalid JSON in request body")
-        except Exception:
-            return InternalServerErrorResponse("Internal Server Error")
+        if ride_request_store_result.status_code != 201:
+            return ride_request_store_result
+
+        timer.stage("response")
+        ride_id = ride_request_store_result.data["rideId"]
+
+        result = self.generate_success_response(
+            ride_id, body, requested_at, surge_multiplier
+        )
+
+        return result
 
-    def generate_success_response(self, ride_id):
+    def parse_request(self, event, timer=NULL_TIMER):
+        # Returns (body, None) for a valid request, else (None, error result)
+        timer.stage("parse")
+        size_result = self.request_validator.check_body_size(event["body"])
+
+        if size_result.status_code != 200:
+            return None, size_result
+
+        # Parse request body
+        body = json.loads(event["body"])
+
+        timer.stage("validate")
+        validation_result = self.request_validator.validate(body)
+
+        if validation_result.status_code != 200:
+            return None, validation_result
+
+        return body, None
+
+    def prepare_response(self, body, surge_multiplier=None, timer=NULL_TIMER):
+        # The response for a ride not stored yet, with the ride id and request
+        # time to store it under; for writes that must carry the response
+        timer.stage("response")
+        ride_id = new_ride_id()
+        requested_at = datetime.now(timezone.utc)
+        result = self.generate_success_response(
+            ride_id, body, requested_at, surge_multiplier
+        )
+        return result, ride_id, requested_at
+
+    def generate_success_response(
+        self, ride_id, body, requested_at, surge_multiplier=None
+    ):
         try:
             response_body = {
                 "rideId": ride_id,
                 "status": "requested",
-                "estimatedArrivalTime": self.calculate_estimated_arrival_time(),
+                "estimatedArrivalTime": self.calculate_estimated_arrival_time(
+                    body, requested_at
+                ),
             }
+            if surge_multiplier is not None:
+                response_body["surgeMultiplier"] = surge_multiplier
             return SuccessResponse(response_body)
         except Exception as e:
             return InternalServerErrorResponse(
                 f"Failed to generate success response: {e}"
             )
 
-    def calculate_estimated_arrival_time(self):
-        # Placeholder function for calculating estimated arrival time
-        # You can replace this with actual logic
-        return "2024-08-31T12:00:00Z"
+    def record_demand(self, body):
+        # Counts the request towards surge pricing at its pickup; returns the
+        # multiplier in effect there, or None without a surge pricer. Surge
+        # pricing is best effort; a failure must not fail the request
+        if self.surge_pricer is None:
+            return None
+
+        try:
+            return self.surge_pricer.record_request(body["pickupLocation"])
+        except Exception as e:
+            print(f"Surge pricing failed: {e!r}")
+            return None
+
+    def calculate_estimated_arrival_time(self, body, requested_at):
+        arrival = self.eta_engine.estimate_arrival(
+            body["pickupLocation"], body["destinationLocation"], requested_at
+        )
+        # Same text as strftime("%Y-%m-%dT%H:%M:%SZ"), in half the time
+        arrival = arrival.astimezone(timezone.utc).isoformat(timespec="seconds")
+        return arrival[:-6] + "Z"
+
+
+class AsyncRideRequestStorage:
+    """Async front for the blocking storage so that writes can overlap.
+
+    boto3 is synchronous, so calls run on a thread pool sized to the client's
+    connection pool while the event loop carries on with other work.
+    """
+
+    def __init__(self, ride_request_storage: RideRequestDynamoDBStorage, executor=None):
+        self.ride_request_storage = ride_request_storage
+        if executor is None:
+            # Imported here, like asyncio below, to keep them (and the ssl,
+            # socket and logging modules they pull in) off the cold start
+            # of the default synchronous pipeline
+            from concurrent.futures import ThreadPoolExecutor
+
+            executor = ThreadPoolExecutor(
+                max_workers=get_max_pool_connections(),
+                thread_name_prefix="ride-request-storage",
+            )
+        self.executor = executor
+
+    async def store(self, body, requested_at=None, ride_id=None, transact_items=()):
+        import asyncio
+        from functools import partial
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            partial(
+                self.ride_request_storage.store,
+                body,
+                requested_at,
+                ride_id=ride_id,
+                transact_items=transact_items,
+            ),
+        )
+
+    async def store_many(self, bodies):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.ride_request_storage.store_many, bodies
+        )
+
+
+_event_loops = threading.local()
+
+
+def run_sync(coroutine):
+    import asyncio
+
+    # One event loop per thread, kept for the life of the container, so a
+    # warm invocation does not pay for creating and closing a loop
+    loop = getattr(_event_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _event_loops.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+class AsyncRideRequestHandler(RideRequestHandler):
+    """Runs the independent steps of a request concurrently.
+
+    The write to DynamoDB, the optional candidate-driver lookup and the ETA
+    estimate all start together, so latency tracks the slowest of them
+    rather than their sum. `candidate_finder` is an async callable taking
+    the pickup location; its result is advisory, so a failure or a timeout
+    leaves it out of the response instead of failing the request. handle()
+    keeps the synchronous interface used by wrapped_lambda_handler.
+    """
+
+    def __init__(
+        self,
+        request_validator: RequestValidator,
+        ride_request_storage: AsyncRideRequestStorage,
+        eta_engine: EtaEngine = None,
+        candidate_finder=None,
+        candidate_timeout=0.5,
+        surge_pricer: SurgePricer = None,
+        stage_metrics: StageMetrics = None,
+    ):
+        super().__init__(
+            request_validator,
+            ride_request_storage,
+            eta_engine,
+            surge_pricer,
+            stage_metrics,
+        )
+        self.candidate_finder = candidate_finder
+        self.candidate_timeout = candidate_timeout
+
+    def handle(self, event, context):
+        return run_sync(self.handle_async(event, context))
+
+    def handle_valid_request(self, body, timer=NULL_TIMER, completion=None):
+        return run_sync(self.handle_valid_request_async(body, timer, completion))
+
+    async def handle_async(self, event, context):
+        timer = self.stage_metrics.start()
+        error = None
+
+        try:
+            body, result = self.parse_request(event, timer)
+
+            if result is None:
+                result = await self.handle_valid_request_async(body, timer)
+        except json.JSONDecodeError:
+            result = BadRequestResponse("Invalid JSON in request body")
+        except Exception as e:
+            error = e
+            result = InternalServerErrorResponse("Internal Server Error")
+
+        timer.finish(result.status_code, error)
+        return result
+
+    async def handle_valid_request_async(self, body, timer=NULL_TIMER, completion=None):
+        import asyncio
+
+        try:
+            timer.stage("surge")
+            surge_multiplier = self.record_demand(body)
+            if completion is not None:
+                return await self.store_with_response(
+                    body, surge_multiplier, completion, timer
+                )
+
+            # The steps overlap, so they are timed as one stage
+            timer.stage("concurrent")
+            requested_at = datetime.now(timezone.utc)
+            tasks = [
+                asyncio.ensure_future(
+                    self.ride_request_storage.store(body, requested_at)
+                )
+            ]
+            if self.candidate_finder is not None:
+                tasks.append(
+                    asyncio.ensure_future(self.find_candidates(body["pickupLocation"]))
+                )
+
+            # CPU-only, so it runs on the loop while the other steps wait on I/O
+            try:
+                estimated_arrival_time = self.calculate_estimated_arrival_time(
+                    body, requested_at
+                )
+                eta_error = None
+            except Exception as e:
+                eta_error = e
+
+            ride_request_store_result, *candidates = await asyncio.gather(*tasks)
+
+            if ride_request_store_result.status_code != 201:
+                return ride_request_store_result
+
+            timer.stage("response")
+            if eta_error is not None:
+                return InternalServerErrorResponse(
+                    f"Failed to generate success response: {eta_error}"
+                )
+
+            response_body = {
+                "rideId": ride_request_store_result.data["rideId"],
+                "status": "requested",
+                "estimatedArrivalTime": estimated_arrival_time,
+            }
+            if surge_multiplier is not None:
+                response_body["surgeMultiplier"] = surge_multiplier
+            if candidates and candidates[0] is not None:
+                response_body["candidateDrivers"] = candidates[0]
+            return SuccessResponse(response_body)
+        except Exception:
+            return InternalServerErrorResponse("Internal Server Error")
+
+    async def store_with_response(self, body, surge_multiplier, completion, timer):
+        # The ride is written in one transaction with completion(result), so
+        # the whole response, candidates included, comes before the write
+        result, ride_id, requested_at = self.prepare_response(
+            body, surge_multiplier, timer
+        )
+        if not result.is_success:
+            return result
+        if self.candidate_finder is not None:
+            candidates = await self.find_candidates(body["pickupLocation"])
+            if candidates is not None:
+                result.data["candidateDrivers"] = candidates
+
+        stored = await self.ride_request_storage.store(
+            body, requested_at, ride_id=ride_id, transact_items=completion(result)
+        )
+        return result if stored.status_code == 201 else stored
+
+    async def find_candidates(self, location):
+        import asyncio
+
+        try:
+            return await asyncio.wait_for(
+                self.candidate_finder(location), self.candidate_timeout
+            )
+        except Exception as e:
+            print(f"Candidate lookup failed: {e!r}")
+            return None
+
+
+class IdempotentRideRequestHandler:
+    """Collapses retries that carry the same Idempotency-Key header.
+
+    A replay is answered from the per-container cache, or from the record
+    claimed in the idempotency table by the first attempt, without touching
+    the ride table. Concurrent duplicates in one container wait for the
+    first to finish; across containers the conditional claim lets exactly
+    one through and the others get 409 until it completes. Only successful
+    responses are kept, so a failed attempt can be retried. Requests
+    without the header go straight to the wrapped handler.
+    """
+
+    def __init__(
+        self,
+        ride_request_handler: RideRequestHandler,
+        idempotency_storage: IdempotencyRecordStorage,
+        response_cache: TTLCache = None,
+    ):
+        self.ride_request_handler = ride_request_handler
+        self.idempotency_storage = idempotency_storage
+        self.response_cache = response_cache or TTLCache()
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+
+    def handle(self, event, context):
+        key = get_idempotency_key(event)
+
+        if key is None:
+            return self.ride_request_handler.handle(event, context)
+
+        if not is_valid_idempotency_key(key):
+            return BadRequestResponse(
+                "Idempotency-Key must be 1 to 255 printable ASCII characters"
+            )
+
+        timer = self.ride_request_handler.stage_metrics.start()
+        error = None
+
+        try:
+            body, result = self.ride_request_handler.parse_request(event, timer)
+
+            if result is None:
+                result = self.handle_once(key, fingerprint(body), body, timer)
+        except json.JSONDecodeError:
+            result = BadRequestResponse("Invalid JSON in request body")
+        except Exception as e:
+            error = e
+            result = InternalServerErrorResponse("Internal Server Error")
+
+        timer.finish(result.status_code, error)
+        return result
+
+    def handle_once(self, key, request_fingerprint, body, timer=NULL_TIMER):
+        timer.stage("idempotency")
+        while True:
+            cached = self.response_cache.get(key)
+
+            if cached is not None:
+                return self.replay(cached, request_fingerprint)
+
+            with self.in_flight_lock:
+                done = self.in_flight.get(key)
+                if done is None:
+                    done = self.in_flight[key] = threading.Event()
+                    break
+
+            # Another thread in this container is running the same key; its
+            # response is cached when it succeeds, otherwise we take over
+            done.wait()
+
+        try:
+            return self.execute(key, request_fingerprint, body, timer)
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+            done.set()
+
+    def execute(self, key, request_fingerprint, body, timer=NULL_TIMER):
+        record = self.idempotency_storage.claim(key, request_fingerprint)
+
+        if record is not None:
+            if record.fingerprint != request_fingerprint:
+                return self.mismatch()
+            if record.status != COMPLETED:
+                return ConflictResponse(
+                    "A request with this Idempotency-Key is still in progress"
+                )
+
+            result = HttpResponse(record.status_code, json.loads(record.response_body))
+            self.response_cache.put(key, (request_fingerprint, result))
+            return result
+
+        def completion(result):
+            # Written with the ride, so a retry finds both or neither
+            return [
+                self.idempotency_storage.completion(
+                    key, request_fingerprint, result.status_code, dumps(result.data)
+                )
+            ]
+
+        try:
+            result = self.ride_request_handler.handle_valid_request(
+                body, timer, completion
+            )
+        except Exception:
+            self.idempotency_storage.release(key)
+            raise
+
+        if result.status_code == 409:
+            # The claim was taken over after its lock expired; the key is
+            # no longer ours to release
+            return ConflictResponse(
+                "A request with this Idempotency-Key is still in progress"
+            )
+        if not result.is_success:
+            self.idempotency_storage.release(key)
+            return result
+
+        self.response_cache.put(key, (request_fingerprint, result))
+        return result
+
+    def replay(self, cached, request_fingerprint):
+        cached_fingerprint, result = cached
+
+        if cached_fingerprint != request_fingerprint:
+            return self.mismatch()
+        return result
+
+    @staticmethod
+    def mismatch():
+        return UnprocessableEntityResponse(
+            "Idempotency-Key was already used with a different request body"
+        )
+
+
+class RideRequestBatchHandler(BatchRecordHandler):
+    def __init__(
+        self,
+        request_validator: RequestValidator,
+        ride_request_storage: RideRequestDynamoDBStorage,
+    ):
+        self.request_validator = request_validator
+        self.ride_request_storage = ride_request_storage
+
+    def process(self, records):
+        # Only retryable failures are reported back, so invalid records are
+        # dropped instead of being redelivered until they reach the DLQ
+        failed = []
+        record_ids = []
+        bodies = []
+
+        for record_id, body in records:
+            validation_result = self.request_validator.validate(body)
+
+            if validation_result.status_code != 200:
+                print(
+                    f"Dropping invalid record {record_id}: "
+                    f"{validation_result.error_message}"
+                )
+                continue
+
+            record_ids.append(record_id)
+            bodies.append(body)
+
+        results = self.ride_request_storage.store_many(bodies)
+
+        for record_id, result in zip(record_ids, results):
+            if result.status_code >= 500:
+                failed.append(record_id)
+            elif result.status_code >= 400:
+                print(f"Dropping invalid record {record_id}: {result.error_message}")
+
+        return failed
+
+
+class RideStatusBatchHandler(BatchRecordHandler):
+    """Applies a batch of ride status events through a write-behind buffer.
+
+    Rides often change status several times within one batch; only the
+    latest state of each ride (by updatedAt) is written, with one
+    RideLifecycle.record_status per ride, and the buffer is flushed before
+    the invocation returns. Records for rides that still could not be
+    written are reported as failures.
+    """
+
+    def __init__(self, write_buffer: WriteBehindBuffer):
+        self.write_buffer = write_buffer
+
+    def process(self, records):
+        ride_id_by_record = {}
+
+        for record_id, body in records:
+            errors = validate_ride_status_event(body)
+
+            if errors is not None:
+                print(f"Dropping invalid record {record_id}: {format_errors(errors)}")
+                continue
+
+            try:
+                # The event's updatedAt is when the source changed the
+                # status; the ride keeps it as reportedAt
+                item = RIDE_STATUS_ITEM.marshal(
+                    {**body, "reportedAt": body["updatedAt"]}
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Dropping invalid record {record_id}: {e}")
+                continue
+
+            self.write_buffer.put(item, order=body["updatedAt"])
+            ride_id_by_record[record_id] = body["rideId"]
+
+        try:
+            self.write_buffer.flush()
+            failed = set()
+        except FlushError as e:
+            failed = set(e.keys)
+
+        return [
+            record_id
+            for record_id, ride_id in ride_id_by_record.items()
+            if ride_id in failed
+        ]
+
+
+class RideMatchBatchHandler(BatchRecordHandler):
+    """Accepts the matches ride_match publishes, moving rides to "matched".
+
+    Each match is one RideLifecycle accept. A ride that was cancelled, or
+    matched by another batch, in the meantime keeps its status and the
+    match is dropped; failed writes are reported for redelivery.
+    """
+
+    def __init__(self, ride_lifecycle: RideLifecycle):
+        self.ride_lifecycle = ride_lifecycle
+
+    def process(self, records):
+        failed = []
+
+        for record_id, body in records:
+            try:
+                ride_id, driver_id = body["rideId"], body["driverId"]
+            except KeyError as e:
+                print(f"Dropping malformed record {record_id}: {e}")
+                continue
+
+            try:
+                result = self.ride_lifecycle.accept(ride_id, driver_id)
+            except Exception as e:
+                print(f"Failed to accept match for ride {ride_id}: {e!r}")
+                failed.append(record_id)
+                continue
+
+            if not result.is_success:
+                print(f"Dropping match for ride {ride_id}: {result!r}")
+
+        return failed
+
+
+class SurgeSupplyHandler:
+    """Publishes available drivers per surge cell from the driver ping stream.
+
+    `batch_handler` feeds the pings to `supply_counter`, a SurgePricer used
+    only for its driver counts, which are then written to `supply_table`.
+    Ride request containers never see driver pings and read the counts
+    from there. Counts that could not be written are retried with the next
+    batch, so the records are not reported as failures.
+    """
+
+    def __init__(self, batch_handler, supply_counter: SurgePricer, supply_table):
+        self.batch_handler = batch_handler
+        self.supply_counter = supply_counter
+        self.supply_table = supply_table
+
+    def handle(self, event, context):
+        result = self.batch_handler.handle(event, context)
+        failed = self.supply_table.publish(self.supply_counter.available_by_cell())
+        if failed:
+            print(f"Surge supply of {len(failed)} cells not written; will retry")
+        return result
+
+
+class RideTransitionHandler:
+    """Moves a ride through its lifecycle: POST /rides/{rideId}/{action}.
+
+    The action is one of the RideLifecycle transitions (accept, arrive,
+    start, complete, cancel). Accept needs a "driverId" in the body; any
+    action may pass "expectedVersion" to fail with 409 if the ride changed
+    since the client last saw it. Every request, including one that loses
+    a race, costs a single conditional UpdateItem.
+    """
+
+    def __init__(self, ride_lifecycle: RideLifecycle, max_body_length=MAX_BODY_LENGTH):
+        self.ride_lifecycle = ride_lifecycle
+        self.max_body_length = max_body_length
+
+    def handle(self, event, context):
+        try:
+            path_parameters = event.get("pathParameters") or {}
+            ride_id = path_parameters.get("rideId")
+            action = path_parameters.get("action")
+
+            if action not in TRANSITIONS:
+                return NotFoundResponse(f"Unknown ride action: {action}")
+            if not ride_id:
+                return BadRequestResponse("Missing ride id")
+
+            raw_body = event.get("body")
+            if raw_body is not None and len(raw_body) > self.max_body_length:
+                return PayloadTooLargeResponse(
+                    f"Request body exceeds {self.max_body_length} characters"
+                )
+
+            body = json.loads(raw_body) if raw_body else {}
+            if type(body) is not dict:
+                return BadRequestResponse("body must be a JSON object")
+
+            expected_version = body.get("expectedVersion")
+            if expected_version is not None and (
+                type(expected_version) is not int or expected_version < 0
+            ):
+                return BadRequestResponse(
+                    "expectedVersion must be a non-negative integer"
+                )
+
+            if action == "accept":
+                errors = validate_ride_accept(body)
+
+                if errors is not None:
+                    return BadRequestResponse(format_errors(errors))
+
+                result = self.ride_lifecycle.accept(
+                    ride_id, body["driverId"], expected_version
+                )
+            else:
+                result = self.ride_lifecycle.transition(
+                    ride_id, action, expected_version
+                )
+
+            return self.to_response(action, result, expected_version)
+        except json.JSONDecodeError:
+            return BadRequestResponse("Invalid JSON in request body")
+        except Exception as e:
+            print(f"Ride transition failed: {e!r}")
+            return InternalServerErrorResponse("Internal Server Error")
+
+    @staticmethod
+    def to_response(action, result, expected_version=None):
+        if isinstance(result, RideNotFound):
+            return NotFoundResponse(f"Ride {result.ride_id} not found")
+        if isinstance(result, InvalidTransition):
+            return ConflictResponse(f"Cannot {action} a ride that is {result.status}")
+        if isinstance(result, VersionConflict):
+            return ConflictResponse(
+                f"Ride is at version {result.version}, not {expected_version}"
+            )
+        return SuccessResponse(
+            {
+                "rideId": result.ride_id,
+                "status": result.status,
+                "version": result.version,
+            }
+        )
+
+
+class RideHistoryHandler:
+    """A customer's rides, newest first: GET /customers/{customerId}/rides.
+
+    Reads the sharded CustomerRides index with key-condition queries,
+    projected to RIDE_SUMMARY_ITEM, one page of `limit` rides (query string,
+    default 20) at a time. "nextCursor" in the response is an opaque token
+    for the following page, passed back as ?cursor=, and is null on the
+    last page. First pages, which is what opening the app shows, are cached
+    per container for a few seconds, so a ride booked since may take that
+    long to appear.
+    """
+
+    def __init__(
+        self,
+        ride_history_reader: ScatterGatherReader,
+        first_page_cache: TTLCache,
+        default_limit=20,
+        max_limit=100,
+    ):
+        self.ride_history_reader = ride_history_reader
+        self.first_page_cache = first_page_cache
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+
+    def handle(self, event, context):
+        try:
+            customer_id = (event.get("pathParameters") or {}).get("customerId")
+
+            if not is_valid_id(customer_id):
+                return BadRequestResponse(
+                    "customerId must be an id of letters, digits, - or _"
+                )
+
+            parameters = event.get("queryStringParameters") or {}
+            limit = parameters.get("limit", str(self.default_limit))
+            if not limit.isdecimal() or not 1 <= int(limit) <= self.max_limit:
+                return BadRequestResponse(
+                    f"limit must be a number between 1 and {self.max_limit}"
+                )
+            limit = int(limit)
+
+            cursor = parameters.get("cursor")
+            if cursor is None:
+                cached = self.first_page_cache.get((customer_id, limit))
+                if cached is not None:
+                    return SuccessResponse(cached)
+                positions = None
+            else:
+                try:
+                    positions = self.ride_history_reader.decode_positions(
+                        customer_id, cursor
+                    )
+                except ValueError:
+                    return BadRequestResponse("Invalid cursor")
+
+            items, next_positions = self.ride_history_reader.query_page(
+                customer_id,
+                limit,
+                positions,
+                attributes=list(RIDE_SUMMARY_ITEM.attributes),
+            )
+            page = {
+                "rides": [RIDE_SUMMARY_ITEM.unmarshal(item) for item in items],
+                "nextCursor": (
+                    self.ride_history_reader.encode_positions(next_positions)
+                    if next_positions is not None
+                    else None
+                ),
+            }
+
+            if cursor is None:
+                self.first_page_cache.put((customer_id, limit), page)
+            return SuccessResponse(page)
+        except Exception as e:
+            print(f"Ride history query failed: {e!r}")
+            return InternalServerErrorResponse("Internal Server Error")
+
+
+class FareEstimateHandler:
+    """Quotes a fare before booking: POST /fares/estimate.
+
+    The body holds the "pickupLocation" and "destinationLocation" of a ride
+    request. Quotes come from a FareEstimator, which serves repeated quotes
+    for nearly the same trip from its cache.
+    """
+
+    def __init__(self, fare_estimator: FareEstimator, max_body_length=MAX_BODY_LENGTH):
+        self.fare_estimator = fare_estimator
+        self.max_body_length = max_body_length
+
+    def handle(self, event, context):
+        try:
+            raw_body = event.get("body")
+            if raw_body is not None and len(raw_body) > self.max_body_length:
+                return PayloadTooLargeResponse(
+                    f"Request body exceeds {self.max_body_length} characters"
+                )
+
+            body = json.loads(raw_body) if raw_body else {}
+            errors = validate_fare_estimate(body)
+
+            if errors is not None:
+                return BadRequestResponse(format_errors(errors))
+
+            return SuccessResponse(
+                self.fare_estimator.estimate(
+                    body["pickupLocation"], body["destinationLocation"]
+                )
+            )
+        except json.JSONDecodeError:
+            return BadRequestResponse("Invalid JSON in request body")
+        except Exception as e:
+            print(f"Fare estimate failed: {e!r}")
+            return InternalServerErrorResponse("Internal Server Error")
 
 
 def format_lambda_response(result):
-    return {
-        "statusCode": result.status_code,
-        "body": json.dumps(
-            result.data if result.data else {"message": result.error_message}
+    return result.to_dict()
+
+
+def create_ride_request_handler(registry):
+    # RIDE_REQUEST_PIPELINE=async overlaps storage with the other steps
+    if os.environ.get("RIDE_REQUEST_PIPELINE") == "async":
+        return AsyncRideRequestHandler(
+            registry.get("request_validator"),
+            AsyncRideRequestStorage(registry.get("ride_request_storage")),
+            registry.get("eta_engine"),
+            surge_pricer=registry.get("surge_pricer"),
+            stage_metrics=registry.get("stage_metrics"),
+        )
+    return RideRequestHandler(
+        registry.get("request_validator"),
+        registry.get("ride_request_storage"),
+        registry.get("eta_engine"),
+        registry.get("surge_pricer"),
+        registry.get("stage_metrics"),
+    )
+
+
+def create_surge_supply_handler(registry):
+    # Imported here, off the cold start of the ride request entry point,
+    # which never consumes driver pings
+    from common.driver_ingestion import (
+        DriverLocationBatchHandler,
+        DriverLocationIngestor,
+    )
+
+    supply_counter = registry.get("surge_supply_counter")
+    return SurgeSupplyHandler(
+        DriverLocationBatchHandler(DriverLocationIngestor(driver_index=supply_counter)),
+        supply_counter,
+        registry.get("surge_supply_table"),
+    )
+
+
+def create_ride_indexes():
+    # Shard counts bound each index key's share of a surge; readers query
+    # every shard, so they are kept as low as the peak write rate allows
+    return (
+        ShardedIndex(
+            CUSTOMER_RIDES_INDEX,
+            "customerId",
+            "timestamp",
+            int(os.environ.get("CUSTOMER_RIDES_INDEX_SHARDS", 4)),
         ),
-        "headers": {"Content-Type": "application/json"},
-    }
+        ShardedIndex(
+            RIDES_BY_STATUS_INDEX,
+            "status",
+            "timestamp",
+            int(os.environ.get("RIDES_BY_STATUS_INDEX_SHARDS", 16)),
+        ),
+    )
+
+
+def register_resources(registry):
+    registry.register("dynamodb_client", lambda r: LazyClient(create_dynamodb_client))
+    registry.register("request_validator", lambda r: RequestValidator())
+    registry.register("ride_indexes", lambda r: create_ride_indexes())
+    registry.register(
+        "ride_request_storage",
+        lambda r: RideRequestDynamoDBStorage(
+            r.get("dynamodb_client"), indexes=r.get("ride_indexes")
+        ),
+    )
+    registry.register("eta_engine", lambda r: EtaEngine.from_environment())
+    registry.register(
+        "surge_supply_table",
+        lambda r: SurgeSupplyTable.from_environment(r.get("dynamodb_client")),
+    )
+    # Outlives client invalidation; its counts are the container's history.
+    # Supply comes from the table, which the surge supply entry point keeps
+    # current; the table is looked up on every read so as not to depend on it
+    registry.register(
+        "surge_pricer",
+        lambda r: SurgePricer.from_environment(
+            supply_source=lambda cells: r.get("surge_supply_table").read(cells)
+        ),
+    )
+    # Counts drivers for the surge supply entry point; outlives client
+    # invalidation, like surge_pricer, so as not to forget the drivers
+    registry.register("surge_supply_counter", lambda r: SurgePricer.from_environment())
+    registry.register("surge_supply_handler", create_surge_supply_handler)
+    # Outlives client invalidation, so only the first invocation counts as cold
+    registry.register("stage_metrics", lambda r: StageMetrics.from_environment())
+    registry.register(
+        "invocation_profiler", lambda r: InvocationProfiler.from_environment()
+    )
+    registry.register(
+        "fare_estimator",
+        lambda r: FareEstimator.from_environment(
+            r.get("eta_engine"), r.get("surge_pricer")
+        ),
+    )
+    registry.register(
+        "fare_estimate_handler",
+        lambda r: FareEstimateHandler(r.get("fare_estimator")),
+    )
+    # Outlives client invalidation so that replays keep hitting the cache
+    registry.register(
+        "idempotency_cache",
+        lambda r: TTLCache(
+            maxsize=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 4096)),
+            ttl=float(os.environ.get("IDEMPOTENCY_CACHE_TTL_SECONDS", 900)),
+        ),
+    )
+    registry.register(
+        "idempotency_storage",
+        lambda r: IdempotencyRecordStorage(r.get("dynamodb_client")),
+    )
+    registry.register(
+        "ride_request_handler",
+        lambda r: IdempotentRideRequestHandler(
+            create_ride_request_handler(r),
+            r.get("idempotency_storage"),
+            r.get("idempotency_cache"),
+        ),
+    )
+    registry.register(
+        "ride_request_batch_handler",
+        lambda r: RideRequestBatchHandler(
+            r.get("request_validator"), r.get("ride_request_storage")
+        ),
+    )
+    registry.register(
+        "ride_status_buffer",
+        lambda r: WriteBehindBuffer(
+            r.get("dynamodb_client"),
+            RIDE_REQUESTS_TABLE,
+            "rideId",
+            # Statuses update the ride, which RideLifecycle also writes to
+            write_item=r.get("ride_lifecycle").record_status,
+            max_items=int(os.environ.get("RIDE_STATUS_BUFFER_MAX_ITEMS", 100)),
+            max_age=float(os.environ.get("RIDE_STATUS_BUFFER_MAX_AGE_SECONDS", 1.0)),
+        ),
+    )
+    registry.register(
+        "ride_status_batch_handler",
+        lambda r: RideStatusBatchHandler(r.get("ride_status_buffer")),
+    )
+    registry.register(
+        "ride_lifecycle",
+        lambda r: RideLifecycle(
+            r.get("dynamodb_client"), RIDE_REQUESTS_TABLE, r.get("ride_indexes")
+        ),
+    )
+    registry.register(
+        "ride_transition_handler",
+        lambda r: RideTransitionHandler(r.get("ride_lifecycle")),
+    )
+    registry.register(
+        "ride_match_batch_handler",
+        lambda r: RideMatchBatchHandler(r.get("ride_lifecycle")),
+    )
+    registry.register(
+        "ride_history_reader",
+        lambda r: ScatterGatherReader(
+            r.get("dynamodb_client"),
+            RIDE_REQUESTS_TABLE,
+            next(
+                index
+                for index in r.get("ride_indexes")
+                if index.name == CUSTOMER_RIDES_INDEX
+            ),
+        ),
+    )
+    # Outlives client invalidation, like the idempotency cache
+    registry.register(
+        "ride_history_cache",
+        lambda r: TTLCache(
+            maxsize=int(os.environ.get("RIDE_HISTORY_CACHE_SIZE", 1024)),
+            ttl=float(os.environ.get("RIDE_HISTORY_CACHE_TTL_SECONDS", 5)),
+        ),
+    )
+    registry.register(
+        "ride_history_handler",
+        lambda r: RideHistoryHandler(
+            r.get("ride_history_reader"), r.get("ride_history_cache")
+        ),
+    )
+    return registry
+
+
+# Reused while the container is warm. The handler graph is deterministic and
+# cheap, so it is built here during the init phase; only the DynamoDB client
+# (and boto3 with it) waits for the first request that needs storage.
+resources = register_resources(ResourceRegistry())
+resources.get("ride_request_handler")
+resources.get("ride_request_batch_handler")
+resources.get("ride_status_batch_handler")
+resources.get("ride_transition_handler")
+resources.get("ride_match_batch_handler")
+resources.get("ride_history_handler")
+resources.get("fare_estimate_handler")
 
 
 def wrapped_lambda_handler(event, context):
-    dynamodb_client = boto3.client("dynamodb")
-    request_validator = RequestValidator()
-    ride_request_storage = RideRequestDynamoDBStorage(dynamodb_client)
-    lambda_handler = RideRequestHandler(request_validator, ride_request_storage)
-    result = lambda_handler.handle(event, context)
+    lambda_handler = resources.get("ride_request_handler")
+    # RIDE_REQUEST_PROFILE samples invocations under cProfile or tracemalloc
+    profiler = resources.get("invocation_profiler")
+
+    try:
+        result = profiler.run(lambda_handler.handle, event, context)
+    except Exception:
+        resources.invalidate("dynamodb_client")
+        raise
+
+    if result.status_code >= 500:
+        # Drop the client (and the handler graph built on it) so a broken
+        # connection pool is not reused by the next invocation
+        resources.invalidate("dynamodb_client")
+
     formatted_response = format_lambda_response(result)
     return formatted_response
+
+
+def wrapped_batch_handler(event, context):
+    # SQS / Kinesis entry point; requires ReportBatchItemFailures on the mapping
+    batch_handler = resources.get("ride_request_batch_handler")
+
+    try:
+        return batch_handler.handle(event, context)
+    except Exception:
+        resources.invalidate("dynamodb_client")
+        raise
+
+
+def wrapped_status_batch_handler(event, context):
+    # SQS / Kinesis entry point for ride status events; the handler flushes
+    # its buffer before returning, since the container may freeze after this
+    status_handler = resources.get("ride_status_batch_handler")
+
+    try:
+        return status_handler.handle(event, context)
+    except Exception:
+        resources.invalidate("dynamodb_client")
+        raise
+
+
+def wrapped_transition_handler(event, context):
+    transition_handler = resources.get("ride_transition_handler")
+
+    try:
+        result = transition_handler.handle(event, context)
+    except Exception:
+        resources.invalidate("dynamodb_client")
+        raise
+
+    if result.status_code >= 500:
+        resources.invalidate("dynamodb_client")
+
+    return format_lambda_response(result)
+
+
+def wrapped_match_handler(event, context):
+    # SQS entry point for the matches ride_match publishes
+    match_handler = resources.get("ride_match_batch_handler")
+
+    try:
+        return match_handler.handle(event, context)
+    except Exception:
+        resources.invalidate("dynamodb_client")
+        raise
+
+
+def wrapped_history_handler(event, context):
+    history_handler = resources.get("ride_history_handler")
+
+    try:
+        result = history_handler.handle(event, context)
+    except Exception:
+        resources.invalidate("dynamodb_client")
+        raise
+
+    if result.status_code >= 500:
+        resources.invalidate("dynamodb_client")
+
+    return format_lambda_response(result)
+
+
+def wrapped_fare_estimate_handler(event, context):
+    # Quotes only reach DynamoDB through the surge pricer's supply reads,
+    # whose failures it absorbs, so there is no client to invalidate
+    return format_lambda_response(
+        resources.get("fare_estimate_handler").handle(event, context)
+    )
+
+
+def wrapped_surge_supply_handler(event, context):
+    # Driver location stream entry point; keeps the SurgeSupply table that
+    # ride request containers price from current
+    supply_handler = resources.get("surge_supply_handler")
+
+    try:
+        return supply_handler.handle(event, context)
+    except Exception:
+        resources.invalidate("dynamodb_client")
+        raise
@@ -0,0 +1,153 @@
+import functools
+import json
+import math
+import os
+from datetime import timedelta
+
+from common.geo import haversine_km
+
+DEFAULT_CELL_SIZE_DEGREES = 0.01
+DEFAULT_BUCKET_MINUTES = 60
+DEFAULT_CACHE_SIZE = 4096
+# Straight-line distance is shorter than the road route
+DEFAULT_DETOUR_FACTOR = 1.3
+# Hourly average road speeds used when a cell pair is not in the matrix
+# fmt: off
+DEFAULT_SPEEDS_KMH = (
+    32, 34, 35, 35, 34, 30, 24, 18, 16, 20, 23, 23,
+    22, 22, 22, 21, 19, 16, 15, 18, 22, 25, 28, 30,
+)
+# fmt: on
+MINUTES_PER_DAY = 24 * 60
+
+
+class EtaEngine:
+    """Travel-time estimates from a precomputed cell-to-cell matrix.
+
+    The matrix maps (origin cell, destination cell) to one travel time in
+    seconds per time-of-day bucket. Lookups interpolate between the two
+    nearest buckets and scale by the exact distance between the points, so
+    an estimate is a dict lookup plus a few float operations. Exact
+    origin/destination/minute triples are memoized in a bounded LRU.
+    """
+
+    def __init__(
+        self,
+        travel_times=None,
+        cell_size=DEFAULT_CELL_SIZE_DEGREES,
+        bucket_minutes=DEFAULT_BUCKET_MINUTES,
+        speeds_kmh=DEFAULT_SPEEDS_KMH,
+        utc_offset_minutes=0,
+        detour_factor=DEFAULT_DETOUR_FACTOR,
+        cache_size=DEFAULT_CACHE_SIZE,
+    ):
+        self.travel_times = travel_times or {}
+        self.cell_size = cell_size
+        self.bucket_minutes = bucket_minutes
+        self.bucket_count = MINUTES_PER_DAY // bucket_minutes
+        self.speeds_kmh = self.__per_bucket(speeds_kmh)
+        self.utc_offset_minutes = utc_offset_minutes
+        self.detour_factor = detour_factor
+        self.estimate_seconds = functools.lru_cache(maxsize=cache_size)(
+            self.__estimate_seconds
+        )
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        # {"cellSize": 0.01, "bucketMinutes": 60, "utcOffsetMinutes": 0,
+        #  "speedsKmh": [...], "travelTimes": {"oi,oj|di,dj": [seconds, ...]}}
+        with open(path, encoding="utf-8") as matrix_file:
+            data = json.load(matrix_file)
+
+        bucket_minutes = data.get("bucketMinutes", DEFAULT_BUCKET_MINUTES)
+        bucket_count = MINUTES_PER_DAY // bucket_minutes
+        travel_times = {}
+        for key, seconds in data.get("travelTimes", {}).items():
+            # A short row would only fail once a request looked it up
+            if len(seconds) != bucket_count:
+                raise ValueError(
+                    f"Travel times for {key} have {len(seconds)} buckets, "
+                    f"expected {bucket_count}"
+                )
+            origin, destination = key.split("|")
+            oi, oj = map(int, origin.split(","))
+            di, dj = map(int, destination.split(","))
+            travel_times[(oi, oj, di, dj)] = tuple(map(float, seconds))
+
+        return cls(
+            travel_times,
+            cell_size=data.get("cellSize", DEFAULT_CELL_SIZE_DEGREES),
+            bucket_minutes=bucket_minutes,
+            speeds_kmh=data.get("speedsKmh", DEFAULT_SPEEDS_KMH),
+            utc_offset_minutes=data.get("utcOffsetMinutes", 0),
+            **kwargs,
+        )
+
+    @classmethod
+    def from_environment(cls):
+        # ETA_MATRIX_PATH is optional; without it only the speed model is used
+        path = os.environ.get("ETA_MATRIX_PATH")
+        cache_size = int(os.environ.get("ETA_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+
+        if path:
+            return cls.from_file(path, cache_size=cache_size)
+        return cls(cache_size=cache_size)
+
+    def cell_of(self, latitude, longitude):
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def estimate_arrival(self, origin, destination, departure):
+        minute_of_day = (
+            departure.hour * 60 + departure.minute + self.utc_offset_minutes
+        ) % MINUTES_PER_DAY
+        seconds = self.estimate_seconds(
+            float(origin["latitude"]),
+            float(origin["longitude"]),
+            float(destination["latitude"]),
+            float(destination["longitude"]),
+            minute_of_day,
+        )
+        return departure + timedelta(seconds=seconds)
+
+    def __estimate_seconds(self, lat1, lon1, lat2, lon2, minute_of_day):
+        # Interpolate between the centres of the two surrounding buckets
+        position = (minute_of_day - self.bucket_minutes / 2) / self.bucket_minutes
+        first = math.floor(position)
+        weight = position - first
+        first %= self.bucket_count
+        second = (first + 1) % self.bucket_count
+
+        distance = haversine_km(lat1, lon1, lat2, lon2)
+
+        # Without a matrix every pair takes the speed model; skip the cells
+        if self.travel_times:
+            origin_cell = self.cell_of(lat1, lon1)
+            destination_cell = self.cell_of(lat2, lon2)
+            seconds = self.travel_times.get(origin_cell + destination_cell)
+
+            if seconds is not None and origin_cell != destination_cell:
+                travel_time = seconds[first] * (1 - weight) + seconds[second] * weight
+                centre_distance = haversine_km(
+                    *self.__cell_centre(origin_cell),
+                    *self.__cell_centre(destination_cell),
+                )
+                return travel_time * distance / centre_distance
+
+        speed = self.speeds_kmh[first] * (1 - weight) + self.speeds_kmh[second] * weight
+        return distance * self.detour_factor / speed * 3600
+
+    def __cell_centre(self, cell):
+        return (cell[0] + 0.5) * self.cell_size, (cell[1] + 0.5) * self.cell_size
+
+    def __per_bucket(self, speeds_kmh):
+        # Resample an hourly (or any length) speed profile onto the buckets
+        speeds_kmh = list(speeds_kmh)
+        return [
+            speeds_kmh[
+                bucket * self.bucket_minutes * len(speeds_kmh) // MINUTES_PER_DAY
+            ]
+            for bucket in range(self.bucket_count)
+        ]
@@ -0,0 +1,225 @@
+import functools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from common.geo import haversine_km
+from ride_request.eta import MINUTES_PER_DAY, EtaEngine
+from ride_request.metrics import DEFAULT_NAMESPACE, DEFAULT_SERVICE, write_line
+from ride_request.serialization import dumps
+from ride_request.surge import SurgePricer
+
+# About 110 m north-south
+DEFAULT_QUANTUM_DEGREES = 0.001
+DEFAULT_SLOT_MINUTES = 5
+DEFAULT_CACHE_SIZE = 8192
+# Quotes are reused until the surge multipliers have been updated this often
+DEFAULT_CACHE_EPOCHS = 1
+DEFAULT_REPORT_EVERY = 1000
+DEFAULT_BASE_FARE = 2.50
+DEFAULT_PER_KM = 1.25
+DEFAULT_PER_MINUTE = 0.30
+DEFAULT_MINIMUM_FARE = 6.00
+DEFAULT_CURRENCY = "GBP"
+
+
+class EpochLRUCache:
+    """Thread-safe LRU whose entries expire `ttl_epochs` epochs after insert.
+
+    Epochs are whatever the caller passes in, e.g. SurgePricer.epoch, so
+    entries live exactly as long as the data they were derived from.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl_epochs=DEFAULT_CACHE_EPOCHS):
+        self.maxsize = maxsize
+        self.ttl_epochs = ttl_epochs
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, epoch):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and epoch - entry[0] < self.ttl_epochs:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, epoch):
+        with self.lock:
+            self.entries[key] = (epoch, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def counts(self):
+        # (hits, misses), read together so concurrent lookups cannot skew them
+        with self.lock:
+            return self.hits, self.misses
+
+    @property
+    def hit_rate(self):
+        hits, misses = self.counts()
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class FareEstimator:
+    """Fare quotes for a pickup and destination, memoized per grid square.
+
+    Both points are snapped to the centre of their `quantum_degrees` square
+    and the departure, in the EtaEngine's local time, to the start of its
+    `slot_minutes` slot, so the near-identical quotes a customer asks for
+    before confirming share one computation. The route is EtaEngine's:
+    straight-line distance times its detour factor, and its travel time.
+    The fare is base + per km + per minute, at least the minimum, times the
+    surge multiplier at the pickup.
+
+    Routes and their unsurged fares are memoized in a bounded LRU. Finished
+    quotes are cached until the surge multipliers have been updated
+    `cache_epochs` times. Both hit rates are emitted as embedded metrics
+    every `report_every` quotes.
+    """
+
+    def __init__(
+        self,
+        eta_engine: EtaEngine = None,
+        surge_pricer: SurgePricer = None,
+        quantum_degrees=DEFAULT_QUANTUM_DEGREES,
+        slot_minutes=DEFAULT_SLOT_MINUTES,
+        cache_size=DEFAULT_CACHE_SIZE,
+        cache_epochs=DEFAULT_CACHE_EPOCHS,
+        base_fare=DEFAULT_BASE_FARE,
+        per_km=DEFAULT_PER_KM,
+        per_minute=DEFAULT_PER_MINUTE,
+        minimum_fare=DEFAULT_MINIMUM_FARE,
+        currency=DEFAULT_CURRENCY,
+        report_every=DEFAULT_REPORT_EVERY,
+        namespace=DEFAULT_NAMESPACE,
+        write=write_line,
+    ):
+        self.eta_engine = eta_engine or EtaEngine()
+        self.surge_pricer = surge_pricer
+        self.quantum_degrees = quantum_degrees
+        self.slot_minutes = slot_minutes
+        self.quote_cache = EpochLRUCache(cache_size, cache_epochs)
+        self.route_fare = functools.lru_cache(maxsize=cache_size)(self.__route_fare)
+        self.base_fare = base_fare
+        self.per_km = per_km
+        self.per_minute = per_minute
+        self.minimum_fare = minimum_fare
+        self.currency = currency
+        self.report_every = report_every
+        self.namespace = namespace
+        self.write = write
+
+    @classmethod
+    def from_environment(cls, eta_engine=None, surge_pricer=None):
+        return cls(
+            eta_engine,
+            surge_pricer,
+            quantum_degrees=float(
+                os.environ.get("FARE_QUANTUM_DEGREES", DEFAULT_QUANTUM_DEGREES)
+            ),
+            cache_size=int(os.environ.get("FARE_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+            cache_epochs=int(os.environ.get("FARE_CACHE_EPOCHS", DEFAULT_CACHE_EPOCHS)),
+            base_fare=float(os.environ.get("FARE_BASE", DEFAULT_BASE_FARE)),
+            per_km=float(os.environ.get("FARE_PER_KM", DEFAULT_PER_KM)),
+            per_minute=float(os.environ.get("FARE_PER_MINUTE", DEFAULT_PER_MINUTE)),
+            minimum_fare=float(os.environ.get("FARE_MINIMUM", DEFAULT_MINIMUM_FARE)),
+            currency=os.environ.get("FARE_CURRENCY", DEFAULT_CURRENCY),
+        )
+
+    def quantize(self, location):
+        # Centre of the location's grid square
+        return tuple(
+            round(
+                (math.floor(float(location[axis]) / self.quantum_degrees) + 0.5)
+                * self.quantum_degrees,
+                9,
+            )
+            for axis in ("latitude", "longitude")
+        )
+
+    def estimate(self, pickup, destination, departure=None):
+        departure = departure or datetime.now(timezone.utc)
+        minute_of_day = (
+            departure.hour * 60 + departure.minute + self.eta_engine.utc_offset_minutes
+        ) % MINUTES_PER_DAY
+        slot = minute_of_day // self.slot_minutes
+        origin = self.quantize(pickup)
+        target = self.quantize(destination)
+        epoch = 0 if self.surge_pricer is None else self.surge_pricer.refresh()
+
+        key = (origin, target, slot)
+        quote = self.quote_cache.get(key, epoch)
+        if quote is None:
+            distance_km, seconds, fare = self.route_fare(origin, target, slot)
+            multiplier = 1.0
+            if self.surge_pricer is not None:
+                multiplier = self.surge_pricer.multiplier(
+                    {"latitude": origin[0], "longitude": origin[1]}
+                )
+            quote = {
+                "fare": round(fare * multiplier, 2),
+                "currency": self.currency,
+                "surgeMultiplier": multiplier,
+                "distanceKm": round(distance_km, 2),
+                "durationSeconds": round(seconds),
+            }
+            self.quote_cache.put(key, quote, epoch)
+
+        self.__report()
+        return quote
+
+    def __route_fare(self, origin, target, slot):
+        # (distance_km, seconds, fare before surge), departing at the start
+        # of the local time slot
+        distance_km = haversine_km(*origin, *target) * self.eta_engine.detour_factor
+        seconds = self.eta_engine.estimate_seconds(
+            *origin, *target, slot * self.slot_minutes
+        )
+        fare = self.base_fare + self.per_km * distance_km
+        fare += self.per_minute * seconds / 60
+        return distance_km, seconds, max(fare, self.minimum_fare)
+
+    def __report(self):
+        hits, misses = self.quote_cache.counts()
+        lookups = hits + misses
+        if self.report_every and lookups % self.report_every == 0:
+            routes = self.route_fare.cache_info()
+            route_lookups = routes.hits + routes.misses
+            metrics = [
+                {"Name": "quoteCacheHitRate", "Unit": "Percent"},
+                {"Name": "routeCacheHitRate", "Unit": "Percent"},
+            ]
+            record = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Service"]],
+                            "Metrics": metrics,
+                        }
+                    ],
+                },
+                "Service": DEFAULT_SERVICE,
+                "quoteCacheHitRate": hits / lookups * 100,
+                "routeCacheHitRate": routes.hits / max(route_lookups, 1) * 100,
+                "quoteLookups": lookups,
+                "routeLookups": route_lookups,
+            }
+            self.write(dumps(record))
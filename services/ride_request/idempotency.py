@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from common.item_schema import ItemSchema, NumberAttribute, StringAttribute
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENCY_KEY_PATTERN = re.compile(r"[\x21-\x7e]{1,255}")
+DEFAULT_IDEMPOTENCY_TABLE = "IdempotencyKeys"
+# Mobile clients give up retrying well within a day
+DEFAULT_RECORD_TTL_SECONDS = 24 * 60 * 60
+# A claim older than this belongs to an invocation that died mid-request;
+# it comfortably exceeds the function timeout
+DEFAULT_IN_PROGRESS_TIMEOUT_SECONDS = 30
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+
+IDEMPOTENCY_ITEM = ItemSchema(
+    {
+        "idempotencyKey": StringAttribute(required=True),
+        "status": StringAttribute(required=True),
+        "fingerprint": StringAttribute(required=True),
+        "statusCode": NumberAttribute(),
+        "responseBody": StringAttribute(),
+        # Epoch seconds; the table's DynamoDB TTL attribute
+        "expiresAt": NumberAttribute(required=True),
+        "lockExpiresAt": NumberAttribute(),
+    }
+)
+
+
+def get_idempotency_key(event):
+    # API Gateway REST APIs keep the client's casing, HTTP APIs lowercase it.
+    # The two usual spellings are looked up directly; only a header in some
+    # other casing (or none) costs a scan, which only lowercases names of
+    # the right length
+    headers = event.get("headers") or {}
+    key = headers.get("Idempotency-Key")
+    if key is None:
+        key = headers.get(IDEMPOTENCY_HEADER)
+    if key is not None:
+        return key
+    length = len(IDEMPOTENCY_HEADER)
+    for name, value in headers.items():
+        if len(name) == length and name.lower() == IDEMPOTENCY_HEADER:
+            return value
+    return None
+
+
+def is_valid_idempotency_key(key):
+    return IDEMPOTENCY_KEY_PATTERN.fullmatch(key) is not None
+
+
+def fingerprint(body):
+    # Same key with a different payload is a client bug, not a retry
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def error_code(error):
+    # Read the botocore error code without importing botocore
+    return getattr(error, "response", {}).get("Error", {}).get("Code")
+
+
+def error_item(error):
+    # The item a failed condition check returned with
+    # ReturnValuesOnConditionCheckFailure, if any
+    return getattr(error, "response", {}).get("Item")
+
+
+class IdempotencyRecord:
+    def __init__(self, status, fingerprint, status_code=None, response_body=None):
+        self.status = status
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.response_body = response_body
+
+
+class IdempotencyRecordStorage:
+    """Idempotency records in DynamoDB, claimed with a conditional write.
+
+    claim() returns None when this invocation now owns the key, otherwise the
+    record that is already there, in the same round trip thanks to
+    ReturnValuesOnConditionCheckFailure. A claim left IN_PROGRESS by a dead
+    invocation can be taken over once its lock expires. completion() is
+    the write that records the response, made in one transaction with the
+    ride so that neither is stored without the other.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name=None,
+        record_ttl=DEFAULT_RECORD_TTL_SECONDS,
+        in_progress_timeout=DEFAULT_IN_PROGRESS_TIMEOUT_SECONDS,
+        clock=time.time,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name or os.environ.get(
+            "IDEMPOTENCY_TABLE", DEFAULT_IDEMPOTENCY_TABLE
+        )
+        self.record_ttl = record_ttl
+        self.in_progress_timeout = in_progress_timeout
+        self.clock = clock
+
+    def claim(self, key, request_fingerprint):
+        now = int(self.clock())
+        item = IDEMPOTENCY_ITEM.marshal(
+            {
+                "idempotencyKey": key,
+                "status": IN_PROGRESS,
+                "fingerprint": request_fingerprint,
+                "expiresAt": now + self.record_ttl,
+                "lockExpiresAt": now + self.in_progress_timeout,
+            }
+        )
+
+        try:
+            self.dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item=item,
+                ConditionExpression=(
+                    "attribute_not_exists(idempotencyKey) OR expiresAt < :now "
+                    "OR (#status = :in_progress AND lockExpiresAt < :now)"
+                ),
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={
+                    ":now": {"N": str(now)},
+                    ":in_progress": {"S": IN_PROGRESS},
+                },
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            )
+            return None
+        except Exception as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+            existing = error_item(e) or self.__get(key)
+            if existing is None:
+                # Deleted between the write and the read; treat as in flight
+                return IdempotencyRecord(IN_PROGRESS, request_fingerprint)
+            return self.__to_record(existing)
+
+    def completion(self, key, request_fingerprint, status_code, response_body):
+        # TransactWriteItems entry that completes our claim, for writing in
+        # one transaction with the ride; it fails if the claim is gone
+        item = IDEMPOTENCY_ITEM.marshal(
+            {
+                "idempotencyKey": key,
+                "status": COMPLETED,
+                "fingerprint": request_fingerprint,
+                "statusCode": status_code,
+                "responseBody": response_body,
+                "expiresAt": int(self.clock()) + self.record_ttl,
+            }
+        )
+        return {
+            "Put": {
+                "TableName": self.table_name,
+                "Item": item,
+                "ConditionExpression": (
+                    "#status = :in_progress AND fingerprint = :fingerprint"
+                ),
+                "ExpressionAttributeNames": {"#status": "status"},
+                "ExpressionAttributeValues": {
+                    ":in_progress": {"S": IN_PROGRESS},
+                    ":fingerprint": {"S": request_fingerprint},
+                },
+            }
+        }
+
+    def release(self, key):
+        # Drop our claim so that a retry can run the request again
+        try:
+            self.dynamodb_client.delete_item(
+                TableName=self.table_name,
+                Key={"idempotencyKey": {"S": key}},
+                ConditionExpression="#status = :in_progress",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={":in_progress": {"S": IN_PROGRESS}},
+            )
+        except Exception as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+
+    def __get(self, key):
+        response = self.dynamodb_client.get_item(
+            TableName=self.table_name,
+            Key={"idempotencyKey": {"S": key}},
+            ConsistentRead=True,
+        )
+        return response.get("Item")
+
+    @staticmethod
+    def __to_record(item):
+        data = IDEMPOTENCY_ITEM.unmarshal(item)
+        return IdempotencyRecord(
+            data["status"],
+            data["fingerprint"],
+            data.get("statusCode"),
+            data.get("responseBody"),
+        )
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+
+from ride_request.serialization import dumps
+
+DEFAULT_NAMESPACE = "RideRequests"
+DEFAULT_SERVICE = "ride_request"
+# Property names, so one metric definition serves every stage
+DIMENSIONS = [["Service", "Start"]]
+UNIT = "Milliseconds"
+
+
+def write_line(line):
+    # Lambda ships stdout to CloudWatch Logs, which extracts the metrics
+    sys.stdout.write(line + "\n")
+
+
+class StageTimer:
+    """Times the consecutive stages of one invocation.
+
+    stage() closes the running stage and opens the next; finish() closes
+    the last one and emits the record. Only timestamps are taken while the
+    request runs; durations are worked out in finish(). A stage that is
+    entered twice adds to its earlier time.
+    """
+
+    __slots__ = ("metrics", "start", "clock", "marks")
+
+    def __init__(self, metrics, start):
+        self.metrics = metrics
+        self.start = start
+        self.clock = metrics.clock
+        # (stage name, time it began); the first mark opens no stage
+        self.marks = [(None, self.clock())]
+
+    def stage(self, name):
+        self.marks.append((name, self.clock()))
+
+    def finish(self, status_code, error=None):
+        # `error` is the exception a handler turned into its response, if any
+        self.stage(None)
+        ms = {}
+        name, began = self.marks[0]
+        for next_name, at in self.marks[1:]:
+            if name is not None:
+                elapsed = (at - began) * 1000
+                ms[name] = ms[name] + elapsed if name in ms else elapsed
+            last_stage, name, began = name, next_name, at
+
+        total = (began - self.marks[0][1]) * 1000
+        self.metrics.emit(self, ms, total, status_code, error, last_stage)
+
+
+class NullStageTimer:
+    # Stands in for StageTimer when metrics are off; costs a method call
+    __slots__ = ()
+
+    def stage(self, name):
+        pass
+
+    def finish(self, status_code, error=None):
+        pass
+
+
+NULL_TIMER = NullStageTimer()
+
+
+class StageMetrics:
+    """Per-stage handler latency, one CloudWatch embedded-metric line each.
+
+    Every invocation gets a StageTimer from start(). Its record carries
+    each stage's time and the total in milliseconds, keyed by Service and
+    Start (cold for the container's first invocation, warm after), plus
+    the status code. Server errors also name the stage the invocation
+    ended in and, when a handler swallowed an exception, its type.
+    Disabled metrics hand out NULL_TIMER.
+    """
+
+    def __init__(
+        self,
+        namespace=DEFAULT_NAMESPACE,
+        service=DEFAULT_SERVICE,
+        enabled=True,
+        write=write_line,
+        clock=time.perf_counter,
+    ):
+        self.namespace = namespace
+        self.service = service
+        self.enabled = enabled
+        self.write = write
+        self.clock = clock
+        self.cold = True
+        # Metric declarations by stage names; the set of stages an
+        # invocation passes through takes only a few shapes
+        self.declarations = {}
+
+    @classmethod
+    def from_environment(cls):
+        # RIDE_REQUEST_STAGE_METRICS=on enables the timers; they cost about
+        # 10 us a request, so they are off unless someone is looking
+        return cls(
+            namespace=os.environ.get("STAGE_METRICS_NAMESPACE", DEFAULT_NAMESPACE),
+            enabled=os.environ.get("RIDE_REQUEST_STAGE_METRICS", "off") == "on",
+        )
+
+    def start(self):
+        if not self.enabled:
+            return NULL_TIMER
+
+        start = "cold" if self.cold else "warm"
+        self.cold = False
+        return StageTimer(self, start)
+
+    def emit(self, timer, ms, total, status_code, error=None, last_stage=None):
+        properties = {
+            "Service": self.service,
+            "Start": timer.start,
+            "statusCode": status_code,
+            "total": total,
+        }
+        properties.update(ms)
+        if status_code >= 500:
+            properties["failedStage"] = last_stage
+        if error is not None:
+            properties["errorType"] = type(error).__name__
+
+        # Spliced rather than encoded as one object: the metric declaration
+        # is the bulk of the line and only changes with the stages
+        self.write(
+            f"{self.declare(tuple(ms))}{int(time.time() * 1000)}}},"
+            f"{dumps(properties)[1:]}"
+        )
+
+    def declare(self, stages):
+        # Start of the record, up to the Timestamp value
+        declaration = self.declarations.get(stages)
+        if declaration is None:
+            metrics = [{"Name": name, "Unit": UNIT} for name in (*stages, "total")]
+            aws = {
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": DIMENSIONS,
+                        "Metrics": metrics,
+                    }
+                ]
+            }
+            declaration = self.declarations[stages] = (
+                f'{{"_aws":{dumps(aws)[:-1]},"Timestamp":'
+            )
+        return declaration
@@ -0,0 +1,264 @@
+import base64
+import json
+import marshal
+import os
+import random
+import sys
+import time
+import uuid
+import zlib
+from collections import Counter
+from pathlib import Path
+
+CPROFILE = "cprofile"
+TRACEMALLOC = "tracemalloc"
+MODES = (CPROFILE, TRACEMALLOC)
+# File suffix of each mode's profiles
+SUFFIXES = {CPROFILE: ".prof", TRACEMALLOC: ".folded"}
+PROFILE_HEADER = "x-profile-token"
+LOG_PREFIX = "PROFILE "
+DEFAULT_TRACEBACK_FRAMES = 32
+# Call paths worth less than this many microseconds are left out of the
+# folded stacks; without a floor, recursive code multiplies them
+DEFAULT_MIN_MICROSECONDS = 1
+
+
+def write_line(line):
+    sys.stdout.write(line + "\n")
+
+
+def get_profile_token(event):
+    for name, value in (event.get("headers") or {}).items():
+        if name.lower() == PROFILE_HEADER:
+            return value
+    return None
+
+
+class InvocationProfiler:
+    """Profiles a sample of invocations under cProfile or tracemalloc.
+
+    With a mode set, `sample_rate` of invocations are profiled, as is any
+    invocation whose X-Profile-Token header matches `token`. Without a
+    token the header is ignored, so clients cannot switch profiling on.
+    Each profile is written to `output_dir`, or logged as one compressed
+    line starting with LOG_PREFIX. cProfile profiles are pstats data;
+    tracemalloc ones are folded stacks of the bytes an invocation left
+    allocated. benchmarks.merge_profiles merges either kind into one
+    flame graph.
+    """
+
+    def __init__(
+        self,
+        mode=None,
+        sample_rate=0.0,
+        token=None,
+        output_dir=None,
+        traceback_frames=DEFAULT_TRACEBACK_FRAMES,
+        write=write_line,
+        random=random.random,
+    ):
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.token = token
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.traceback_frames = traceback_frames
+        self.write = write
+        self.random = random
+
+    @classmethod
+    def from_environment(cls):
+        # RIDE_REQUEST_PROFILE=cprofile|tracemalloc; unset or off disables it
+        mode = os.environ.get("RIDE_REQUEST_PROFILE", "off")
+        return cls(
+            mode=None if mode == "off" else mode,
+            sample_rate=float(os.environ.get("RIDE_REQUEST_PROFILE_SAMPLE_RATE", 0)),
+            token=os.environ.get("RIDE_REQUEST_PROFILE_TOKEN") or None,
+            output_dir=os.environ.get("RIDE_REQUEST_PROFILE_DIR"),
+        )
+
+    def should_profile(self, event):
+        if self.mode is None:
+            return False
+        if self.token is not None and get_profile_token(event) == self.token:
+            return True
+        return self.random() < self.sample_rate
+
+    def run(self, function, event, context):
+        # Returns function(event, context), profiling it if sampled
+        if not self.should_profile(event):
+            return function(event, context)
+
+        request_id = getattr(context, "aws_request_id", None) or uuid.uuid4().hex
+        if self.mode == CPROFILE:
+            return self.__run_cprofile(function, event, context, request_id)
+        return self.__run_tracemalloc(function, event, context, request_id)
+
+    def __run_cprofile(self, function, event, context, request_id):
+        import cProfile
+
+        if sys.getprofile() is not None:
+            # Another profiler is attached; leave the invocation to it
+            return function(event, context)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, event, context)
+        finally:
+            profile.create_stats()
+            self.__save(request_id, marshal.dumps(profile.stats), {})
+
+    def __run_tracemalloc(self, function, event, context, request_id):
+        import tracemalloc
+
+        if tracemalloc.is_tracing():
+            return function(event, context)
+
+        tracemalloc.start(self.traceback_frames)
+        try:
+            return function(event, context)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stacks = folded_allocations(snapshot)
+            self.__save(request_id, format_folded(stacks).encode(), {"peakBytes": peak})
+
+    def __save(self, request_id, data, details):
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            name = f"{int(time.time() * 1000)}-{request_id}{SUFFIXES[self.mode]}"
+            (self.output_dir / name).write_bytes(data)
+            return
+
+        record = {
+            "mode": self.mode,
+            "requestId": request_id,
+            **details,
+            "data": base64.b64encode(zlib.compress(data)).decode("ascii"),
+        }
+        self.write(LOG_PREFIX + json.dumps(record, separators=(",", ":")))
+
+
+def frame_name(filename, name):
+    # Two path components are enough to tell the repo's modules apart
+    if filename == "~":
+        return name
+    return f"{'/'.join(Path(filename).parts[-2:])}:{name}"
+
+
+def folded_allocations(snapshot):
+    # Bytes still allocated, by call stack from the outermost frame in
+    stacks = Counter()
+    for statistic in snapshot.statistics("traceback"):
+        stack = ";".join(
+            frame_name(frame.filename, f"{frame.lineno}")
+            for frame in statistic.traceback
+        )
+        stacks[stack] += statistic.size
+    return stacks
+
+
+def folded_cpu(stats, min_microseconds=DEFAULT_MIN_MICROSECONDS):
+    """Microseconds by call stack from pstats data.
+
+    cProfile keeps caller-callee pairs, not whole stacks, so each
+    function's time under a caller is split among the caller's own
+    stacks in proportion to the time they spent in the caller.
+    """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller in callers:
+            callees.setdefault(caller, []).append(function)
+
+    stacks = Counter()
+    roots = [function for function, entry in stats.items() if not entry[4]]
+
+    def visit(function, path, share):
+        own = stats[function][2]
+        path = path + (frame_name(function[0], function[2]),)
+        microseconds = own * share * 1e6
+        if microseconds >= min_microseconds:
+            stacks[";".join(path)] += round(microseconds)
+
+        for callee in callees.get(function, ()):
+            callee_cumulative = stats[callee][3]
+            via_edge = stats[callee][4][function][3]
+            if callee_cumulative <= 0 or via_edge * share * 1e6 < min_microseconds:
+                continue
+            if frame_name(callee[0], callee[2]) in path:
+                # Recursion: the edge's time is already inside this stack
+                continue
+            visit(callee, path, share * via_edge / callee_cumulative)
+
+    for root in roots:
+        visit(root, (), 1.0)
+    return stacks
+
+
+def format_folded(stacks):
+    return "".join(f"{stack} {value}\n" for stack, value in sorted(stacks.items()))
+
+
+def parse_folded(text):
+    stacks = Counter()
+    for line in text.splitlines():
+        stack, _, value = line.rpartition(" ")
+        if stack:
+            stacks[stack] += int(value)
+    return stacks
+
+
+def read_profiles(path):
+    # Yields (mode, data) for a profile file, or for every profile line in
+    # a log file (such as a CloudWatch Logs export)
+    path = Path(path)
+    for mode, suffix in SUFFIXES.items():
+        if path.suffix == suffix:
+            yield mode, path.read_bytes()
+            return
+
+    with path.open(encoding="utf-8") as lines:
+        for line in lines:
+            start = line.find(LOG_PREFIX)
+            if start < 0:
+                continue
+            record = json.loads(line[start + len(LOG_PREFIX) :])
+            yield record["mode"], zlib.decompress(base64.b64decode(record["data"]))
+
+
+def merge_profiles(paths, mode=CPROFILE, min_microseconds=DEFAULT_MIN_MICROSECONDS):
+    """Folded stacks summed over every `mode` profile found in `paths`.
+
+    cProfile data is merged with pstats before being folded, so call paths
+    below `min_microseconds` in single invocations still add up.
+    """
+    import pstats
+
+    stacks = Counter()
+    merged = None
+    for path in paths:
+        for profile_mode, data in read_profiles(path):
+            if profile_mode != mode:
+                continue
+            if mode == TRACEMALLOC:
+                stacks.update(parse_folded(data.decode()))
+            elif merged is None:
+                merged = pstats.Stats(LoadedProfile(marshal.loads(data)))
+            else:
+                merged.add(LoadedProfile(marshal.loads(data)))
+
+    if merged is not None:
+        stacks.update(folded_cpu(merged.stats, min_microseconds))
+    return stacks
+
+
+class LoadedProfile:
+    # What pstats.Stats accepts in place of a cProfile.Profile
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
@@ -0,0 +1,290 @@
+import time
+
+from ride_request.idempotency import error_code, error_item
+
+DEFAULT_RIDES_TABLE = "RideRequests"
+
+# action: (statuses it may be taken from, status it leads to)
+TRANSITIONS = {
+    "accept": (("requested",), "matched"),
+    "arrive": (("matched",), "arriving"),
+    "start": (("arriving",), "in_progress"),
+    "complete": (("in_progress",), "completed"),
+    "cancel": (("requested", "matched", "arriving"), "cancelled"),
+}
+
+# Statuses no action leads out of
+TERMINAL_STATUSES = frozenset(
+    to_status
+    for _, to_status in TRANSITIONS.values()
+    if not any(to_status in from_statuses for from_statuses, _ in TRANSITIONS.values())
+)
+
+
+def _reported_predecessors():
+    # status: the statuses a ride may be in for a reported status to be
+    # applied. Those are the statuses some sequence of transitions leads to
+    # it from, since the write-behind buffer only writes the latest of a
+    # ride's statuses, and, unless it is terminal, the status itself, which
+    # a newer report may repeat
+    predecessors = {}
+    for from_statuses, to_status in TRANSITIONS.values():
+        for status in (*from_statuses, to_status):
+            if status not in TERMINAL_STATUSES:
+                predecessors.setdefault(status, {status})
+        predecessors.setdefault(to_status, set()).update(from_statuses)
+
+    changed = True
+    while changed:
+        changed = False
+        for status, allowed in predecessors.items():
+            reachable = set().union(*(predecessors[other] for other in allowed))
+            if not reachable <= allowed:
+                allowed |= reachable
+                changed = True
+    return {status: tuple(sorted(allowed)) for status, allowed in predecessors.items()}
+
+
+REPORTED_PREDECESSORS = _reported_predecessors()
+
+
+class TransitionResult:
+    """Outcome of a transition, with the ride's status and version after it.
+
+    For the failures these are the ride's current values, read from the
+    failed write itself, so callers never need a follow-up GetItem.
+    """
+
+    __slots__ = ("ride_id", "status", "version")
+
+    def __init__(self, ride_id, status=None, version=None):
+        self.ride_id = ride_id
+        self.status = status
+        self.version = version
+
+    @property
+    def is_success(self):
+        return False
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}({self.ride_id!r}, {self.status!r}, "
+            f"{self.version!r})"
+        )
+
+
+class Transitioned(TransitionResult):
+    __slots__ = ()
+
+    @property
+    def is_success(self):
+        return True
+
+
+class RideNotFound(TransitionResult):
+    __slots__ = ()
+
+
+class InvalidTransition(TransitionResult):
+    # The ride's status does not allow the action: it never did, or a
+    # competing transition (a driver's accept against a customer's cancel)
+    # got there first
+    __slots__ = ()
+
+
+class VersionConflict(TransitionResult):
+    # The status still allows the action, but the ride changed since the
+    # caller read the version it expected
+    __slots__ = ()
+
+
+class StaleStatus(TransitionResult):
+    # A reported status older than the last one reported for the ride
+    __slots__ = ()
+
+
+def _version_of(item):
+    # Rides written before the lifecycle existed have no counter yet
+    return int(item.get("version", {}).get("N", 0))
+
+
+class RideLifecycle:
+    """Moves rides between statuses with one conditional UpdateItem each.
+
+    The condition checks the expected current status and, when the caller
+    passes `expected_version`, the ride's version counter, which every
+    transition increments. There is no read before the write: on a failed
+    condition, ReturnValuesOnConditionCheckFailure hands back the item as
+    it is, and the result type says why the transition did not happen.
+    Sharded indexes on status are kept current in the same update.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name=DEFAULT_RIDES_TABLE,
+        indexes=(),
+        clock=time.time,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.status_indexes = [
+            index for index in indexes if index.attribute == "status"
+        ]
+        self.clock = clock
+
+    def accept(self, ride_id, driver_id, expected_version=None):
+        return self.transition(
+            ride_id, "accept", expected_version, {"driverId": {"S": driver_id}}
+        )
+
+    def cancel(self, ride_id, expected_version=None):
+        return self.transition(ride_id, "cancel", expected_version)
+
+    def complete(self, ride_id, expected_version=None):
+        return self.transition(ride_id, "complete", expected_version)
+
+    def transition(self, ride_id, action, expected_version=None, attributes=None):
+        if action not in TRANSITIONS:
+            raise ValueError(f"Unknown ride action: {action!r}")
+        from_statuses, to_status = TRANSITIONS[action]
+
+        attributes = dict(attributes or {})
+        for index in self.status_indexes:
+            shard_key = index.shard_key(to_status, ride_id)
+            attributes[index.key_attribute] = {"S": shard_key}
+
+        names = {"#status": "status"}
+        values = {
+            ":to": {"S": to_status},
+            ":zero": {"N": "0"},
+            ":one": {"N": "1"},
+            # Epoch milliseconds, like the status events
+            ":now": {"N": str(int(self.clock() * 1000))},
+        }
+        updates = [
+            "#status = :to",
+            "version = if_not_exists(version, :zero) + :one",
+            "updatedAt = :now",
+        ]
+        for index, (name, value) in enumerate(attributes.items()):
+            names[f"#a{index}"] = name
+            values[f":a{index}"] = value
+            updates.append(f"#a{index} = :a{index}")
+
+        allowed = []
+        for index, status in enumerate(from_statuses):
+            values[f":from{index}"] = {"S": status}
+            allowed.append(f"#status = :from{index}")
+        condition = f"attribute_exists(rideId) AND ({' OR '.join(allowed)})"
+
+        if expected_version == 0:
+            condition += " AND attribute_not_exists(version)"
+        elif expected_version is not None:
+            values[":version"] = {"N": str(expected_version)}
+            condition += " AND version = :version"
+
+        try:
+            response = self.dynamodb_client.update_item(
+                TableName=self.table_name,
+                Key={"rideId": {"S": ride_id}},
+                UpdateExpression=f"SET {', '.join(updates)}",
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues="ALL_NEW",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            )
+        except Exception as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+            return self.__failure(ride_id, from_statuses, error_item(e))
+
+        item = response["Attributes"]
+        return Transitioned(ride_id, item["status"]["S"], _version_of(item))
+
+    def record_status(self, item):
+        """Applies a status reported by another service, unless it is stale.
+
+        `item` is a RIDE_STATUS_ITEM; its attributes are set on the ride
+        only if the ride's status may lead to the reported one (see
+        REPORTED_PREDECESSORS) and is not terminal, and its reportedAt is
+        older than the item's. An update delivered late or twice, or after
+        a transition such as a cancel, cannot roll the ride back. reportedAt
+        is the source's clock; updatedAt stays the time of the write, as for
+        transitions.
+        """
+        ride_id = item["rideId"]["S"]
+        status = item["status"]["S"]
+        if status not in REPORTED_PREDECESSORS:
+            raise ValueError(f"Unknown ride status: {status!r}")
+
+        attributes = {name: value for name, value in item.items() if name != "rideId"}
+        for index in self.status_indexes:
+            shard_key = index.shard_key(status, ride_id)
+            attributes[index.key_attribute] = {"S": shard_key}
+
+        names = {"#status": "status", "#reportedAt": "reportedAt"}
+        values = {
+            ":zero": {"N": "0"},
+            ":one": {"N": "1"},
+            ":now": {"N": str(int(self.clock() * 1000))},
+            ":reportedAt": item["reportedAt"],
+        }
+        updates = [
+            "version = if_not_exists(version, :zero) + :one",
+            "updatedAt = :now",
+        ]
+        for index, (name, value) in enumerate(attributes.items()):
+            names[f"#a{index}"] = name
+            values[f":a{index}"] = value
+            updates.append(f"#a{index} = :a{index}")
+
+        allowed = []
+        for index, predecessor in enumerate(REPORTED_PREDECESSORS[status]):
+            values[f":from{index}"] = {"S": predecessor}
+            allowed.append(f":from{index}")
+        terminal = []
+        for index, terminal_status in enumerate(sorted(TERMINAL_STATUSES)):
+            values[f":terminal{index}"] = {"S": terminal_status}
+            terminal.append(f":terminal{index}")
+        condition = (
+            f"attribute_exists(rideId) AND #status IN ({', '.join(allowed)}) "
+            f"AND NOT #status IN ({', '.join(terminal)}) "
+            "AND (attribute_not_exists(#reportedAt) OR #reportedAt < :reportedAt)"
+        )
+
+        try:
+            response = self.dynamodb_client.update_item(
+                TableName=self.table_name,
+                Key={"rideId": {"S": ride_id}},
+                UpdateExpression=f"SET {', '.join(updates)}",
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues="ALL_NEW",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            )
+        except Exception as e:
+            if error_code(e) != "ConditionalCheckFailedException":
+                raise
+            current = error_item(e)
+            if current is None:
+                return RideNotFound(ride_id)
+            current_status = current.get("status", {}).get("S")
+            if current_status not in REPORTED_PREDECESSORS[status]:
+                return InvalidTransition(ride_id, current_status, _version_of(current))
+            return StaleStatus(ride_id, current_status, _version_of(current))
+
+        item = response["Attributes"]
+        return Transitioned(ride_id, item["status"]["S"], _version_of(item))
+
+    @staticmethod
+    def __failure(ride_id, from_statuses, item):
+        if item is None:
+            return RideNotFound(ride_id)
+
+        status = item.get("status", {}).get("S")
+        if status not in from_statuses:
+            return InvalidTransition(ride_id, status, _version_of(item))
+        return VersionConflict(ride_id, status, _version_of(item))
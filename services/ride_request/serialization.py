@@ -0,0 +1,38 @@
+import functools
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the deployment package
+    orjson = None
+
+# Shared by every response; never mutate it
+JSON_HEADERS = {"Content-Type": "application/json"}
+ERROR_BODY_CACHE_SIZE = 256
+
+
+if orjson is not None:
+
+    def dumps(data):
+        return orjson.dumps(data).decode("utf-8")
+
+else:
+    _encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def dumps(data):
+        return _encoder.encode(data)
+
+
+@functools.lru_cache(maxsize=ERROR_BODY_CACHE_SIZE)
+def error_body(error_message):
+    # Error messages repeat constantly ("Internal Server Error", missing
+    # fields), so their encoded bodies are built once and reused
+    return dumps({"message": error_message})
+
+
+def format_response(status_code, data=None, error_message=None):
+    return {
+        "statusCode": status_code,
+        "body": dumps(data) if status_code < 400 else error_body(error_message),
+        "headers": JSON_HEADERS,
+    }
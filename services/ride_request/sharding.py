@@ -0,0 +1,272 @@
+import base64
+import heapq
+import itertools
+import json
+import threading
+import zlib
+
+SHARD_SEPARATOR = "#"
+# Page position of a shard that has no items left
+SHARD_EXHAUSTED = 0
+
+
+def sort_value(attribute):
+    # Comparable value of an index sort key attribute
+    if "N" in attribute:
+        return float(attribute["N"])
+    return attribute["S"]
+
+
+def is_key_value(attribute):
+    return (
+        type(attribute) is dict
+        and len(attribute) == 1
+        and type(attribute.get("S", attribute.get("N"))) is str
+    )
+
+
+class ShardedIndex:
+    """A secondary index whose partition key is spread over write shards.
+
+    An index keyed on a low-cardinality attribute puts every write for one
+    value on one partition, which DynamoDB caps at 1,000 write units a
+    second: during a surge every new ride lands on status "requested".
+    Items instead carry `key_attribute` = "<value>#<shard>", where the shard
+    is a stable hash of the item's own unique key (e.g. rideId). Any writer
+    can recompute an item's shard without reading it, and readers query all
+    shards of a value (see ScatterGatherReader). Raising shard_count later
+    is safe; lowering it hides items in the dropped shards until rewritten.
+    """
+
+    def __init__(self, name, attribute, sort_key, shard_count=1, key_attribute=None):
+        if shard_count < 1:
+            raise ValueError(f"shard_count must be at least 1, got {shard_count}")
+        self.name = name
+        self.attribute = attribute
+        self.sort_key = sort_key
+        self.shard_count = shard_count
+        self.key_attribute = key_attribute or f"{attribute}Shard"
+
+    def shard_of(self, spread_by):
+        # crc32, unlike hash(), is the same in every process
+        return zlib.crc32(spread_by.encode("utf-8")) % self.shard_count
+
+    def shard_key(self, value, spread_by):
+        return f"{value}{SHARD_SEPARATOR}{self.shard_of(spread_by)}"
+
+    def shard_keys(self, value):
+        return [f"{value}{SHARD_SEPARATOR}{shard}" for shard in range(self.shard_count)]
+
+
+class ScatterGatherReader:
+    """Reads one value of a ShardedIndex by querying all its shards at once.
+
+    Shards are queried in parallel on `executor` (a thread pool sized to
+    the shard count by default, created on first use) and each returns its
+    items in sort key order, so a k-way heap merge yields the overall order.
+    With `limit`, no shard is asked for more than `limit` items, as no more
+    than that many from one shard can make the merged result.
+
+    query_page() reads one page at a time. Its positions, one per shard,
+    record where each shard left off: None before its first item,
+    SHARD_EXHAUSTED after its last, otherwise the ExclusiveStartKey that
+    follows the last item of that shard on the page. `table_keys` names the
+    table's primary key attributes, which such a key includes.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name,
+        index,
+        table_keys=("rideId",),
+        executor=None,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.index = index
+        self.table_keys = table_keys
+        self.executor = executor
+        self.lock = threading.Lock()
+
+    def query(self, value, limit=None, newest_first=True, attributes=None):
+        shard_keys = self.index.shard_keys(value)
+        shards = self.__scatter(
+            lambda shard: self.query_shard(
+                shard_keys[shard], limit, newest_first, attributes=attributes
+            )[0],
+            len(shard_keys),
+        )
+
+        sort_key = self.index.sort_key
+        merged = heapq.merge(
+            *shards,
+            key=lambda item: sort_value(item[sort_key]),
+            reverse=newest_first,
+        )
+        return list(itertools.islice(merged, limit))
+
+    def query_page(
+        self, value, limit, positions=None, newest_first=True, attributes=None
+    ):
+        """Returns (items, positions), with positions None after the last page."""
+        shard_keys = self.index.shard_keys(value)
+        positions = positions or [None] * len(shard_keys)
+
+        def read_shard(shard):
+            if positions[shard] == SHARD_EXHAUSTED:
+                return [], None
+            return self.query_shard(
+                shard_keys[shard], limit, newest_first, positions[shard], attributes
+            )
+
+        shards = self.__scatter(read_shard, len(shard_keys))
+
+        sort_key = self.index.sort_key
+        merged = heapq.merge(
+            *(
+                [(item, shard) for item in items]
+                for shard, (items, _) in enumerate(shards)
+            ),
+            key=lambda entry: sort_value(entry[0][sort_key]),
+            reverse=newest_first,
+        )
+        page = list(itertools.islice(merged, limit))
+
+        last_taken = {}
+        for item, shard in page:
+            last_taken[shard] = item
+
+        next_positions = []
+        for shard, (items, last_key) in enumerate(shards):
+            if shard in last_taken:
+                item = last_taken[shard]
+                if item is items[-1] and last_key is None:
+                    next_positions.append(SHARD_EXHAUSTED)
+                else:
+                    next_positions.append(self.start_key(item, shard_keys[shard]))
+            elif not items and last_key is None:
+                next_positions.append(SHARD_EXHAUSTED)
+            else:
+                next_positions.append(positions[shard])
+
+        if all(position == SHARD_EXHAUSTED for position in next_positions):
+            next_positions = None
+        return [item for item, _ in page], next_positions
+
+    def query_shard(
+        self,
+        shard_key,
+        limit=None,
+        newest_first=True,
+        start_key=None,
+        attributes=None,
+    ):
+        # Returns (items, LastEvaluatedKey of the last response)
+        items = []
+        names = {"#shard": self.index.key_attribute}
+        request = {
+            "TableName": self.table_name,
+            "IndexName": self.index.name,
+            "KeyConditionExpression": "#shard = :shard",
+            "ExpressionAttributeNames": names,
+            "ExpressionAttributeValues": {":shard": {"S": shard_key}},
+            "ScanIndexForward": not newest_first,
+        }
+        if start_key is not None:
+            request["ExclusiveStartKey"] = start_key
+        if attributes is not None:
+            # Paging needs the key attributes whatever the caller asked for
+            wanted = dict.fromkeys([*attributes, self.index.sort_key, *self.table_keys])
+            for position, name in enumerate(wanted):
+                names[f"#p{position}"] = name
+            request["ProjectionExpression"] = ", ".join(
+                f"#p{position}" for position in range(len(wanted))
+            )
+
+        while True:
+            if limit is not None:
+                request["Limit"] = limit - len(items)
+            response = self.dynamodb_client.query(**request)
+            items.extend(response["Items"])
+
+            last_key = response.get("LastEvaluatedKey")
+            if last_key is None or (limit is not None and len(items) >= limit):
+                return items, last_key
+            request["ExclusiveStartKey"] = last_key
+
+    def start_key(self, item, shard_key):
+        # The ExclusiveStartKey that resumes a shard's query after `item`
+        key = {self.index.key_attribute: {"S": shard_key}}
+        for name in (self.index.sort_key, *self.table_keys):
+            key[name] = item[name]
+        return key
+
+    def encode_positions(self, positions):
+        # Opaque to clients: URL-safe base64 of the positions' key values
+        compact = [
+            (
+                position
+                if position is None or position == SHARD_EXHAUSTED
+                else [
+                    position[name] for name in (self.index.sort_key, *self.table_keys)
+                ]
+            )
+            for position in positions
+        ]
+        text = json.dumps(compact, separators=(",", ":"))
+        return (
+            base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+        )
+
+    def decode_positions(self, value, token):
+        """Positions for `value` from encode_positions(); ValueError if malformed.
+
+        Shard keys come from `value`, never from the token, so a token can
+        only move the start within the shards of the value being read.
+        """
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            compact = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        except (ValueError, UnicodeError) as e:
+            raise ValueError(f"Malformed cursor: {e}") from None
+
+        shard_keys = self.index.shard_keys(value)
+        if type(compact) is not list or len(compact) != len(shard_keys):
+            raise ValueError("Cursor does not match the index shards")
+
+        key_names = (self.index.sort_key, *self.table_keys)
+        positions = []
+        for shard_key, position in zip(shard_keys, compact):
+            if position is None or (
+                type(position) is int and position == SHARD_EXHAUSTED
+            ):
+                positions.append(position)
+            elif (
+                type(position) is list
+                and len(position) == len(key_names)
+                and all(is_key_value(attribute) for attribute in position)
+            ):
+                key = {self.index.key_attribute: {"S": shard_key}}
+                key.update(zip(key_names, position))
+                positions.append(key)
+            else:
+                raise ValueError("Malformed cursor position")
+        return positions
+
+    def __scatter(self, read_shard, shard_count):
+        if shard_count == 1:
+            return [read_shard(0)]
+        return list(self.__executor().map(read_shard, range(shard_count)))
+
+    def __executor(self):
+        with self.lock:
+            if self.executor is None:
+                # Imported on first use to keep it off the cold start
+                from concurrent.futures import ThreadPoolExecutor
+
+                self.executor = ThreadPoolExecutor(
+                    max_workers=min(self.index.shard_count, 32),
+                    thread_name_prefix=f"scatter-{self.index.name}",
+                )
+            return self.executor
@@ -0,0 +1,568 @@
+import math
+import os
+import threading
+import time
+import uuid
+from array import array
+
+from common.batch_write import BATCH_WRITE_MAX_ITEMS, batch_write
+from common.item_schema import ItemSchema, NumberAttribute, StringAttribute
+
+# About 2 km across at mid latitudes
+DEFAULT_CELL_SIZE_DEGREES = 0.02
+DEFAULT_WINDOW_SECONDS = 300
+DEFAULT_BUCKET_SECONDS = 10
+DEFAULT_UPDATE_SECONDS = 5
+DEFAULT_NEIGHBOUR_WEIGHT = 0.5
+# Requests per available driver over the window at which surge starts
+DEFAULT_SURGE_THRESHOLD = 1.0
+# Multiplier added per request per driver above the threshold
+DEFAULT_SENSITIVITY = 0.5
+DEFAULT_MAX_MULTIPLIER = 3.0
+MULTIPLIER_STEP = 0.1
+# Below this many cells an update takes under a millisecond in pure Python,
+# less than importing NumPy (~90 ms) would ever save
+NUMPY_MIN_ROWS = 256
+DEFAULT_SUPPLY_TABLE = "SurgeSupply"
+# Side of the regions that partition the supply table, in degrees
+DEFAULT_SUPPLY_REGION_DEGREES = 1.0
+# A cell and its 8 neighbours, row by row; the cell itself is in the middle
+# and the opposite of offset k is offset 8 - k
+NEIGHBOURHOOD = tuple((di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1))
+SELF = NEIGHBOURHOOD.index((0, 0))
+NO_NEIGHBOUR = -1
+# Identifies this container's items in the supply table; module level, so
+# that a table rebuilt after a client error keeps writing the same items
+WRITER_ID = uuid.uuid4().hex
+
+SURGE_SUPPLY_ITEM = ItemSchema(
+    {
+        "region": StringAttribute(required=True),
+        # "<i>:<j>#<writer id>"
+        "cell": StringAttribute(required=True),
+        "available": NumberAttribute(required=True),
+        # Epoch milliseconds of the write
+        "updatedAt": NumberAttribute(required=True),
+        # Epoch seconds, for the table's TTL
+        "expiresAt": NumberAttribute(),
+    }
+)
+
+
+def load_numpy():
+    # Called by the first update with NUMPY_MIN_ROWS cells, so that neither
+    # a cold start nor a small city pays for the import
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class SurgePricer:
+    """Surge multipliers per grid cell from recent demand and supply.
+
+    Demand is ride requests counted by pickup cell into a ring of
+    `bucket_seconds` buckets spanning `window_seconds`. Supply is the number
+    of available drivers per cell, sampled into a second ring at the start
+    of every bucket and on every update, and averaged over the window.
+    Driver positions arrive through upsert/remove, the interface of
+    ride_match's DriverGridIndex, so a DriverLocationIngestor can feed
+    them. Recording either is O(1). A pricer in a container that never
+    sees driver pings takes `supply_source` instead: a callable that is
+    given the pricer's cells on every update and returns the available
+    drivers per cell, or None if it knows of none, as
+    SurgeSupplyTable.read does. Until supply has arrived within the last
+    `window_seconds`, it is unknown and every multiplier is 1.0.
+
+    Every `update_seconds` all multipliers are recomputed in one pass:
+    demand and supply are smoothed with `neighbour_weight` over each cell's
+    8 neighbours, and every request per driver above `threshold` adds
+    `sensitivity`, capped at `max_multiplier` and rounded down to 0.1,
+    with NumPy once there are NUMPY_MIN_ROWS cells and it is installed.
+    multiplier() only looks up the last result. `epoch` counts updates, so
+    that anything priced from a multiplier can tell when it is stale.
+
+    Demand counts are per container. Every public method holds the
+    pricer's lock, since the arrays cannot grow while an update holds views
+    of them.
+    """
+
+    def __init__(
+        self,
+        cell_size=DEFAULT_CELL_SIZE_DEGREES,
+        window_seconds=DEFAULT_WINDOW_SECONDS,
+        bucket_seconds=DEFAULT_BUCKET_SECONDS,
+        update_seconds=DEFAULT_UPDATE_SECONDS,
+        neighbour_weight=DEFAULT_NEIGHBOUR_WEIGHT,
+        threshold=DEFAULT_SURGE_THRESHOLD,
+        sensitivity=DEFAULT_SENSITIVITY,
+        max_multiplier=DEFAULT_MAX_MULTIPLIER,
+        supply_source=None,
+        clock=time.monotonic,
+    ):
+        self.cell_size = cell_size
+        self.bucket_seconds = bucket_seconds
+        self.bucket_count = max(1, round(window_seconds / bucket_seconds))
+        self.window_seconds = self.bucket_count * bucket_seconds
+        self.update_seconds = update_seconds
+        self.neighbour_weight = neighbour_weight
+        self.threshold = threshold
+        self.sensitivity = sensitivity
+        self.max_multiplier = max_multiplier
+        self.supply_source = supply_source
+        self.clock = clock
+        self.numpy = None
+        self.numpy_loaded = False
+        self.lock = threading.Lock()
+
+        self.rows = {}
+        self.cells = []
+        # Row-major rows x bucket_count rings
+        self.demand = array("q")
+        self.supply = array("q")
+        # Available drivers per row right now, and the row of each driver
+        self.available = array("q")
+        self.drivers = {}
+        self.supply_updated_at = None
+        # Row-major rows x 9 rows of each cell's neighbourhood
+        self.neighbours = array("q")
+
+        self.bucket = None
+        self.slot = None
+        self.buckets_seen = 0
+        self.multipliers = []
+        self.epoch = 0
+        self.next_update_at = float("-inf")
+
+    @classmethod
+    def from_environment(cls, supply_source=None):
+        return cls(
+            cell_size=float(
+                os.environ.get("SURGE_CELL_SIZE_DEGREES", DEFAULT_CELL_SIZE_DEGREES)
+            ),
+            window_seconds=float(
+                os.environ.get("SURGE_WINDOW_SECONDS", DEFAULT_WINDOW_SECONDS)
+            ),
+            bucket_seconds=float(
+                os.environ.get("SURGE_BUCKET_SECONDS", DEFAULT_BUCKET_SECONDS)
+            ),
+            update_seconds=float(
+                os.environ.get("SURGE_UPDATE_SECONDS", DEFAULT_UPDATE_SECONDS)
+            ),
+            max_multiplier=float(
+                os.environ.get("SURGE_MAX_MULTIPLIER", DEFAULT_MAX_MULTIPLIER)
+            ),
+            supply_source=supply_source,
+        )
+
+    def cell_of(self, latitude, longitude):
+        return (
+            math.floor(latitude / self.cell_size),
+            math.floor(longitude / self.cell_size),
+        )
+
+    def record_request(self, location):
+        # Counts a request at `location`; returns the multiplier in effect
+        # there, which saves the request path a second lookup
+        with self.lock:
+            return self.__record_request(location)
+
+    def __record_request(self, location):
+        now = self.clock()
+        if now >= self.next_update_at:
+            self.__update()
+
+        # Inlined fast paths: this runs on every ride request
+        slot = self.slot
+        if int(now // self.bucket_seconds) != self.bucket:
+            slot = self.__advance(now)
+        latitude = float(location["latitude"])
+        longitude = float(location["longitude"])
+        row = self.rows.get(
+            (
+                math.floor(latitude / self.cell_size),
+                math.floor(longitude / self.cell_size),
+            )
+        )
+        if row is None:
+            row = self.__row(latitude, longitude)
+
+        self.demand[row * self.bucket_count + slot] += 1
+        multipliers = self.multipliers
+        return multipliers[row] if row < len(multipliers) else 1.0
+
+    def upsert(self, driver_id, latitude, longitude):
+        with self.lock:
+            self.__upsert(driver_id, latitude, longitude)
+
+    def __upsert(self, driver_id, latitude, longitude):
+        now = self.clock()
+        self.supply_updated_at = now
+        self.__advance(now)
+        row = self.__row(latitude, longitude)
+        previous = self.drivers.get(driver_id)
+
+        if previous == row:
+            return
+        if previous is not None:
+            self.available[previous] -= 1
+
+        self.available[row] += 1
+        self.drivers[driver_id] = row
+
+    def remove(self, driver_id):
+        with self.lock:
+            self.supply_updated_at = self.clock()
+            row = self.drivers.pop(driver_id, None)
+
+            if row is None:
+                return False
+
+            self.available[row] -= 1
+            return True
+
+    def set_supply(self, counts):
+        # Replaces the available drivers per cell with `counts`
+        with self.lock:
+            self.__set_supply(counts)
+
+    def __set_supply(self, counts):
+        now = self.clock()
+        self.supply_updated_at = now
+        self.__advance(now)
+        self.available[:] = array("q", [0]) * len(self.cells)
+        for cell, count in counts.items():
+            self.available[self.__cell_row(cell)] = count
+
+    def available_by_cell(self):
+        # Available drivers per cell right now, for publishing supply
+        with self.lock:
+            return dict(zip(self.cells, self.available))
+
+    def multiplier(self, location):
+        with self.lock:
+            self.__refresh()
+            row = self.rows.get(
+                self.cell_of(float(location["latitude"]), float(location["longitude"]))
+            )
+            if row is None or row >= len(self.multipliers):
+                return 1.0
+            return self.multipliers[row]
+
+    def refresh(self):
+        # Updates the multipliers if an update is due; returns the epoch
+        with self.lock:
+            return self.__refresh()
+
+    def update(self):
+        with self.lock:
+            self.__update()
+
+    def supply_known(self, now):
+        # Whether driver positions have arrived within the window
+        updated_at = self.supply_updated_at
+        return updated_at is not None and now - updated_at < self.window_seconds
+
+    def __refresh(self):
+        if self.clock() >= self.next_update_at:
+            self.__update()
+        return self.epoch
+
+    def __update(self):
+        now = self.clock()
+        if self.supply_source is not None:
+            self.__read_supply()
+        # The current bucket's supply sample is the latest count
+        self.__sample_supply(self.__advance(now))
+
+        if not self.numpy_loaded and len(self.cells) >= NUMPY_MIN_ROWS:
+            self.numpy = load_numpy()
+            self.numpy_loaded = True
+
+        if not self.cells or not self.supply_known(now):
+            self.multipliers = []
+        elif self.numpy is None:
+            self.multipliers = self.__multipliers_python()
+        else:
+            self.multipliers = self.__multipliers_numpy(self.numpy)
+
+        self.epoch += 1
+        self.next_update_at = now + self.update_seconds
+
+    def __read_supply(self):
+        # A failed read keeps the last counts until they leave the window
+        try:
+            counts = self.supply_source(list(self.cells))
+        except Exception as e:
+            print(f"Reading surge supply failed: {e!r}")
+            return
+        if counts is not None:
+            self.__set_supply(counts)
+
+    def __multipliers_numpy(self, numpy):
+        rows = len(self.cells)
+        seen = min(self.buckets_seen, self.bucket_count)
+
+        demand = numpy.frombuffer(self.demand, dtype=numpy.int64).reshape(rows, -1)
+        supply = numpy.frombuffer(self.supply, dtype=numpy.int64).reshape(rows, -1)
+        neighbours = numpy.frombuffer(self.neighbours, dtype=numpy.int64)
+        neighbours = neighbours.reshape(rows, len(NEIGHBOURHOOD))
+        weights = numpy.full(len(NEIGHBOURHOOD), self.neighbour_weight)
+        weights[SELF] = 1.0
+
+        # Requests in the window and mean available drivers, with a trailing
+        # zero for NO_NEIGHBOUR (-1) to index
+        padded = numpy.zeros((2, rows + 1))
+        demand.sum(axis=1, out=padded[0, :rows])
+        supply.sum(axis=1, out=padded[1, :rows])
+        padded[1] /= seen
+
+        smoothed = padded[:, neighbours] @ weights
+        ratio = smoothed[0] / numpy.maximum(smoothed[1], 1.0)
+        multipliers = 1.0 + self.sensitivity * (ratio - self.threshold)
+        numpy.clip(multipliers, 1.0, self.max_multiplier, out=multipliers)
+        # Down to the step; the epsilon keeps 1.3 from becoming 1.2
+        steps = numpy.floor(multipliers / MULTIPLIER_STEP + 1e-9)
+        return (steps * MULTIPLIER_STEP).round(1).tolist()
+
+    def __multipliers_python(self):
+        rows = len(self.cells)
+        buckets = self.bucket_count
+        seen = min(self.buckets_seen, buckets)
+        width = len(NEIGHBOURHOOD)
+
+        demand = [
+            sum(self.demand[row * buckets : (row + 1) * buckets]) for row in range(rows)
+        ] + [0.0]
+        supply = [
+            sum(self.supply[row * buckets : (row + 1) * buckets]) / seen
+            for row in range(rows)
+        ] + [0.0]
+
+        multipliers = []
+        for row in range(rows):
+            smoothed_demand = smoothed_supply = 0.0
+            for k, neighbour in enumerate(
+                self.neighbours[row * width : (row + 1) * width]
+            ):
+                weight = 1.0 if k == SELF else self.neighbour_weight
+                smoothed_demand += weight * demand[neighbour]
+                smoothed_supply += weight * supply[neighbour]
+            ratio = smoothed_demand / max(smoothed_supply, 1.0)
+            multiplier = 1.0 + self.sensitivity * (ratio - self.threshold)
+            multiplier = min(max(multiplier, 1.0), self.max_multiplier)
+            steps = math.floor(multiplier / MULTIPLIER_STEP + 1e-9)
+            multipliers.append(round(steps * MULTIPLIER_STEP, 1))
+        return multipliers
+
+    def __advance(self, now):
+        # Moves the rings to the bucket of `now`; returns its slot
+        bucket = int(now // self.bucket_seconds)
+        if bucket == self.bucket:
+            return self.slot
+
+        buckets = self.bucket_count
+        if self.bucket is None:
+            self.bucket = bucket
+            self.buckets_seen = 1
+            self.__sample_supply(bucket % buckets)
+        elif bucket > self.bucket:
+            zeros = array("q", [0]) * len(self.cells)
+            for passed in range(max(self.bucket + 1, bucket - buckets + 1), bucket + 1):
+                slot = passed % buckets
+                self.demand[slot::buckets] = zeros
+                self.__sample_supply(slot)
+            self.buckets_seen += bucket - self.bucket
+            self.bucket = bucket
+
+        self.slot = self.bucket % buckets
+        return self.slot
+
+    def __sample_supply(self, slot):
+        self.supply[slot :: self.bucket_count] = self.available
+
+    def __row(self, latitude, longitude):
+        return self.__cell_row(self.cell_of(latitude, longitude))
+
+    def __cell_row(self, cell):
+        row = self.rows.get(cell)
+
+        if row is None:
+            row = len(self.cells)
+            self.rows[cell] = row
+            self.cells.append(cell)
+            self.demand.extend(array("q", [0]) * self.bucket_count)
+            self.supply.extend(array("q", [0]) * self.bucket_count)
+            self.available.append(0)
+
+            # Link the new cell and its existing neighbours both ways
+            i, j = cell
+            width = len(NEIGHBOURHOOD)
+            for k, (di, dj) in enumerate(NEIGHBOURHOOD):
+                neighbour = row if k == SELF else self.rows.get((i + di, j + dj))
+                if neighbour is None:
+                    self.neighbours.append(NO_NEIGHBOUR)
+                else:
+                    self.neighbours.append(neighbour)
+                    self.neighbours[neighbour * width + width - 1 - k] = row
+
+        return row
+
+
+class SurgeSupplyTable:
+    """Available drivers per surge cell, shared between Lambda functions.
+
+    The function that consumes driver pings counts drivers per cell in a
+    SurgePricer of its own and publish()es the counts; ride request
+    containers read() them as their pricer's supply_source. Every writing
+    container has its own item per cell, keyed by the cell's region and
+    "cell#writer", so writers never contend for an item and one Query per
+    region reads a city. read() sums the writers' counts and ignores items
+    older than `max_age_seconds`, which drops containers that stopped.
+
+    publish() writes the cells whose count changed since its last write,
+    and every cell once `heartbeat_seconds` have passed, so that the items
+    of a writer whose counts hold still do not age out. A driver must only
+    be counted by one writer, so pings should come from a Kinesis stream
+    partitioned by driver id.
+    """
+
+    def __init__(
+        self,
+        dynamodb_client,
+        table_name=DEFAULT_SUPPLY_TABLE,
+        cell_size=DEFAULT_CELL_SIZE_DEGREES,
+        region_degrees=DEFAULT_SUPPLY_REGION_DEGREES,
+        max_age_seconds=DEFAULT_WINDOW_SECONDS,
+        heartbeat_seconds=None,
+        writer_id=WRITER_ID,
+        clock=time.time,
+    ):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+        self.region_cells = max(1, round(region_degrees / cell_size))
+        self.max_age_seconds = max_age_seconds
+        if heartbeat_seconds is None:
+            heartbeat_seconds = max_age_seconds / 3
+        self.heartbeat_seconds = heartbeat_seconds
+        self.writer_id = writer_id
+        self.clock = clock
+        # {cell: count} as last written
+        self.published = {}
+        self.next_heartbeat_at = float("-inf")
+
+    @classmethod
+    def from_environment(cls, dynamodb_client):
+        return cls(
+            dynamodb_client,
+            table_name=os.environ.get("SURGE_SUPPLY_TABLE", DEFAULT_SUPPLY_TABLE),
+            cell_size=float(
+                os.environ.get("SURGE_CELL_SIZE_DEGREES", DEFAULT_CELL_SIZE_DEGREES)
+            ),
+            max_age_seconds=float(
+                os.environ.get("SURGE_WINDOW_SECONDS", DEFAULT_WINDOW_SECONDS)
+            ),
+        )
+
+    def region_of(self, cell):
+        i, j = cell
+        return f"{i // self.region_cells}:{j // self.region_cells}"
+
+    def publish(self, counts):
+        """Writes `counts` ({cell: available}); returns the cells not written.
+
+        Cells that were not written are retried by the next publish.
+        """
+        now = self.clock()
+        heartbeat = now >= self.next_heartbeat_at
+        published = self.published
+        cells = [
+            cell
+            for cell, count in counts.items()
+            if heartbeat or published.get(cell) != count
+        ]
+
+        requests = [
+            {"PutRequest": {"Item": self.__item(cell, counts[cell], now)}}
+            for cell in cells
+        ]
+        unprocessed = []
+        for start in range(0, len(requests), BATCH_WRITE_MAX_ITEMS):
+            unprocessed.extend(
+                batch_write(
+                    self.dynamodb_client,
+                    self.table_name,
+                    requests[start : start + BATCH_WRITE_MAX_ITEMS],
+                )
+            )
+
+        failed = {
+            self.__cell_of(request["PutRequest"]["Item"]) for request in unprocessed
+        }
+        for cell in cells:
+            if cell not in failed:
+                published[cell] = counts[cell]
+        if heartbeat and not failed:
+            self.next_heartbeat_at = now + self.heartbeat_seconds
+        return failed
+
+    def read(self, cells):
+        """Available drivers in `cells` and their neighbours' regions.
+
+        Returns None when no writer has published within max_age_seconds,
+        so that a pricer treats the supply as unknown.
+        """
+        regions = {
+            self.region_of((i + di, j + dj))
+            for i, j in cells
+            for di, dj in NEIGHBOURHOOD
+        }
+        oldest = {"N": str(int((self.clock() - self.max_age_seconds) * 1000))}
+        counts = {}
+        fresh = False
+
+        for region in sorted(regions):
+            for item in self.__query(region, oldest):
+                fresh = True
+                cell = self.__cell_of(item)
+                counts[cell] = counts.get(cell, 0) + int(item["available"]["N"])
+
+        return counts if fresh else None
+
+    def __query(self, region, oldest):
+        kwargs = {}
+        while True:
+            response = self.dynamodb_client.query(
+                TableName=self.table_name,
+                KeyConditionExpression="#region = :region",
+                FilterExpression="updatedAt >= :oldest",
+                ExpressionAttributeNames={"#region": "region"},
+                ExpressionAttributeValues={
+                    ":region": {"S": region},
+                    ":oldest": oldest,
+                },
+                **kwargs,
+            )
+            yield from response.get("Items", [])
+
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def __item(self, cell, count, now):
+        i, j = cell
+        return SURGE_SUPPLY_ITEM.marshal(
+            {
+                "region": self.region_of(cell),
+                "cell": f"{i}:{j}#{self.writer_id}",
+                "available": count,
+                "updatedAt": int(now * 1000),
+                "expiresAt": int(now + 2 * self.max_age_seconds),
+            }
+        )
+
+    @staticmethod
+    def __cell_of(item):
+        i, j = item["cell"]["S"].split("#", 1)[0].split(":")
+        return int(i), int(j)
@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    # Runs a test with NumPy and with the pure-Python fallback. The test
+    # module lists the (module, attribute, value) patches that force the
+    # fallback in NUMPY_FALLBACK
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        for module, name, value in request.module.NUMPY_FALLBACK:
+            monkeypatch.setattr(module, name, value)
+    return request.param
@@ -0,0 +1,37 @@
+import json
+
+
+class FakeClock:
+    # Reads `now`, which tests move by hand; with a `step`, every reading
+    # is that much later than the previous one
+    def __init__(self, now=0.0, step=0.0):
+        self.now = now
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+class FakeDynamoDBClient:
+    # Records (TableName, Item) for every put; fails them all while `fail`
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.items = []
+
+    def put_item(self, TableName, Item):
+        if self.fail:
+            raise ConnectionError("connection reset")
+        self.items.append((TableName, Item))
+
+
+def ride_request_body(customer_id="customer-1"):
+    return {
+        "customerId": customer_id,
+        "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+        "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+    }
+
+
+def ride_request_event(customer_id="customer-1"):
+    return {"body": json.dumps(ride_request_body(customer_id))}
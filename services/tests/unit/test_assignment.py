@@ -0,0 +1,171 @@
+import itertools
+import json
+import random
+import time
+
+import pytest
+
+from ride_match import app
+from ride_match.app import MatchPublisher, RideMatcher
+from ride_match.assignment import (
+    greedy_with_improvement,
+    hungarian,
+    solve_assignment,
+)
+from ride_match.spatial_index import DriverGridIndex
+
+
+def total_cost(cost, assignment):
+    return sum(cost[row][column] for row, column in assignment.items())
+
+
+def brute_force_minimum(cost):
+    rows = range(len(cost))
+    columns = range(len(cost[0]))
+    return min(
+        sum(cost[row][column] for row, column in zip(rows, permutation))
+        for permutation in itertools.permutations(columns, len(cost))
+    )
+
+
+def random_cost(rows, columns, seed):
+    rng = random.Random(seed)
+    return [[rng.uniform(0, 10) for _ in range(columns)] for _ in range(rows)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_hungarian_finds_optimum(seed):
+    cost = random_cost(5, 7, seed)
+
+    assignment = solve_assignment(cost, candidates_per_row=7)
+
+    assert len(assignment) == 5
+    assert len(set(assignment.values())) == 5
+    assert total_cost(cost, assignment) == pytest.approx(brute_force_minimum(cost))
+
+
+def test_hungarian_handles_more_rows_than_columns():
+    cost = random_cost(6, 3, seed=1)
+    candidates = {
+        row: [(value, column) for column, value in enumerate(values)]
+        for row, values in enumerate(cost)
+    }
+
+    assignment = hungarian(candidates)
+
+    assert len(assignment) == 3
+    assert len(set(assignment.values())) == 3
+
+
+def test_infeasible_pairs_are_never_assigned():
+    cost = [[1.0, 50.0], [60.0, 70.0]]
+
+    assert solve_assignment(cost, max_cost=10) == {0: 0}
+
+
+def test_greedy_with_improvement_beats_plain_greedy():
+    # Plain greedy takes (0, 0) at cost 1 and then pays 100 for row 1
+    candidates = {0: [(1.0, 0), (2.0, 1)], 1: [(2.0, 0), (100.0, 1)]}
+
+    assignment = greedy_with_improvement(candidates)
+
+    assert assignment == {0: 1, 1: 0}
+
+
+def test_large_batches_respect_deadline():
+    cost = random_cost(300, 300, seed=2)
+
+    start = time.monotonic()
+    assignment = solve_assignment(cost, deadline=start + 0.2)
+
+    assert time.monotonic() - start < 1.0
+    assert len(set(assignment.values())) == len(assignment)
+
+
+def test_match_batch_beats_sequential_matching():
+    rng = random.Random(3)
+    drivers = {
+        f"driver-{i}": (rng.uniform(51.45, 51.55), rng.uniform(-0.2, 0.0))
+        for i in range(80)
+    }
+    locations = [
+        {"latitude": rng.uniform(51.45, 51.55), "longitude": rng.uniform(-0.2, 0.0)}
+        for _ in range(60)
+    ]
+    sequential = RideMatcher(DriverGridIndex())
+    batched = RideMatcher(DriverGridIndex())
+    for driver_id, (latitude, longitude) in drivers.items():
+        sequential.update_driver_location(driver_id, latitude, longitude)
+        batched.update_driver_location(driver_id, latitude, longitude)
+
+    sequential_matches = [sequential.match(location) for location in locations]
+    batch_matches = batched.match_batch(locations)
+
+    assert all(batch_matches)
+    assert len({match["driverId"] for match in batch_matches}) == len(locations)
+    assert sum(match["distanceKm"] for match in batch_matches) < sum(
+        match["distanceKm"] for match in sequential_matches
+    )
+
+
+class FakeSQSClient:
+    def __init__(self, fail_ids=()):
+        self.fail_ids = set(fail_ids)
+        self.messages = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        failed = []
+        for entry in Entries:
+            body = json.loads(entry["MessageBody"])
+            if body["rideId"] in self.fail_ids:
+                failed.append({"Id": entry["Id"], "Code": "InternalError"})
+            else:
+                self.messages.append(body)
+        return {"Successful": [], "Failed": failed}
+
+
+def match_request_event(ride_ids, location):
+    records = [
+        {
+            "messageId": f"m-{ride_id}",
+            "body": json.dumps({"rideId": ride_id, "pickupLocation": location}),
+        }
+        for ride_id in ride_ids
+    ]
+    return {"Records": records + [{"messageId": "m-invalid", "body": "{}"}]}
+
+
+def test_batch_lambda_handler_publishes_matches_and_retries_the_rest(monkeypatch):
+    matcher = RideMatcher(DriverGridIndex())
+    matcher.update_driver_location("driver-1", 51.5075, -0.1279)
+    sqs = FakeSQSClient()
+    monkeypatch.setattr(app, "ride_matcher", matcher)
+    monkeypatch.setattr(app, "match_publisher", MatchPublisher("queue", sqs))
+    location = {"latitude": 51.5074, "longitude": -0.1278}
+
+    response = app.batch_lambda_handler(
+        match_request_event(["ride-1", "ride-2"], location), None
+    )
+
+    # ride-2 found no driver; the malformed record is dropped, not retried
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m-ride-2"}]}
+    assert [(message["rideId"], message["driverId"]) for message in sqs.messages] == [
+        ("ride-1", "driver-1")
+    ]
+
+
+def test_matches_that_cannot_be_published_are_retried(monkeypatch):
+    matcher = RideMatcher(DriverGridIndex())
+    location = {"latitude": 51.5074, "longitude": -0.1278}
+    ride_ids = [f"ride-{n}" for n in range(12)]
+    for n in range(12):
+        matcher.update_driver_location(f"driver-{n}", 51.5074 + n * 1e-4, -0.1278)
+    sqs = FakeSQSClient(fail_ids={"ride-3"})
+    monkeypatch.setattr(app, "ride_matcher", matcher)
+    monkeypatch.setattr(app, "match_publisher", MatchPublisher("queue", sqs))
+
+    response = app.batch_lambda_handler(match_request_event(ride_ids, location), None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m-ride-3"}]}
+    assert len(sqs.messages) == 11
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+
+from ride_request.app_old_v11 import (
+    AsyncRideRequestHandler,
+    AsyncRideRequestStorage,
+    RequestValidator,
+    RideRequestDynamoDBStorage,
+    RideRequestHandler,
+)
+from tests.unit.fakes import ride_request_event
+
+DELAY = 0.1
+
+
+class SlowDynamoDBClient:
+    def __init__(self, delay=DELAY, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.items = []
+
+    def put_item(self, TableName, Item):
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("connection reset")
+        self.items.append(Item)
+
+
+def create_handler(client, candidate_finder=None, candidate_timeout=0.5):
+    storage = AsyncRideRequestStorage(RideRequestDynamoDBStorage(client))
+    return AsyncRideRequestHandler(
+        RequestValidator(),
+        storage,
+        candidate_finder=candidate_finder,
+        candidate_timeout=candidate_timeout,
+    )
+
+
+async def slow_candidates(location):
+    await asyncio.sleep(DELAY)
+    return [{"driverId": "driver-1", "distanceKm": 0.4}]
+
+
+def test_storage_and_candidates_overlap():
+    client = SlowDynamoDBClient()
+    handler = create_handler(client, slow_candidates)
+
+    started = time.perf_counter()
+    result = handler.handle(ride_request_event(), None)
+    elapsed = time.perf_counter() - started
+
+    assert result.status_code == 200
+    assert result.data["candidateDrivers"] == [
+        {"driverId": "driver-1", "distanceKm": 0.4}
+    ]
+    assert result.data["estimatedArrivalTime"].endswith("Z")
+    assert len(client.items) == 1
+    # Both dependencies take DELAY; run in sequence they would take twice that
+    assert elapsed < DELAY * 1.8
+
+
+def test_matches_the_sync_handler_response_shape():
+    sync_handler = RideRequestHandler(
+        RequestValidator(), RideRequestDynamoDBStorage(SlowDynamoDBClient(delay=0))
+    )
+    async_handler = create_handler(SlowDynamoDBClient(delay=0))
+
+    sync_result = sync_handler.handle(ride_request_event(), None)
+    async_result = async_handler.handle(ride_request_event(), None)
+
+    assert async_result.status_code == sync_result.status_code == 200
+    assert set(async_result.data) == set(sync_result.data)
+
+
+def test_candidate_timeout_is_left_out_of_the_response():
+    handler = create_handler(
+        SlowDynamoDBClient(delay=0), slow_candidates, candidate_timeout=0.01
+    )
+
+    result = handler.handle(ride_request_event(), None)
+
+    assert result.status_code == 200
+    assert "candidateDrivers" not in result.data
+
+
+def test_storage_failure_returns_500():
+    handler = create_handler(SlowDynamoDBClient(delay=0, fail=True), slow_candidates)
+
+    result = handler.handle(ride_request_event(), None)
+
+    assert result.status_code == 500
+
+
+def test_invalid_requests_are_rejected_before_any_io():
+    client = SlowDynamoDBClient()
+    handler = create_handler(client)
+
+    assert handler.handle({"body": "{not json"}, None).status_code == 400
+    assert handler.handle({"body": json.dumps({})}, None).status_code == 400
+    assert client.items == []
+
+
+def test_concurrent_requests_share_one_event_loop():
+    client = SlowDynamoDBClient()
+    handler = create_handler(client, slow_candidates)
+
+    async def burst():
+        return await asyncio.gather(
+            *(handler.handle_async(ride_request_event(str(i)), None) for i in range(5))
+        )
+
+    started = time.perf_counter()
+    results = asyncio.run(burst())
+    elapsed = time.perf_counter() - started
+
+    assert [result.status_code for result in results] == [200] * 5
+    assert elapsed < DELAY * 3
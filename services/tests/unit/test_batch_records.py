@@ -0,0 +1,50 @@
+import base64
+import json
+
+from common.batch_records import BatchRecordHandler
+
+
+class RecordingHandler(BatchRecordHandler):
+    # Retries every record whose body asks for it
+    def __init__(self):
+        self.processed = []
+
+    def process(self, records):
+        self.processed.extend(records)
+        return [record_id for record_id, body in records if body.get("retry")]
+
+
+def kinesis_record(sequence_number, body):
+    data = base64.b64encode(json.dumps(body).encode()).decode()
+    return {"kinesis": {"sequenceNumber": sequence_number, "data": data}}
+
+
+def test_sqs_and_kinesis_records_are_parsed_and_failures_reported():
+    handler = RecordingHandler()
+    records = [
+        {"messageId": "m1", "body": json.dumps({"retry": True})},
+        kinesis_record("s2", {"retry": False}),
+        kinesis_record("s3", {"retry": True}),
+    ]
+
+    result = handler.handle({"Records": records}, None)
+
+    assert result == {
+        "batchItemFailures": [{"itemIdentifier": "m1"}, {"itemIdentifier": "s3"}]
+    }
+    assert [record_id for record_id, _ in handler.processed] == ["m1", "s2", "s3"]
+
+
+def test_malformed_records_are_dropped():
+    handler = RecordingHandler()
+    records = [
+        {"messageId": "m1", "body": "not json"},
+        {"messageId": "m2", "body": "[1, 2]"},
+        {"messageId": "m3"},
+        {"messageId": "m4", "body": "{}"},
+    ]
+
+    result = handler.handle({"Records": records}, None)
+
+    assert result == {"batchItemFailures": []}
+    assert handler.processed == [("m4", {})]
@@ -0,0 +1,120 @@
+import base64
+import json
+
+from ride_request import app_old_v11
+from ride_request.app_old_v11 import (
+    RequestValidator,
+    RideRequestBatchHandler,
+    RideRequestDynamoDBStorage,
+)
+from tests.unit.fakes import ride_request_body
+
+
+class FakeBatchDynamoDBClient:
+    """Leaves the first `unprocessed` items of each call unprocessed."""
+
+    def __init__(self, unprocessed=0, fail=False):
+        self.unprocessed = unprocessed
+        self.fail = fail
+        self.calls = []
+        self.items = {}
+
+    def batch_write_item(self, RequestItems):
+        self.calls.append(RequestItems)
+
+        if self.fail:
+            raise ConnectionError("connection reset")
+
+        unprocessed = {}
+        for table, requests in RequestItems.items():
+            assert len(requests) <= app_old_v11.BATCH_WRITE_MAX_ITEMS
+            skipped = requests[: self.unprocessed]
+            for request in requests[self.unprocessed :]:
+                item = request["PutRequest"]["Item"]
+                self.items[item["rideId"]["S"]] = item
+            if skipped:
+                unprocessed[table] = skipped
+
+        return {"UnprocessedItems": unprocessed}
+
+
+def create_storage(client, delays):
+    return RideRequestDynamoDBStorage(client, max_batch_retries=3, sleep=delays.append)
+
+
+def test_store_many_groups_items_into_batches():
+    client = FakeBatchDynamoDBClient()
+    storage = create_storage(client, [])
+
+    results = storage.store_many([ride_request_body(str(i)) for i in range(60)])
+
+    batch_sizes = [len(call[app_old_v11.RIDE_REQUESTS_TABLE]) for call in client.calls]
+    assert batch_sizes == [25, 25, 10]
+    assert all(result.status_code == 201 for result in results)
+    assert {result.data["rideId"] for result in results} == set(client.items)
+
+
+def test_store_many_retries_unprocessed_items_with_backoff():
+    client = FakeBatchDynamoDBClient(unprocessed=2)
+    delays = []
+    storage = create_storage(client, delays)
+
+    results = storage.store_many([ride_request_body(str(i)) for i in range(5)])
+
+    # Two items are skipped on every call, so they exhaust the retries
+    assert len(client.calls) == 4
+    assert len(delays) == 3
+    assert all(0 <= delay <= storage.max_retry_delay for delay in delays)
+    assert [result.status_code for result in results] == [500, 500, 201, 201, 201]
+
+
+def test_store_many_reports_invalid_bodies_per_record():
+    client = FakeBatchDynamoDBClient()
+    storage = create_storage(client, [])
+
+    results = storage.store_many([ride_request_body(), {"customerId": "c"}])
+
+    assert [result.status_code for result in results] == [201, 400]
+    assert len(client.items) == 1
+
+
+def test_batch_handler_reports_partial_failures():
+    client = FakeBatchDynamoDBClient(unprocessed=1)
+    handler = RideRequestBatchHandler(RequestValidator(), create_storage(client, []))
+    event = {
+        "Records": [
+            {"messageId": "m-1", "body": json.dumps(ride_request_body())},
+            {"messageId": "m-2", "body": "not json"},
+            {"messageId": "m-3", "body": json.dumps({"customerId": "c"})},
+            {
+                "kinesis": {
+                    "sequenceNumber": "k-4",
+                    "data": base64.b64encode(
+                        json.dumps(ride_request_body()).encode()
+                    ).decode(),
+                }
+            },
+        ]
+    }
+
+    response = handler.handle(event, None)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": "m-1"}]}
+    assert len(client.items) == 1
+
+
+def test_batch_handler_reports_every_record_when_storage_fails():
+    client = FakeBatchDynamoDBClient(fail=True)
+    handler = RideRequestBatchHandler(RequestValidator(), create_storage(client, []))
+    event = {
+        "Records": [
+            {"messageId": f"m-{i}", "body": json.dumps(ride_request_body())}
+            for i in range(3)
+        ]
+    }
+
+    response = handler.handle(event, None)
+
+    assert response["batchItemFailures"] == [
+        {"itemIdentifier": f"m-{i}"} for i in range(3)
+    ]
@@ -0,0 +1,62 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from common.resources import LazyClient
+from ride_request.app_old_v11 import (
+    RequestValidator,
+    RideRequestDynamoDBStorage,
+    RideRequestHandler,
+)
+from tests.unit.fakes import FakeDynamoDBClient
+
+SERVICES_DIR = Path(__file__).resolve().parents[2]
+
+
+def test_importing_the_handler_does_not_load_boto3():
+    script = (
+        "import sys, ride_request.app_old_v11; "
+        "print(sorted(m for m in sys.modules if m.split('.')[0] in "
+        "('boto3', 'botocore')))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=SERVICES_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert completed.stdout.strip() == "[]"
+
+
+def test_lazy_client_builds_once_on_first_use():
+    built = []
+
+    def factory():
+        built.append(FakeDynamoDBClient())
+        return built[-1]
+
+    client = LazyClient(factory)
+    assert not client.is_loaded
+
+    client.put_item(TableName="RideRequests", Item={"rideId": {"S": "1"}})
+    client.put_item(TableName="RideRequests", Item={"rideId": {"S": "2"}})
+
+    assert client.is_loaded
+    assert len(built) == 1
+    assert len(built[0].items) == 2
+
+
+def test_invalid_requests_never_build_the_client():
+    def factory():
+        raise AssertionError("client built for an invalid request")
+
+    client = LazyClient(factory)
+    handler = RideRequestHandler(RequestValidator(), RideRequestDynamoDBStorage(client))
+
+    result = handler.handle({"body": json.dumps({"customerId": "c1"})}, None)
+
+    assert result.status_code == 400
+    assert not client.is_loaded
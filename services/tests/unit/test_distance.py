@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from common.geo import haversine_km
+from ride_match import distance
+from ride_match.app import RideMatcher
+from ride_match.spatial_index import DriverGridIndex
+
+NUMPY_FALLBACK = [(distance, "numpy", None)]
+
+
+def random_points(count, seed):
+    rng = random.Random(seed)
+    return [(rng.uniform(51.3, 51.7), rng.uniform(-0.5, 0.3)) for _ in range(count)]
+
+
+def as_lists(matrix):
+    return [list(row) for row in matrix]
+
+
+def test_haversine_matrix_matches_scalar_haversine(backend):
+    origins = random_points(7, seed=1)
+    destinations = random_points(5, seed=2)
+
+    # A tiny chunk size forces several row blocks
+    matrix = as_lists(distance.haversine_matrix(origins, destinations, 10))
+
+    for i, (lat1, lon1) in enumerate(origins):
+        for j, (lat2, lon2) in enumerate(destinations):
+            expected = haversine_km(lat1, lon1, lat2, lon2)
+            assert matrix[i][j] == pytest.approx(expected, rel=1e-9, abs=1e-9)
+
+
+def test_equirectangular_matrix_is_close_to_haversine(backend):
+    origins = random_points(6, seed=3)
+    destinations = random_points(9, seed=4)
+
+    approximate = as_lists(distance.equirectangular_matrix(origins, destinations, 4))
+    exact = as_lists(distance.haversine_matrix(origins, destinations))
+
+    for approximate_row, exact_row in zip(approximate, exact):
+        assert approximate_row == pytest.approx(exact_row, rel=1e-3)
+
+
+def test_empty_inputs(backend):
+    assert len(distance.haversine_matrix([], random_points(3, seed=5))) == 0
+    assert len(distance.equirectangular_matrix([], [])) == 0
+
+
+def test_candidate_distances_scores_batch_against_nearby_drivers(backend):
+    matcher = RideMatcher(DriverGridIndex())
+    matcher.update_driver_location("near", 51.5075, -0.1279)
+    matcher.update_driver_location("far", 52.5, -0.1279)
+    pickups = [
+        {"latitude": 51.5074, "longitude": -0.1278},
+        {"latitude": 51.5080, "longitude": -0.1270},
+    ]
+
+    driver_ids, matrix = matcher.candidate_distances(pickups)
+
+    assert driver_ids == ["near"]
+    assert [len(row) for row in matrix] == [1, 1]
+    assert matrix[0][0] < 0.1
@@ -0,0 +1,144 @@
+import json
+
+from common.driver_ingestion import DriverLocationBatchHandler, DriverLocationIngestor
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from common.write_behind import WriteBehindBuffer
+from ride_match import app as ride_match_app
+from ride_match.spatial_index import DriverGridIndex
+
+
+def message(driver_id, *pings, available=True):
+    return {
+        "driverId": driver_id,
+        "available": available,
+        "pings": [
+            {"latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+            for timestamp, latitude, longitude in pings
+        ],
+    }
+
+
+def create_ingestor(client=None, index=None, **kwargs):
+    buffer = WriteBehindBuffer(
+        client or InMemoryDynamoDBClient(),
+        "Drivers",
+        "driverId",
+        sleep=lambda delay: None,
+    )
+    return DriverLocationIngestor(index, buffer, **kwargs)
+
+
+def stored_location(client, driver_id):
+    item = client.get_item(TableName="Drivers", Key={"driverId": {"S": driver_id}})
+    location = item["Item"]["location"]["M"]
+    return (
+        float(location["latitude"]["N"]),
+        float(location["longitude"]["N"]),
+        int(item["Item"]["lastSeen"]["N"]),
+    )
+
+
+def test_only_the_newest_ping_of_a_batch_is_applied():
+    client = InMemoryDynamoDBClient()
+    index = DriverGridIndex()
+    ingestor = create_ingestor(client, index)
+
+    ingestor.ingest(
+        [
+            message("driver-1", (3000, 51.503, -0.12), (1000, 51.501, -0.12)),
+            message("driver-1", (2000, 51.502, -0.12)),
+            message("driver-2", (1000, 51.6, -0.2)),
+        ]
+    )
+
+    assert client.call_counts == {"BatchWriteItem": 1}
+    assert index.location_of("driver-1") == (51.503, -0.12)
+    assert stored_location(client, "driver-1") == (51.503, -0.12, 3000)
+    assert ingestor.stats["superseded"] == 2
+
+
+def test_duplicate_and_late_pings_are_dropped():
+    index = DriverGridIndex()
+    ingestor = create_ingestor(index=index)
+    ingestor.ingest([message("driver-1", (2000, 51.5, -0.12))])
+
+    ingestor.ingest([message("driver-1", (2000, 51.5, -0.12))])
+    ingestor.ingest([message("driver-1", (1000, 51.4, -0.12))])
+
+    assert index.location_of("driver-1") == (51.5, -0.12)
+    assert ingestor.stats["duplicate"] == 1
+    assert ingestor.stats["out_of_order"] == 1
+
+
+def test_small_moves_update_the_index_but_not_the_store():
+    client = InMemoryDynamoDBClient()
+    index = DriverGridIndex()
+    ingestor = create_ingestor(client, index, min_move_km=0.05, heartbeat_seconds=60)
+
+    def ping(timestamp, latitude):
+        ingestor.ingest([message("driver-1", (timestamp, latitude, -0.1255))])
+        return stored_location(client, "driver-1")[2]
+
+    assert ping(0, 51.5097) == 0
+    # 11 m and 22 m from the stored fix, in the same cell
+    assert ping(1000, 51.5098) == 0
+    assert ping(2000, 51.5099) == 0
+    assert index.location_of("driver-1") == (51.5099, -0.1255)
+
+    # 44 m from the stored fix, but across a cell boundary
+    assert ping(3000, 51.5101) == 3000
+    # 55 m in the same cell
+    assert ping(4000, 51.5106) == 4000
+    # Standing still for a minute
+    assert ping(30000, 51.5106) == 4000
+    assert ping(64000, 51.5106) == 64000
+    assert ingestor.stats["written"] == 4
+
+
+def test_unavailable_drivers_leave_the_index_and_are_written():
+    client = InMemoryDynamoDBClient()
+    index = DriverGridIndex()
+    ingestor = create_ingestor(client, index)
+
+    ingestor.ingest([message("driver-1", (0, 51.5, -0.12))])
+    ingestor.ingest([message("driver-1", (1000, 51.5, -0.12), available=False)])
+
+    assert "driver-1" not in index
+    item = client.get_item(TableName="Drivers", Key={"driverId": {"S": "driver-1"}})
+    assert item["Item"]["available"] == {"BOOL": False}
+
+
+def test_batch_handler_reports_records_of_unwritten_drivers():
+    client = InMemoryDynamoDBClient(throttle_rate=1.0)
+    buffer = WriteBehindBuffer(
+        client, "Drivers", "driverId", max_batch_retries=1, sleep=lambda delay: None
+    )
+    handler = DriverLocationBatchHandler(DriverLocationIngestor(None, buffer))
+    records = [
+        {"messageId": "m1", "body": json.dumps(message("driver-1", (0, 51.5, 0.1)))},
+        {"messageId": "m2", "body": "not json"},
+        {"messageId": "m3", "body": json.dumps({"driverId": ["x"], "pings": []})},
+        {"messageId": "m4", "body": json.dumps(message("bad id", (0, 51.5, 0.1)))},
+    ]
+
+    result = handler.handle({"Records": records}, None)
+    client.throttle_rate = 0.0
+    redelivered = handler.handle({"Records": records[:1]}, None)
+
+    assert result == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    assert redelivered == {"batchItemFailures": []}
+    assert client.item_count("Drivers") == 1
+
+
+def test_ride_match_consumes_the_location_stream():
+    body = message("driver-stream-1", (0, 10.0005, 10.0005))
+    event = {"Records": [{"messageId": "m1", "body": json.dumps(body)}]}
+
+    try:
+        ride_match_app.location_lambda_handler(event, None)
+        candidates = ride_match_app.ride_matcher.find_candidates(
+            {"latitude": 10.0, "longitude": 10.0}, k=1
+        )
+        assert candidates[0]["driverId"] == "driver-stream-1"
+    finally:
+        ride_match_app.ride_matcher.remove_driver("driver-stream-1")
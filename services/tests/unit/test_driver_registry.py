@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+from ride_match import driver_registry
+from ride_match.driver_registry import DriverRegistry, StaleDriverRecord
+from ride_match.spatial_index import brute_force_nearest
+
+NUMPY_FALLBACK = [(driver_registry, "numpy", None)]
+
+
+def test_records_read_through_to_the_arrays():
+    registry = DriverRegistry()
+    registry.upsert("driver-1", 51.5, -0.12, "available", 1000)
+    record = registry.get("driver-1")
+
+    registry.upsert("driver-1", 51.6, -0.13, "on_trip", 2000)
+
+    assert (record.driver_id, record.latitude, record.longitude) == (
+        "driver-1",
+        51.6,
+        -0.13,
+    )
+    assert (record.status, record.last_seen) == ("on_trip", 2000)
+    assert registry.get("driver-2") is None
+    with pytest.raises(AttributeError):
+        record.extra = 1
+
+
+def test_removed_slots_are_reused():
+    registry = DriverRegistry()
+    for n in range(3):
+        registry.upsert(f"driver-{n}", 51.5, -0.12)
+
+    assert registry.remove("driver-1")
+    assert not registry.remove("driver-1")
+    slot = registry.upsert("driver-3", 51.5, -0.12)
+
+    assert slot == 1
+    assert len(registry.latitudes) == 3
+    assert len(registry) == 3
+    assert "driver-1" not in registry
+    assert registry.get("driver-3").driver_id == "driver-3"
+
+
+def test_records_of_removed_drivers_go_stale():
+    registry = DriverRegistry()
+    registry.upsert("driver-1", 51.5, -0.12, "on_trip")
+    removed = registry.get("driver-1")
+    registry.remove("driver-1")
+
+    with pytest.raises(StaleDriverRecord):
+        removed.status
+
+    registry.upsert("driver-2", 51.6, -0.13)
+    assert registry.get("driver-2").slot == removed.slot
+    with pytest.raises(StaleDriverRecord):
+        removed.driver_id
+
+
+def test_select_filters_by_status_and_last_seen(backend):
+    registry = DriverRegistry()
+    assert registry.select() == []
+    registry.upsert("driver-1", 51.5, -0.12, "available", 1000)
+    registry.upsert("driver-2", 51.5, -0.12, "available", 5000)
+    registry.upsert("driver-3", 51.5, -0.12, "offline", 5000)
+    registry.upsert("driver-4", 51.5, -0.12, "available", 5000)
+    registry.set_status("driver-4", "assigned")
+    registry.upsert("driver-5", 51.5, -0.12)
+    registry.remove("driver-5")
+
+    assert registry.select() == ["driver-1", "driver-2", "driver-3", "driver-4"]
+    assert registry.select("available") == ["driver-1", "driver-2"]
+    assert registry.select("available", seen_since=2000) == ["driver-2"]
+    assert registry.count(seen_since=2000) == 3
+
+
+def test_nearest_matches_brute_force(backend):
+    rng = random.Random(3)
+    registry = DriverRegistry()
+    available = {}
+    for n in range(500):
+        location = (rng.uniform(51.3, 51.7), rng.uniform(-0.5, 0.3))
+        status = "available" if n % 3 else "on_trip"
+        registry.upsert(f"driver-{n}", *location, status)
+        if status == "available":
+            available[f"driver-{n}"] = location
+
+    for _ in range(20):
+        latitude, longitude = rng.uniform(51.3, 51.7), rng.uniform(-0.5, 0.3)
+        expected = brute_force_nearest(available, latitude, longitude, 5)
+        actual = registry.nearest(latitude, longitude, 5)
+        assert [driver_id for _, driver_id in actual] == [
+            driver_id for _, driver_id in expected
+        ]
+        assert [distance for distance, _ in actual] == pytest.approx(
+            [distance for distance, _ in expected]
+        )
+
+    assert registry.nearest(51.5, -0.1, 5, max_radius_km=0.001) == []
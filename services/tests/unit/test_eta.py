@@ -0,0 +1,91 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from ride_request.app_old_v11 import RideRequestHandler
+from ride_request.eta import EtaEngine
+
+PICKUP = {"latitude": 51.5074, "longitude": -0.1278}
+DESTINATION = {"latitude": 51.4700, "longitude": -0.4543}
+
+
+def departure(hour, minute=0):
+    return datetime(2024, 8, 31, hour, minute, tzinfo=timezone.utc)
+
+
+def test_speed_model_is_slower_at_rush_hour():
+    engine = EtaEngine()
+
+    night = engine.estimate_arrival(PICKUP, DESTINATION, departure(3)) - departure(3)
+    rush = engine.estimate_arrival(PICKUP, DESTINATION, departure(8)) - departure(8)
+
+    assert 0 < night.total_seconds() < rush.total_seconds()
+
+
+def test_matrix_lookup_interpolates_between_buckets():
+    engine = EtaEngine(cell_size=1.0, bucket_minutes=720)
+    origin = engine.cell_of(0.5, 0.5)
+    destination = engine.cell_of(0.5, 1.5)
+    engine.travel_times[origin + destination] = (1000.0, 2000.0)
+    start = {"latitude": 0.5, "longitude": 0.5}
+    end = {"latitude": 0.5, "longitude": 1.5}
+
+    # Bucket centres are 06:00 and 18:00
+    at_six = engine.estimate_arrival(start, end, departure(6)) - departure(6)
+    at_noon = engine.estimate_arrival(start, end, departure(12)) - departure(12)
+
+    assert at_six.total_seconds() == pytest.approx(1000.0)
+    assert at_noon.total_seconds() == pytest.approx(1500.0)
+
+
+def test_from_file(tmp_path):
+    path = tmp_path / "eta.json"
+    path.write_text(
+        json.dumps(
+            {
+                "cellSize": 1.0,
+                "bucketMinutes": 1440,
+                "travelTimes": {"0,0|0,1": [600]},
+            }
+        )
+    )
+
+    engine = EtaEngine.from_file(path)
+    start = {"latitude": 0.5, "longitude": 0.5}
+    end = {"latitude": 0.5, "longitude": 1.5}
+    arrival = engine.estimate_arrival(start, end, departure(9))
+
+    assert (arrival - departure(9)).total_seconds() == pytest.approx(600.0)
+
+
+def test_from_file_rejects_rows_without_a_time_per_bucket(tmp_path):
+    path = tmp_path / "eta.json"
+    path.write_text(
+        json.dumps({"bucketMinutes": 60, "travelTimes": {"0,0|0,1": [600] * 23}})
+    )
+
+    with pytest.raises(ValueError, match="0,0\\|0,1"):
+        EtaEngine.from_file(path)
+
+
+def test_repeated_lookups_hit_the_cache():
+    engine = EtaEngine(cache_size=8)
+
+    for _ in range(3):
+        engine.estimate_arrival(PICKUP, DESTINATION, departure(10, 15))
+
+    info = engine.estimate_seconds.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+
+def test_arrival_times_are_utc_to_the_second():
+    handler = RideRequestHandler(None, None, EtaEngine())
+    requested_at = datetime(2024, 8, 31, 8, 0, 0, 123456, tzinfo=timezone.utc)
+    body = {"pickupLocation": PICKUP, "destinationLocation": DESTINATION}
+
+    arrival = handler.eta_engine.estimate_arrival(PICKUP, DESTINATION, requested_at)
+
+    assert handler.calculate_estimated_arrival_time(
+        body, requested_at
+    ) == arrival.strftime("%Y-%m-%dT%H:%M:%SZ")
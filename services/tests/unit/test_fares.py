@@ -0,0 +1,137 @@
+import json
+from datetime import datetime, timezone
+
+from ride_request.app_old_v11 import FareEstimateHandler
+from ride_request.eta import EtaEngine
+from ride_request.fares import EpochLRUCache, FareEstimator
+from ride_request.surge import SurgePricer
+from tests.unit.fakes import FakeClock
+
+PICKUP = {"latitude": 51.5074, "longitude": -0.1278}
+DESTINATION = {"latitude": 51.4700, "longitude": -0.4543}
+DEPARTURE = datetime(2024, 8, 31, 14, 2, tzinfo=timezone.utc)
+
+
+def test_nearby_quotes_in_the_same_slot_share_a_cache_entry():
+    estimator = FareEstimator()
+
+    first = estimator.estimate(PICKUP, DESTINATION, DEPARTURE)
+    # 20 m away and two minutes later, in the same squares and slot
+    nearby = estimator.estimate(
+        {"latitude": 51.5075, "longitude": -0.1276},
+        DESTINATION,
+        DEPARTURE.replace(minute=4),
+    )
+    later = estimator.estimate(PICKUP, DESTINATION, DEPARTURE.replace(minute=5))
+    elsewhere = estimator.estimate(
+        {"latitude": 51.5174, "longitude": -0.1278}, DESTINATION, DEPARTURE
+    )
+
+    assert nearby is first
+    assert later is not first and elsewhere is not first
+    assert elsewhere["distanceKm"] != first["distanceKm"]
+    cache = estimator.quote_cache
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.hit_rate == 0.25
+
+
+def test_fares_follow_the_tariff_and_the_minimum():
+    estimator = FareEstimator(
+        base_fare=2.0, per_km=1.0, per_minute=0.5, minimum_fare=10.0
+    )
+
+    quote = estimator.estimate(PICKUP, DESTINATION, DEPARTURE)
+    short = estimator.estimate(PICKUP, PICKUP, DEPARTURE)
+
+    expected = 2.0 + quote["distanceKm"] + 0.5 * quote["durationSeconds"] / 60
+    assert abs(quote["fare"] - expected) < 0.05
+    assert quote["currency"] == "GBP"
+    assert quote["surgeMultiplier"] == 1.0
+    assert short["fare"] == 10.0
+
+
+def test_quotes_expire_when_surge_multipliers_are_updated():
+    clock = FakeClock(1000.0)
+    pricer = SurgePricer(
+        window_seconds=60, bucket_seconds=10, update_seconds=5, clock=clock
+    )
+    estimator = FareEstimator(surge_pricer=pricer)
+    # Supply is known, but no driver is near the pickup
+    pricer.upsert("driver-1", DESTINATION["latitude"], DESTINATION["longitude"])
+
+    first = estimator.estimate(PICKUP, DESTINATION, DEPARTURE)
+    for _ in range(3):
+        pricer.record_request(PICKUP)
+    assert estimator.estimate(PICKUP, DESTINATION, DEPARTURE) is first
+
+    clock.now += 5
+    surged = estimator.estimate(PICKUP, DESTINATION, DEPARTURE)
+
+    assert surged["surgeMultiplier"] == 2.0
+    assert surged["fare"] == round(first["fare"] * 2, 2)
+
+
+def test_epoch_cache_is_bounded_lru():
+    cache = EpochLRUCache(maxsize=2, ttl_epochs=2)
+    cache.put("a", 1, epoch=0)
+    cache.put("b", 2, epoch=0)
+    assert cache.get("a", epoch=1) == 1
+    cache.put("c", 3, epoch=1)
+
+    assert cache.get("b", epoch=1) is None
+    assert cache.get("a", epoch=2) is None
+    assert cache.get("c", epoch=2) == 3
+    assert len(cache) == 1
+
+
+def test_handler_validates_and_quotes():
+    handler = FareEstimateHandler(FareEstimator())
+    body = {"pickupLocation": PICKUP, "destinationLocation": DESTINATION}
+
+    quoted = handler.handle({"body": json.dumps(body)}, None)
+    invalid = handler.handle(
+        {"body": json.dumps({**body, "pickupLocation": {"latitude": 91}})}, None
+    )
+    malformed = handler.handle({"body": "{"}, None)
+
+    assert quoted.status_code == 200
+    assert set(quoted.data) == {
+        "fare",
+        "currency",
+        "surgeMultiplier",
+        "distanceKm",
+        "durationSeconds",
+    }
+    assert [invalid.status_code, malformed.status_code] == [400, 400]
+
+
+def test_slots_are_in_the_eta_engines_local_time():
+    local = FareEstimator(EtaEngine(utc_offset_minutes=60))
+    utc = FareEstimator(EtaEngine())
+
+    for hour in (16, 23):
+        departure = DEPARTURE.replace(hour=hour, minute=30)
+        local_departure = DEPARTURE.replace(hour=(hour + 1) % 24, minute=30)
+        assert local.estimate(PICKUP, DESTINATION, departure) == utc.estimate(
+            PICKUP, DESTINATION, local_departure
+        )
+    assert local.estimate(PICKUP, DESTINATION, DEPARTURE) != utc.estimate(
+        PICKUP, DESTINATION, DEPARTURE
+    )
+
+
+def test_cache_hit_rates_are_emitted_as_embedded_metrics():
+    lines = []
+    estimator = FareEstimator(report_every=2, write=lines.append)
+
+    estimator.estimate(PICKUP, DESTINATION, DEPARTURE)
+    estimator.estimate(PICKUP, DESTINATION, DEPARTURE)
+
+    (record,) = (json.loads(line) for line in lines)
+    declaration = record["_aws"]["CloudWatchMetrics"][0]
+    assert [metric["Name"] for metric in declaration["Metrics"]] == [
+        "quoteCacheHitRate",
+        "routeCacheHitRate",
+    ]
+    assert record["quoteCacheHitRate"] == 50.0
+    assert record["quoteLookups"] == 2
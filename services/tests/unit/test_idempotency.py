@@ -0,0 +1,229 @@
+import json
+import threading
+import uuid
+
+import pytest
+
+from common.cache import TTLCache
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from ride_request.app_old_v11 import (
+    IdempotentRideRequestHandler,
+    RequestValidator,
+    RideRequestDynamoDBStorage,
+    RideRequestHandler,
+    new_ride_id,
+)
+from ride_request.idempotency import (
+    IdempotencyRecordStorage,
+    fingerprint,
+    get_idempotency_key,
+)
+from tests.unit.fakes import FakeClock, ride_request_body
+
+NOW = 1_700_000_000.0
+
+
+class FlakyRideTableClient(InMemoryDynamoDBClient):
+    """Fails the next `failures` writes to the ride table."""
+
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def put_item(self, TableName, **kwargs):
+        self.__maybe_fail([TableName])
+        return super().put_item(TableName=TableName, **kwargs)
+
+    def transact_write_items(self, TransactItems):
+        self.__maybe_fail(
+            [
+                request["TableName"]
+                for entry in TransactItems
+                for request in entry.values()
+            ]
+        )
+        return super().transact_write_items(TransactItems=TransactItems)
+
+    def __maybe_fail(self, table_names):
+        if "RideRequests" in table_names and self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection reset")
+
+
+def ride_request_event(key="key-1", customer_id="customer-1"):
+    headers = {"Idempotency-Key": key} if key is not None else {}
+    return {"headers": headers, "body": json.dumps(ride_request_body(customer_id))}
+
+
+def create_handler(client, clock=None, cache=None):
+    handler = RideRequestHandler(RequestValidator(), RideRequestDynamoDBStorage(client))
+    storage = IdempotencyRecordStorage(client, clock=clock or FakeClock(NOW))
+    return IdempotentRideRequestHandler(handler, storage, cache)
+
+
+def test_replay_is_served_from_the_container_cache():
+    client = InMemoryDynamoDBClient()
+    handler = create_handler(client)
+
+    first = handler.handle(ride_request_event(), None)
+    calls_after_first = dict(client.call_counts)
+    second = handler.handle(ride_request_event(), None)
+
+    assert first.status_code == second.status_code == 200
+    assert second.data["rideId"] == first.data["rideId"]
+    assert client.call_counts == calls_after_first
+    assert client.item_count("RideRequests") == 1
+
+
+def test_replay_in_another_container_is_served_from_the_record():
+    client = InMemoryDynamoDBClient()
+
+    first = create_handler(client).handle(ride_request_event(), None)
+    second = create_handler(client).handle(ride_request_event(), None)
+
+    assert second.status_code == 200
+    assert second.data == first.data
+    assert client.item_count("RideRequests") == 1
+
+
+def test_key_reused_with_a_different_body_is_rejected():
+    client = InMemoryDynamoDBClient()
+    handler = create_handler(client)
+
+    handler.handle(ride_request_event(customer_id="a"), None)
+    cached = handler.handle(ride_request_event(customer_id="b"), None)
+    stored = create_handler(client).handle(ride_request_event(customer_id="b"), None)
+
+    assert cached.status_code == stored.status_code == 422
+    assert client.item_count("RideRequests") == 1
+
+
+def test_concurrent_duplicates_collapse_to_one_write():
+    client = InMemoryDynamoDBClient(latency=0.01)
+    handler = create_handler(client)
+    ride_ids = []
+
+    def worker():
+        ride_ids.append(handler.handle(ride_request_event(), None).data["rideId"])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(ride_ids)) == 1
+    assert client.item_count("RideRequests") == 1
+
+
+def test_failed_attempt_releases_the_key_for_a_retry():
+    client = FlakyRideTableClient(failures=1)
+    handler = create_handler(client)
+
+    failed = handler.handle(ride_request_event(), None)
+    # Neither the ride nor the response record was written
+    assert client.item_count("RideRequests") == 0
+    assert client.item_count("IdempotencyKeys") == 0
+    retried = handler.handle(ride_request_event(), None)
+
+    assert failed.status_code == 500
+    assert retried.status_code == 200
+    assert client.item_count("RideRequests") == 1
+
+
+def test_ride_and_response_record_are_written_together():
+    client = InMemoryDynamoDBClient()
+    clock = FakeClock(NOW)
+    records = IdempotencyRecordStorage(client, clock=clock)
+    rides = RideRequestDynamoDBStorage(client)
+    body = json.loads(ride_request_event()["body"])
+    request_fingerprint = fingerprint(body)
+
+    assert records.claim("key-1", request_fingerprint) is None
+    # A retry takes the claim over once its lock expires
+    clock.now += records.in_progress_timeout + 1
+    assert records.claim("key-1", request_fingerprint) is None
+    stored = [
+        rides.store(
+            body,
+            transact_items=[
+                records.completion("key-1", request_fingerprint, 200, "{}")
+            ],
+        )
+        for _ in range(2)
+    ]
+
+    assert [result.status_code for result in stored] == [201, 409]
+    assert client.item_count("RideRequests") == 1
+    assert records.claim("key-1", request_fingerprint).status == "COMPLETED"
+
+
+def test_claim_in_flight_elsewhere_conflicts_until_its_lock_expires():
+    client = InMemoryDynamoDBClient()
+    clock = FakeClock(NOW)
+    other_container = IdempotencyRecordStorage(client, clock=clock)
+    body = json.loads(ride_request_event()["body"])
+    assert other_container.claim("key-1", fingerprint(body)) is None
+
+    blocked = create_handler(client, clock).handle(ride_request_event(), None)
+    clock.now += other_container.in_progress_timeout + 1
+    taken_over = create_handler(client, clock).handle(ride_request_event(), None)
+
+    assert blocked.status_code == 409
+    assert taken_over.status_code == 200
+
+
+def test_requests_without_or_with_bad_keys():
+    client = InMemoryDynamoDBClient()
+    handler = create_handler(client)
+
+    assert handler.handle(ride_request_event(key=None), None).status_code == 200
+    assert handler.handle(ride_request_event(key=None), None).status_code == 200
+    assert handler.handle(ride_request_event(key="has space"), None).status_code == 400
+    assert client.item_count("RideRequests") == 2
+    assert client.item_count("IdempotencyKeys") == 0
+
+
+@pytest.mark.parametrize(
+    "name", ["Idempotency-Key", "idempotency-key", "IDEMPOTENCY-KEY"]
+)
+def test_idempotency_key_header_in_any_casing(name):
+    assert get_idempotency_key({"headers": {"Accept": "*/*", name: "k"}}) == "k"
+    assert get_idempotency_key({"headers": {"Accept": "*/*"}}) is None
+    assert get_idempotency_key({"headers": None}) is None
+
+
+def test_ride_ids_are_version_4_uuids():
+    ride_ids = {new_ride_id() for _ in range(100)}
+
+    assert len(ride_ids) == 100
+    for ride_id in ride_ids:
+        parsed = uuid.UUID(ride_id)
+        assert str(parsed) == ride_id
+        assert parsed.version == 4
+        assert parsed.variant == uuid.RFC_4122
+
+
+def test_invalid_bodies_never_claim_a_key():
+    client = InMemoryDynamoDBClient()
+    handler = create_handler(client)
+    event = {"headers": {"idempotency-key": "key-1"}, "body": json.dumps({})}
+
+    assert handler.handle(event, None).status_code == 400
+    assert client.item_count("IdempotencyKeys") == 0
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    clock = FakeClock(0)
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.get("c") is None
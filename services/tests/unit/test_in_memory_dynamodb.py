@@ -0,0 +1,245 @@
+import json
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from common.in_memory_dynamodb import InMemoryDynamoDBClient, TableSchema
+from ride_request.app_old_v11 import (
+    RequestValidator,
+    RideRequestDynamoDBStorage,
+    RideRequestHandler,
+)
+from tests.unit.fakes import ride_request_body
+
+TABLES = {
+    "RideRequests": TableSchema("rideId"),
+    "RideHistory": TableSchema(
+        "customerId", "requestedAt", indexes={"ByDriver": ("driverId", "requestedAt")}
+    ),
+}
+
+
+def history_item(customer_id, requested_at, driver_id="driver-1"):
+    return {
+        "customerId": {"S": customer_id},
+        "requestedAt": {"N": str(requested_at)},
+        "driverId": {"S": driver_id},
+    }
+
+
+def error_code(error):
+    return error.value.response["Error"]["Code"]
+
+
+def test_put_and_get_item_round_trip_copies():
+    client = InMemoryDynamoDBClient(TABLES)
+    item = {"rideId": {"S": "ride-1"}, "status": {"S": "requested"}}
+
+    client.put_item(TableName="RideRequests", Item=item)
+    item["status"]["S"] = "mutated"
+
+    stored = client.get_item(TableName="RideRequests", Key={"rideId": {"S": "ride-1"}})
+    assert stored["Item"]["status"] == {"S": "requested"}
+    assert client.get_item(TableName="RideRequests", Key={"rideId": {"S": "x"}}) == {}
+
+
+def test_conditional_put_rejects_existing_item():
+    client = InMemoryDynamoDBClient(TABLES)
+    item = {"rideId": {"S": "ride-1"}}
+    kwargs = dict(
+        TableName="RideRequests",
+        Item=item,
+        ConditionExpression="attribute_not_exists(#id)",
+        ExpressionAttributeNames={"#id": "rideId"},
+    )
+
+    client.put_item(**kwargs)
+    with pytest.raises(ClientError) as error:
+        client.put_item(**kwargs)
+
+    assert error_code(error) == "ConditionalCheckFailedException"
+
+
+def test_update_item_applies_set_with_version_condition():
+    client = InMemoryDynamoDBClient(TABLES)
+    client.put_item(
+        TableName="RideRequests",
+        Item={
+            "rideId": {"S": "ride-1"},
+            "status": {"S": "requested"},
+            "version": {"N": "1"},
+        },
+    )
+    update = dict(
+        TableName="RideRequests",
+        Key={"rideId": {"S": "ride-1"}},
+        UpdateExpression="SET #s = :s, version = version + :one",
+        ConditionExpression="#s = :expected AND version = :v",
+        ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={
+            ":s": {"S": "matched"},
+            ":expected": {"S": "requested"},
+            ":one": {"N": "1"},
+            ":v": {"N": "1"},
+        },
+        ReturnValues="ALL_NEW",
+    )
+
+    result = client.update_item(**update)
+    assert result["Attributes"]["status"] == {"S": "matched"}
+    assert result["Attributes"]["version"] == {"N": "2"}
+
+    with pytest.raises(ClientError) as error:
+        client.update_item(**update)
+    assert error_code(error) == "ConditionalCheckFailedException"
+
+
+def test_in_condition_matches_any_listed_value():
+    client = InMemoryDynamoDBClient(TABLES)
+    client.put_item(
+        TableName="RideRequests",
+        Item={"rideId": {"S": "ride-1"}, "status": {"S": "matched"}},
+    )
+    kwargs = dict(
+        TableName="RideRequests",
+        Key={"rideId": {"S": "ride-1"}},
+        UpdateExpression="SET #s = :to",
+        ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={
+            ":to": {"S": "arriving"},
+            ":a": {"S": "requested"},
+            ":b": {"S": "matched"},
+        },
+    )
+
+    with pytest.raises(ClientError) as error:
+        client.update_item(ConditionExpression="NOT #s IN (:a, :b)", **kwargs)
+    assert error_code(error) == "ConditionalCheckFailedException"
+
+    client.update_item(ConditionExpression="#s IN (:a, :b)", **kwargs)
+    with pytest.raises(ClientError):
+        client.update_item(ConditionExpression="#s IN (:a, :b)", **kwargs)
+
+
+def test_query_orders_by_sort_key_and_paginates():
+    client = InMemoryDynamoDBClient(TABLES)
+    for requested_at in (30, 10, 20, 40):
+        client.put_item(TableName="RideHistory", Item=history_item("c1", requested_at))
+    client.put_item(TableName="RideHistory", Item=history_item("c2", 15))
+
+    query = dict(
+        TableName="RideHistory",
+        KeyConditionExpression="customerId = :c AND requestedAt BETWEEN :lo AND :hi",
+        ExpressionAttributeValues={
+            ":c": {"S": "c1"},
+            ":lo": {"N": "10"},
+            ":hi": {"N": "30"},
+        },
+        ScanIndexForward=False,
+        Limit=2,
+    )
+
+    first = client.query(**query)
+    assert [item["requestedAt"]["N"] for item in first["Items"]] == ["30", "20"]
+
+    second = client.query(**query, ExclusiveStartKey=first["LastEvaluatedKey"])
+    assert [item["requestedAt"]["N"] for item in second["Items"]] == ["10"]
+    assert "LastEvaluatedKey" not in second
+
+
+def test_full_pages_carry_a_key_and_resume_after_deleted_items():
+    client = InMemoryDynamoDBClient(TABLES)
+    for requested_at in (10, 20, 30, 40):
+        client.put_item(TableName="RideHistory", Item=history_item("c1", requested_at))
+    query = dict(
+        TableName="RideHistory",
+        IndexName="ByDriver",
+        KeyConditionExpression="driverId = :d",
+        ExpressionAttributeValues={":d": {"S": "driver-1"}},
+        Limit=2,
+    )
+
+    first = client.query(**query)
+    client.delete_item(TableName="RideHistory", Key=history_item("c1", 20))
+    second = client.query(**query, ExclusiveStartKey=first["LastEvaluatedKey"])
+    last = client.query(**query, ExclusiveStartKey=second["LastEvaluatedKey"])
+
+    assert [item["requestedAt"]["N"] for item in second["Items"]] == ["30", "40"]
+    assert "LastEvaluatedKey" in second
+    assert last["Items"] == [] and "LastEvaluatedKey" not in last
+
+
+def test_query_on_secondary_index_tracks_overwrites():
+    client = InMemoryDynamoDBClient(TABLES)
+    client.put_item(TableName="RideHistory", Item=history_item("c1", 1, "d1"))
+    client.put_item(TableName="RideHistory", Item=history_item("c2", 2, "d1"))
+    # Reassigning the ride moves it to another driver's index partition
+    client.put_item(TableName="RideHistory", Item=history_item("c1", 1, "d2"))
+
+    result = client.query(
+        TableName="RideHistory",
+        IndexName="ByDriver",
+        KeyConditionExpression="driverId = :d",
+        ExpressionAttributeValues={":d": {"S": "d1"}},
+    )
+
+    assert [item["customerId"]["S"] for item in result["Items"]] == ["c2"]
+
+
+def test_unknown_table_raises_resource_not_found():
+    client = InMemoryDynamoDBClient(TABLES)
+
+    with pytest.raises(ClientError) as error:
+        client.get_item(TableName="Missing", Key={"id": {"S": "1"}})
+
+    assert error_code(error) == "ResourceNotFoundException"
+
+
+def test_throttling_and_latency_injection():
+    delays = []
+    client = InMemoryDynamoDBClient(
+        TABLES, latency=0.01, throttle_rate=1.0, sleep=delays.append
+    )
+
+    with pytest.raises(ClientError) as error:
+        client.put_item(TableName="RideRequests", Item={"rideId": {"S": "1"}})
+
+    assert error_code(error) == "ProvisionedThroughputExceededException"
+    assert delays == [0.01]
+
+    requests = [{"PutRequest": {"Item": {"rideId": {"S": str(i)}}}} for i in range(3)]
+    result = client.batch_write_item(RequestItems={"RideRequests": requests})
+    assert result["UnprocessedItems"] == {"RideRequests": requests}
+
+
+def test_storage_batch_writes_retry_throttled_items():
+    client = InMemoryDynamoDBClient(TABLES, throttle_rate=0.3, seed=7)
+    storage = RideRequestDynamoDBStorage(
+        client, max_batch_retries=20, sleep=lambda delay: None
+    )
+
+    results = storage.store_many([ride_request_body(str(i)) for i in range(60)])
+
+    assert all(result.status_code == 201 for result in results)
+    assert client.item_count("RideRequests") == 60
+
+
+def test_handler_stores_ride_requests_from_concurrent_threads():
+    client = InMemoryDynamoDBClient(TABLES)
+    handler = RideRequestHandler(RequestValidator(), RideRequestDynamoDBStorage(client))
+    statuses = []
+
+    def worker(worker_id):
+        for i in range(50):
+            event = {"body": json.dumps(ride_request_body(f"c{worker_id}-{i}"))}
+            statuses.append(handler.handle(event, None).status_code)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 400
+    assert client.item_count("RideRequests") == 400
@@ -0,0 +1,124 @@
+from decimal import Decimal
+
+import pytest
+
+from common.item_schema import (
+    DRIVER_ITEM,
+    RIDE_REQUEST_ITEM,
+    RIDE_STATUS_ITEM,
+    build_ride_request_item,
+    format_number,
+)
+
+
+def ride_request():
+    return {
+        "customerId": "customer-1",
+        "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+        "destinationLocation": {"latitude": 51.47, "longitude": -1},
+    }
+
+
+def test_marshal_matches_handwritten_layout():
+    item = build_ride_request_item(ride_request(), "ride-1", "requested", "t")
+
+    assert item == {
+        "rideId": {"S": "ride-1"},
+        "customerId": {"S": "customer-1"},
+        "pickupLocation": {
+            "M": {"latitude": {"N": "51.5074"}, "longitude": {"N": "-0.1278"}}
+        },
+        "destinationLocation": {
+            "M": {"latitude": {"N": "51.47"}, "longitude": {"N": "-1"}}
+        },
+        "status": {"S": "requested"},
+        "timestamp": {"S": "t"},
+    }
+
+
+def test_handwritten_builder_matches_the_schema():
+    data = {**ride_request(), "rideId": "ride-1", "status": "requested"}
+    data["pickupLocation"] = {"latitude": 0.1 + 0.2, "longitude": 12}
+
+    assert build_ride_request_item(data, "ride-1", "requested", "t") == (
+        RIDE_REQUEST_ITEM.marshal({**data, "timestamp": "t"})
+    )
+
+
+def test_round_trip():
+    data = {**ride_request(), "rideId": "ride-1", "status": "requested"}
+
+    assert RIDE_REQUEST_ITEM.unmarshal(RIDE_REQUEST_ITEM.marshal(data)) == data
+
+
+def test_empty_attributes_are_skipped():
+    item = DRIVER_ITEM.marshal(
+        {"driverId": "driver-1", "status": "", "location": {}, "lastSeen": None}
+    )
+
+    assert item == {"driverId": {"S": "driver-1"}}
+
+
+def test_missing_required_attributes_raise_key_error():
+    with pytest.raises(KeyError, match="rideId"):
+        RIDE_STATUS_ITEM.marshal({"status": "accepted", "reportedAt": 1})
+
+    with pytest.raises(KeyError, match="pickupLocation.latitude"):
+        RIDE_REQUEST_ITEM.marshal(
+            {**ride_request(), "rideId": "r", "pickupLocation": {"longitude": 1.0}}
+        )
+
+
+@pytest.mark.parametrize("value", [42, b"driver-1", ["driver-1"], False])
+def test_strings_of_other_types_raise_type_error(value):
+    with pytest.raises(TypeError, match="driverId"):
+        RIDE_STATUS_ITEM.marshal(
+            {
+                "rideId": "ride-1",
+                "status": "accepted",
+                "reportedAt": 1,
+                "driverId": value,
+            }
+        )
+
+    with pytest.raises(TypeError, match="status"):
+        DRIVER_ITEM.marshal({"driverId": "driver-1", "status": value})
+
+
+def test_unmarshal_ignores_attributes_outside_the_schema():
+    item = RIDE_STATUS_ITEM.marshal(
+        {"rideId": "ride-1", "status": "accepted", "reportedAt": 1}
+    )
+    item["version"] = {"N": "3"}
+
+    assert RIDE_STATUS_ITEM.unmarshal(item) == {
+        "rideId": "ride-1",
+        "status": "accepted",
+        "reportedAt": 1,
+    }
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [(0.1, "0.1"), (1e-07, "1e-07"), (12, "12"), (Decimal("1.50"), "1.50")],
+)
+def test_format_number_keeps_full_precision(value, expected):
+    assert format_number(value) == expected
+    assert float(format_number(value)) == float(value)
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), True, "1"])
+def test_format_number_rejects_invalid_values(value):
+    with pytest.raises((TypeError, ValueError)):
+        format_number(value)
+
+
+def test_driver_item_round_trip():
+    data = {
+        "driverId": "driver-1",
+        "available": False,
+        "location": {"latitude": 51.5, "longitude": -0.12},
+        "lastSeen": 1725105600123,
+    }
+
+    assert DRIVER_ITEM.unmarshal(DRIVER_ITEM.marshal(data)) == data
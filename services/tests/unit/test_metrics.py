@@ -0,0 +1,107 @@
+import json
+
+from common.resources import ResourceRegistry
+from ride_request import app_old_v11
+from ride_request.app_old_v11 import (
+    RequestValidator,
+    RideRequestDynamoDBStorage,
+    RideRequestHandler,
+)
+from ride_request.metrics import NULL_TIMER, StageMetrics
+from tests.unit.fakes import FakeClock, FakeDynamoDBClient, ride_request_event
+
+STAGES = ["parse", "validate", "surge", "build_item", "put_item", "response"]
+
+
+class BrokenValidator(RequestValidator):
+    def validate(self, body):
+        raise KeyError("schema")
+
+
+def create_handler(lines, client=None, validator=None):
+    metrics = StageMetrics(write=lines.append, clock=FakeClock(step=0.001))
+    return RideRequestHandler(
+        validator or RequestValidator(),
+        RideRequestDynamoDBStorage(client or FakeDynamoDBClient()),
+        stage_metrics=metrics,
+    )
+
+
+def test_each_invocation_emits_one_embedded_metric_record():
+    lines = []
+    handler = create_handler(lines)
+
+    handler.handle(ride_request_event(), None)
+    handler.handle(ride_request_event(), None)
+
+    first, second = (json.loads(line) for line in lines)
+    declaration = first["_aws"]["CloudWatchMetrics"][0]
+    assert declaration["Dimensions"] == [["Service", "Start"]]
+    assert [metric["Name"] for metric in declaration["Metrics"]] == STAGES + ["total"]
+    assert isinstance(first["_aws"]["Timestamp"], int)
+    assert [first["Start"], second["Start"]] == ["cold", "warm"]
+    assert first["statusCode"] == 200
+    assert [first[stage] for stage in STAGES] == [1.0] * len(STAGES)
+    # The total also covers the reading taken before the first stage
+    assert first["total"] == len(STAGES) + 1
+    assert "failedStage" not in first and "errorType" not in first
+
+
+def test_server_errors_name_the_stage_and_exception():
+    lines = []
+    storage_down = create_handler(lines, client=FakeDynamoDBClient(fail=True))
+    broken = create_handler(lines, validator=BrokenValidator())
+
+    storage_down.handle(ride_request_event(), None)
+    broken.handle(ride_request_event(), None)
+    invalid = create_handler(lines).handle({"body": "{"}, None)
+
+    put_failed, raised, bad_json = (json.loads(line) for line in lines)
+    assert put_failed["statusCode"] == 500
+    assert put_failed["failedStage"] == "put_item"
+    assert "errorType" not in put_failed
+    assert raised["failedStage"] == "validate"
+    assert raised["errorType"] == "KeyError"
+    assert invalid.status_code == bad_json["statusCode"] == 400
+    assert "failedStage" not in bad_json
+
+
+def test_metrics_are_off_unless_enabled(monkeypatch):
+    lines = []
+    monkeypatch.delenv("RIDE_REQUEST_STAGE_METRICS", raising=False)
+    metrics = StageMetrics.from_environment()
+    metrics.write = lines.append
+    handler = RideRequestHandler(
+        RequestValidator(),
+        RideRequestDynamoDBStorage(FakeDynamoDBClient()),
+        stage_metrics=metrics,
+    )
+
+    result = handler.handle(ride_request_event(), None)
+
+    assert result.status_code == 200
+    assert metrics.start() is NULL_TIMER
+    assert lines == []
+
+
+def test_containers_start_cold_once_despite_client_errors(monkeypatch, capsys):
+    clients = []
+    monkeypatch.setenv("RIDE_REQUEST_STAGE_METRICS", "on")
+
+    def create_client():
+        clients.append(FakeDynamoDBClient(fail=not clients))
+        return clients[-1]
+
+    monkeypatch.setattr(app_old_v11, "create_dynamodb_client", create_client)
+    monkeypatch.setattr(
+        app_old_v11, "resources", app_old_v11.register_resources(ResourceRegistry())
+    )
+
+    failed = app_old_v11.wrapped_lambda_handler(ride_request_event(), None)
+    recovered = app_old_v11.wrapped_lambda_handler(ride_request_event(), None)
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [failed["statusCode"], recovered["statusCode"]] == [500, 200]
+    assert len(clients) == 2
+    assert [record["Start"] for record in records] == ["cold", "warm"]
+    assert [record["statusCode"] for record in records] == [500, 200]
@@ -0,0 +1,121 @@
+import json
+import pstats
+from types import SimpleNamespace
+
+import pytest
+
+from common.resources import ResourceRegistry
+from ride_request import app_old_v11
+from ride_request.profiling import (
+    CPROFILE,
+    LOG_PREFIX,
+    TRACEMALLOC,
+    InvocationProfiler,
+    format_folded,
+    merge_profiles,
+    parse_folded,
+)
+
+CONTEXT = SimpleNamespace(aws_request_id="request-1")
+
+
+def fibonacci(n):
+    return n if n < 2 else fibonacci(n - 1) + fibonacci(n - 2)
+
+
+def slow_handler(event, context):
+    fibonacci(18)
+    return {"statusCode": 200}
+
+
+def allocating_handler(event, context):
+    allocating_handler.retained = [bytearray(100_000)]
+    return {"statusCode": 200}
+
+
+def test_only_sampled_or_token_bearing_invocations_are_profiled():
+    draws = iter([0.05, 0.5])
+    profiler = InvocationProfiler(
+        CPROFILE, sample_rate=0.1, token="secret", random=lambda: next(draws)
+    )
+    with_token = {"headers": {"X-Profile-Token": "secret"}}
+    wrong_token = {"headers": {"x-profile-token": "guess"}}
+
+    assert profiler.should_profile({})
+    assert not profiler.should_profile(wrong_token)
+    assert profiler.should_profile(with_token)
+    assert not InvocationProfiler(token="secret").should_profile(with_token)
+    assert not InvocationProfiler(CPROFILE).should_profile(with_token)
+    with pytest.raises(ValueError):
+        InvocationProfiler("perf")
+
+
+def test_cprofile_profiles_are_written_to_the_directory(tmp_path):
+    profiler = InvocationProfiler(CPROFILE, sample_rate=1.0, output_dir=tmp_path)
+
+    result = profiler.run(slow_handler, {}, CONTEXT)
+
+    (path,) = tmp_path.iterdir()
+    assert result == {"statusCode": 200}
+    assert path.name.endswith("-request-1.prof")
+    functions = {name for _, _, name in pstats.Stats(str(path)).stats}
+    assert {"slow_handler", "fibonacci"} <= functions
+
+
+def test_merged_profiles_fold_into_flame_graph_stacks(tmp_path):
+    lines = []
+    to_directory = InvocationProfiler(CPROFILE, sample_rate=1.0, output_dir=tmp_path)
+    to_log = InvocationProfiler(CPROFILE, sample_rate=1.0, write=lines.append)
+    to_directory.run(slow_handler, {}, CONTEXT)
+    to_log.run(slow_handler, {}, None)
+    log = tmp_path / "lambda.log"
+    log.write_text("START RequestId: request-2\n" + "\n".join(lines) + "\n")
+
+    stacks = merge_profiles([*tmp_path.glob("*.prof"), log], min_microseconds=0)
+    apart = [
+        merge_profiles(paths, min_microseconds=0)
+        for paths in (tmp_path.glob("*.prof"), [log])
+    ]
+
+    assert lines[0].startswith(LOG_PREFIX)
+    path = next(stack for stack in stacks if stack.endswith("slow_handler"))
+    assert path.endswith("test_profiling.py:slow_handler")
+    assert any(stack.startswith(f"{path};") for stack in stacks)
+    # Both invocations, give or take rounding
+    expected = sum(sum(profile.values()) for profile in apart)
+    assert abs(sum(stacks.values()) - expected) <= len(stacks)
+    assert parse_folded(format_folded(stacks)) == stacks
+
+
+def test_tracemalloc_logs_what_the_invocation_left_allocated(tmp_path):
+    lines = []
+    profiler = InvocationProfiler(TRACEMALLOC, sample_rate=1.0, write=lines.append)
+
+    profiler.run(allocating_handler, {}, CONTEXT)
+    log = tmp_path / "lambda.log"
+    log.write_text("\n".join(lines))
+
+    record = json.loads(lines[0][len(LOG_PREFIX) :])
+    stacks = merge_profiles([log], TRACEMALLOC)
+    largest = max(stacks, key=stacks.get)
+    assert record["requestId"] == "request-1"
+    assert record["peakBytes"] >= 100_000
+    assert stacks[largest] >= 100_000
+    assert "test_profiling.py" in largest.rsplit(";", 1)[-1]
+
+
+def test_wrapped_lambda_handler_profiles_on_request(monkeypatch, tmp_path):
+    monkeypatch.setenv("RIDE_REQUEST_PROFILE", CPROFILE)
+    monkeypatch.setenv("RIDE_REQUEST_PROFILE_TOKEN", "secret")
+    monkeypatch.setenv("RIDE_REQUEST_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        app_old_v11, "resources", app_old_v11.register_resources(ResourceRegistry())
+    )
+
+    app_old_v11.wrapped_lambda_handler({"body": "{", "headers": {}}, CONTEXT)
+    response = app_old_v11.wrapped_lambda_handler(
+        {"body": "{", "headers": {"X-Profile-Token": "secret"}}, CONTEXT
+    )
+
+    assert response["statusCode"] == 400
+    assert [path.suffix for path in tmp_path.iterdir()] == [".prof"]
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from common.resources import ResourceRegistry
+from ride_request import app_old_v11
+from tests.unit.fakes import FakeDynamoDBClient, ride_request_event
+
+
+@pytest.fixture()
+def resources(monkeypatch):
+    clients = []
+
+    def create_client():
+        client = FakeDynamoDBClient()
+        clients.append(client)
+        return client
+
+    monkeypatch.setattr(app_old_v11, "create_dynamodb_client", create_client)
+    registry = app_old_v11.register_resources(ResourceRegistry())
+    monkeypatch.setattr(app_old_v11, "resources", registry)
+    return registry, clients
+
+
+def test_registry_builds_each_resource_once():
+    registry = ResourceRegistry()
+    calls = []
+    registry.register("client", lambda r: calls.append("client") or object())
+
+    assert registry.get("client") is registry.get("client")
+    assert calls == ["client"]
+
+
+def test_registry_invalidate_cascades_to_dependents():
+    registry = ResourceRegistry()
+    registry.register("client", lambda r: object())
+    registry.register("storage", lambda r: ("storage", r.get("client")))
+    registry.register("other", lambda r: object())
+
+    storage = registry.get("storage")
+    other = registry.get("other")
+    registry.invalidate("client")
+
+    assert not registry.is_built("storage")
+    assert registry.get("storage") is not storage
+    assert registry.get("other") is other
+
+
+def test_registry_unknown_resource():
+    with pytest.raises(KeyError):
+        ResourceRegistry().get("missing")
+
+
+def test_wrapped_lambda_handler_reuses_handler_graph(resources):
+    registry, clients = resources
+    event = ride_request_event()
+
+    first = app_old_v11.wrapped_lambda_handler(event, None)
+    second = app_old_v11.wrapped_lambda_handler(event, None)
+
+    assert first["statusCode"] == 200
+    assert second["statusCode"] == 200
+    assert len(clients) == 1
+    assert len(clients[0].items) == 2
+
+    ride_ids = [json.loads(r["body"])["rideId"] for r in (first, second)]
+    stored_ids = [item["rideId"]["S"] for _, item in clients[0].items]
+    assert ride_ids == stored_ids
+    assert ride_ids[0] != ride_ids[1]
+
+
+def test_wrapped_lambda_handler_recreates_client_after_error(resources):
+    registry, clients = resources
+    event = ride_request_event()
+
+    app_old_v11.wrapped_lambda_handler(event, None)
+    clients[0].fail = True
+    failed = app_old_v11.wrapped_lambda_handler(event, None)
+    recovered = app_old_v11.wrapped_lambda_handler(event, None)
+
+    assert failed["statusCode"] == 500
+    assert recovered["statusCode"] == 200
+    assert len(clients) == 2
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+
+from common.cache import TTLCache
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from ride_request.app_old_v11 import RideHistoryHandler, RideRequestDynamoDBStorage
+from ride_request.sharding import ScatterGatherReader, ShardedIndex
+from tests.unit.fakes import ride_request_body
+
+CUSTOMER_RIDES = ShardedIndex("CustomerRides", "customerId", "timestamp", 4)
+
+
+def create_handler(client):
+    reader = ScatterGatherReader(client, "RideRequests", CUSTOMER_RIDES)
+    return RideHistoryHandler(reader, TTLCache(maxsize=16, ttl=60))
+
+
+def history_event(customer_id="customer-1", **parameters):
+    return {
+        "pathParameters": {"customerId": customer_id},
+        "queryStringParameters": parameters or None,
+    }
+
+
+def read_all_pages(handler, limit):
+    pages = []
+    cursor = None
+    while True:
+        parameters = {"limit": str(limit)}
+        if cursor is not None:
+            parameters["cursor"] = cursor
+        result = handler.handle(history_event(**parameters), None)
+        assert result.status_code == 200
+        pages.append([ride["rideId"] for ride in result.data["rides"]])
+        cursor = result.data["nextCursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_walk_the_history_newest_first():
+    client = InMemoryDynamoDBClient()
+    storage = RideRequestDynamoDBStorage(client, indexes=(CUSTOMER_RIDES,))
+    started_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    ride_ids = [
+        storage.store(ride_request_body(), started_at + timedelta(minutes=n)).data[
+            "rideId"
+        ]
+        for n in range(45)
+    ]
+    storage.store(ride_request_body("customer-2"))
+
+    pages = read_all_pages(create_handler(client), limit=20)
+
+    assert [len(page) for page in pages] == [20, 20, 5]
+    assert sum(pages, []) == ride_ids[::-1]
+
+
+def test_rides_sharing_a_timestamp_are_paged_without_gaps_or_repeats():
+    client = InMemoryDynamoDBClient()
+    storage = RideRequestDynamoDBStorage(client, indexes=(CUSTOMER_RIDES,))
+    # store_many stamps a whole batch with one timestamp
+    results = storage.store_many([ride_request_body()] * 23)
+
+    pages = read_all_pages(create_handler(client), limit=5)
+
+    assert sorted(sum(pages, [])) == sorted(result.data["rideId"] for result in results)
+    assert len(pages) == 5
+
+
+def test_first_page_is_cached_and_projected():
+    client = InMemoryDynamoDBClient()
+    RideRequestDynamoDBStorage(client, indexes=(CUSTOMER_RIDES,)).store(
+        ride_request_body()
+    )
+    handler = create_handler(client)
+
+    first = handler.handle(history_event(), None)
+    queries = client.call_counts["Query"]
+    cached = handler.handle(history_event(), None)
+
+    assert cached.data is first.data
+    assert client.call_counts["Query"] == queries
+    (ride,) = first.data["rides"]
+    assert set(ride) == {
+        "rideId",
+        "status",
+        "timestamp",
+        "pickupLocation",
+        "destinationLocation",
+    }
+    assert first.data["nextCursor"] is None
+
+
+def test_bad_parameters_are_rejected():
+    handler = create_handler(InMemoryDynamoDBClient())
+
+    results = [
+        handler.handle(history_event(customer_id="bad id"), None),
+        handler.handle(history_event(limit="0"), None),
+        handler.handle(history_event(limit="101"), None),
+        handler.handle(history_event(limit="ten"), None),
+        # A digit to str.isdigit() but not a number to int()
+        handler.handle(history_event(limit="\u00b2"), None),
+        handler.handle(history_event(cursor="not-a-cursor"), None),
+        handler.handle(history_event(cursor="W251bGxd"), None),
+    ]
+
+    assert [result.status_code for result in results] == [400] * 7
@@ -0,0 +1,180 @@
+import json
+import threading
+
+import pytest
+
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from ride_request.app_old_v11 import (
+    RideMatchBatchHandler,
+    RideRequestDynamoDBStorage,
+    RideTransitionHandler,
+)
+from ride_request.ride_lifecycle import (
+    InvalidTransition,
+    RideLifecycle,
+    RideNotFound,
+    Transitioned,
+    VersionConflict,
+)
+
+
+def create_ride(client):
+    body = {
+        "customerId": "customer-1",
+        "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+        "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+    }
+    result = RideRequestDynamoDBStorage(client).store(body)
+    client.call_counts.clear()
+    return result.data["rideId"]
+
+
+def stored_ride(client, ride_id):
+    return client.get_item(TableName="RideRequests", Key={"rideId": {"S": ride_id}})[
+        "Item"
+    ]
+
+
+def transition_event(ride_id, action, body=None):
+    return {
+        "pathParameters": {"rideId": ride_id, "action": action},
+        "body": json.dumps(body) if body is not None else None,
+    }
+
+
+def test_a_ride_goes_through_its_lifecycle_one_update_per_step():
+    client = InMemoryDynamoDBClient()
+    lifecycle = RideLifecycle(client, clock=lambda: 1_700_000_000.0)
+    ride_id = create_ride(client)
+
+    results = [
+        lifecycle.accept(ride_id, "driver-1"),
+        lifecycle.transition(ride_id, "arrive"),
+        lifecycle.transition(ride_id, "start"),
+        lifecycle.complete(ride_id),
+    ]
+
+    assert [type(result) for result in results] == [Transitioned] * 4
+    assert [result.status for result in results] == [
+        "matched",
+        "arriving",
+        "in_progress",
+        "completed",
+    ]
+    assert [result.version for result in results] == [1, 2, 3, 4]
+    assert client.call_counts == {"UpdateItem": 4}
+
+    item = stored_ride(client, ride_id)
+    assert item["driverId"] == {"S": "driver-1"}
+    assert item["updatedAt"] == {"N": "1700000000000"}
+
+
+def test_failures_report_the_current_state_without_another_read():
+    client = InMemoryDynamoDBClient()
+    lifecycle = RideLifecycle(client)
+    ride_id = create_ride(client)
+    lifecycle.accept(ride_id, "driver-1")
+
+    invalid = lifecycle.accept(ride_id, "driver-2")
+    stale = lifecycle.cancel(ride_id, expected_version=0)
+    missing = lifecycle.cancel("no-such-ride")
+
+    assert isinstance(invalid, InvalidTransition)
+    assert (invalid.status, invalid.version) == ("matched", 1)
+    assert isinstance(stale, VersionConflict)
+    assert (stale.status, stale.version) == ("matched", 1)
+    assert isinstance(missing, RideNotFound)
+    assert client.call_counts == {"UpdateItem": 4}
+    assert stored_ride(client, ride_id)["driverId"] == {"S": "driver-1"}
+
+
+def test_accept_and_cancel_race_has_exactly_one_winner():
+    client = InMemoryDynamoDBClient(latency=0.005)
+    lifecycle = RideLifecycle(client)
+    ride_id = create_ride(client)
+    barrier = threading.Barrier(9)
+    results = []
+
+    def attempt(action):
+        barrier.wait()
+        results.append(action())
+
+    # Everyone acts on the version 0 they read; without expected_version a
+    # cancel after an accept would rightly succeed too
+    actions = [lambda: lifecycle.cancel(ride_id, expected_version=0)]
+    actions += [
+        lambda driver=f"driver-{index}": lifecycle.accept(ride_id, driver, 0)
+        for index in range(8)
+    ]
+    threads = [threading.Thread(target=attempt, args=(action,)) for action in actions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [result for result in results if result.is_success]
+    assert len(winners) == 1
+    assert client.call_counts == {"UpdateItem": 9}
+    assert stored_ride(client, ride_id)["status"]["S"] == winners[0].status
+    assert stored_ride(client, ride_id)["version"] == {"N": "1"}
+
+
+def test_unknown_actions_are_rejected():
+    with pytest.raises(ValueError):
+        RideLifecycle(InMemoryDynamoDBClient()).transition("ride-1", "teleport")
+
+
+def test_transition_handler_maps_results_to_status_codes():
+    client = InMemoryDynamoDBClient()
+    handler = RideTransitionHandler(RideLifecycle(client))
+    ride_id = create_ride(client)
+
+    accepted = handler.handle(
+        transition_event(ride_id, "accept", {"driverId": "driver-1"}), None
+    )
+    assert accepted.status_code == 200
+    assert accepted.data == {"rideId": ride_id, "status": "matched", "version": 1}
+
+    codes = [
+        handler.handle(transition_event(ride_id, "accept", {}), None),
+        handler.handle(transition_event(ride_id, "start"), None),
+        handler.handle(
+            transition_event(ride_id, "cancel", {"expectedVersion": 0}), None
+        ),
+        handler.handle(
+            transition_event(ride_id, "cancel", {"expectedVersion": "1"}), None
+        ),
+        handler.handle(transition_event("no-such-ride", "cancel"), None),
+        handler.handle(transition_event(ride_id, "teleport"), None),
+        handler.handle(
+            transition_event(ride_id, "cancel", {"expectedVersion": 1}), None
+        ),
+    ]
+    assert [result.status_code for result in codes] == [
+        400,
+        409,
+        409,
+        400,
+        404,
+        404,
+        200,
+    ]
+
+
+def test_published_matches_are_accepted_once():
+    client = InMemoryDynamoDBClient()
+    handler = RideMatchBatchHandler(RideLifecycle(client))
+    ride_id = create_ride(client)
+    match = {"rideId": ride_id, "driverId": "driver-1", "distanceKm": 0.2}
+    records = [
+        {"messageId": "m-1", "body": json.dumps(match)},
+        # Redelivered, or matched again by another container
+        {"messageId": "m-2", "body": json.dumps({**match, "driverId": "driver-2"})},
+        {"messageId": "m-3", "body": "{}"},
+    ]
+
+    response = handler.handle({"Records": records}, None)
+
+    assert response == {"batchItemFailures": []}
+    assert stored_ride(client, ride_id)["driverId"] == {"S": "driver-1"}
+    assert stored_ride(client, ride_id)["status"] == {"S": "matched"}
@@ -0,0 +1,54 @@
+import importlib
+import json
+import sys
+
+from ride_request import serialization
+from ride_request.app_old_v11 import (
+    BadRequestResponse,
+    CreatedResponse,
+    SuccessResponse,
+    format_lambda_response,
+)
+
+
+def test_success_and_error_responses():
+    success = SuccessResponse({"rideId": "ride-1"}).to_dict()
+    error = BadRequestResponse("Invalid JSON in request body").to_dict()
+
+    assert success["statusCode"] == 200
+    assert json.loads(success["body"]) == {"rideId": "ride-1"}
+    assert error["statusCode"] == 400
+    assert json.loads(error["body"]) == {"message": "Invalid JSON in request body"}
+    assert success["headers"] is error["headers"] is serialization.JSON_HEADERS
+
+
+def test_format_lambda_response_matches_to_dict():
+    result = CreatedResponse({"rideId": "ride-1"})
+
+    assert format_lambda_response(result) == result.to_dict()
+
+
+def test_error_bodies_are_encoded_once():
+    first = BadRequestResponse("Missing required fields: customerId").to_dict()
+    second = BadRequestResponse("Missing required fields: customerId").to_dict()
+
+    assert first["body"] is second["body"]
+
+
+def test_responses_use_slots():
+    response = SuccessResponse()
+
+    assert not hasattr(response, "__dict__")
+    assert response.is_success
+
+
+def test_stdlib_fallback(monkeypatch):
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    fallback = importlib.reload(serialization)
+
+    try:
+        assert fallback.orjson is None
+        assert fallback.dumps({"a": [1, 2.5, "x"]}) == '{"a":[1,2.5,"x"]}'
+    finally:
+        monkeypatch.undo()
+        importlib.reload(serialization)
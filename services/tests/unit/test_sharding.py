@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from ride_request.app_old_v11 import RideRequestDynamoDBStorage
+from ride_request.ride_lifecycle import RideLifecycle
+from ride_request.sharding import ScatterGatherReader, ShardedIndex
+
+CUSTOMER_RIDES = ShardedIndex("CustomerRides", "customerId", "timestamp", 4)
+RIDES_BY_STATUS = ShardedIndex("RidesByStatus", "status", "timestamp", 8)
+INDEXES = (CUSTOMER_RIDES, RIDES_BY_STATUS)
+
+
+def store_rides(client, count, customer_id="customer-1"):
+    storage = RideRequestDynamoDBStorage(client, indexes=INDEXES)
+    started_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    body = {
+        "customerId": customer_id,
+        "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+        "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+    }
+    return [
+        storage.store(body, started_at + timedelta(minutes=minute)).data["rideId"]
+        for minute in range(count)
+    ]
+
+
+def test_shard_keys_are_stable_and_cover_every_shard():
+    index = ShardedIndex("RidesByStatus", "status", "timestamp", 8)
+
+    shards = {index.shard_key("requested", f"ride-{n}") for n in range(200)}
+
+    assert shards == set(index.shard_keys("requested"))
+    assert index.shard_key("requested", "ride-1") == "requested#7"
+    with pytest.raises(ValueError):
+        ShardedIndex("RidesByStatus", "status", "timestamp", 0)
+
+
+def test_scatter_gather_merges_shards_newest_first():
+    client = InMemoryDynamoDBClient()
+    ride_ids = store_rides(client, 30)
+    store_rides(client, 5, customer_id="customer-2")
+    reader = ScatterGatherReader(client, "RideRequests", CUSTOMER_RIDES)
+
+    newest = reader.query("customer-1", limit=10)
+    oldest = reader.query("customer-1", limit=3, newest_first=False)
+    everything = reader.query("customer-1")
+
+    assert [item["rideId"]["S"] for item in newest] == ride_ids[::-1][:10]
+    assert [item["rideId"]["S"] for item in oldest] == ride_ids[:3]
+    assert len(everything) == 30
+    assert client.call_counts["Query"] == 3 * CUSTOMER_RIDES.shard_count
+
+
+def test_transitions_move_rides_between_status_shards():
+    client = InMemoryDynamoDBClient()
+    ride_ids = store_rides(client, 6)
+    lifecycle = RideLifecycle(client, indexes=INDEXES)
+    reader = ScatterGatherReader(client, "RideRequests", RIDES_BY_STATUS)
+
+    for ride_id in ride_ids[:2]:
+        lifecycle.accept(ride_id, "driver-1")
+
+    requested = [item["rideId"]["S"] for item in reader.query("requested")]
+    matched = [item["rideId"]["S"] for item in reader.query("matched")]
+    assert sorted(requested) == sorted(ride_ids[2:])
+    assert sorted(matched) == sorted(ride_ids[:2])
@@ -0,0 +1,97 @@
+import json
+import random
+
+import pytest
+
+from ride_match import app
+from ride_match.app import RideMatcher
+from ride_match.spatial_index import DriverGridIndex, brute_force_nearest
+
+
+def random_drivers(count, seed=7):
+    rng = random.Random(seed)
+    return {
+        f"driver-{i}": (rng.uniform(51.3, 51.7), rng.uniform(-0.5, 0.3))
+        for i in range(count)
+    }
+
+
+def build_index(drivers):
+    index = DriverGridIndex()
+    for driver_id, (latitude, longitude) in drivers.items():
+        index.insert(driver_id, latitude, longitude)
+    return index
+
+
+@pytest.mark.parametrize("k", [1, 5, 20])
+def test_nearest_matches_brute_force(k):
+    drivers = random_drivers(2000)
+    index = build_index(drivers)
+    rng = random.Random(11)
+
+    for _ in range(50):
+        latitude, longitude = rng.uniform(51.2, 51.8), rng.uniform(-0.6, 0.4)
+        expected = brute_force_nearest(drivers, latitude, longitude, k)
+        actual = index.nearest(latitude, longitude, k)
+        assert [driver_id for _, driver_id in actual] == [
+            driver_id for _, driver_id in expected
+        ]
+
+
+def test_move_and_remove_keep_cells_consistent():
+    index = DriverGridIndex()
+    index.insert("driver-1", 51.50, -0.12)
+    index.move("driver-1", 51.60, -0.20)
+
+    assert index.location_of("driver-1") == (51.60, -0.20)
+    assert len(index.cells) == 1
+    assert index.nearest(51.60, -0.20)[0][1] == "driver-1"
+
+    assert index.remove("driver-1")
+    assert not index.remove("driver-1")
+    assert index.cells == {}
+    assert index.nearest(51.60, -0.20) == []
+
+
+def test_moves_keep_the_status_and_last_seen_unless_given():
+    index = DriverGridIndex()
+    index.insert("driver-1", 51.50, -0.12, last_seen=1000)
+    index.registry.set_status("driver-1", "on_trip")
+
+    index.move("driver-1", 51.60, -0.20)
+    record = index.registry.get("driver-1")
+
+    assert (record.status, record.last_seen) == ("on_trip", 1000)
+
+    index.move("driver-1", 51.61, -0.21, status="available", last_seen=2000)
+
+    assert (record.status, record.last_seen) == ("available", 2000)
+    assert index.location_of("driver-1") == (51.61, -0.21)
+
+
+def test_nearest_respects_max_radius():
+    index = DriverGridIndex()
+    index.insert("far", 52.5, -0.12)
+
+    assert index.nearest(51.5, -0.12, max_radius_km=10) == []
+
+
+def test_lambda_handler_assigns_nearest_driver(monkeypatch):
+    matcher = RideMatcher(DriverGridIndex())
+    matcher.update_driver_location("near", 51.5075, -0.1279)
+    matcher.update_driver_location("far", 51.55, -0.2)
+    monkeypatch.setattr(app, "ride_matcher", matcher)
+    event = {
+        "body": json.dumps(
+            {"pickupLocation": {"latitude": 51.5074, "longitude": -0.1278}}
+        )
+    }
+
+    first = app.lambda_handler(event, None)
+    second = app.lambda_handler(event, None)
+    third = app.lambda_handler(event, None)
+
+    assert json.loads(first["body"])["driverId"] == "near"
+    assert json.loads(second["body"])["driverId"] == "far"
+    assert third["statusCode"] == 404
+    assert app.lambda_handler({"body": "{}"}, None)["statusCode"] == 400
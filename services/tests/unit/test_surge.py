@@ -0,0 +1,335 @@
+import json
+import random
+import sys
+import threading
+
+import pytest
+
+from common.driver_ingestion import DriverLocationIngestor
+from common.in_memory_dynamodb import InMemoryDynamoDBClient
+from common.resources import ResourceRegistry
+from ride_request import app_old_v11, surge
+from ride_request.app_old_v11 import (
+    RequestValidator,
+    RideRequestDynamoDBStorage,
+    RideRequestHandler,
+)
+from ride_request.surge import SurgePricer, SurgeSupplyTable
+from tests.unit.fakes import FakeClock, ride_request_event
+
+PICKUP = {"latitude": 51.51, "longitude": -0.13}
+# Three cells east: outside PICKUP's neighbourhood
+ELSEWHERE = {"latitude": 51.51, "longitude": -0.07}
+NUMPY_FALLBACK = [(surge, "load_numpy", lambda: None)]
+
+
+def create_pricer(clock, **kwargs):
+    kwargs.setdefault("neighbour_weight", 0.0)
+    return SurgePricer(
+        window_seconds=60, bucket_seconds=10, update_seconds=5, clock=clock, **kwargs
+    )
+
+
+def test_demand_above_supply_raises_the_multiplier(backend):
+    clock = FakeClock(1000.0)
+    pricer = create_pricer(clock)
+    for n in range(2):
+        pricer.upsert(f"driver-{n}", PICKUP["latitude"], PICKUP["longitude"])
+    for _ in range(8):
+        pricer.record_request(PICKUP)
+
+    # 8 requests for 2 drivers: 1 + 0.5 * (4 - 1), from the next update
+    assert pricer.multiplier(PICKUP) == 1.0
+    clock.now += 5
+    assert pricer.multiplier(PICKUP) == 2.5
+    assert pricer.multiplier(ELSEWHERE) == 1.0
+
+    for n in range(2, 4):
+        pricer.upsert(f"driver-{n}", PICKUP["latitude"], PICKUP["longitude"])
+    clock.now += 10
+    for _ in range(8):
+        pricer.record_request(PICKUP)
+    # A ping from where the driver already is keeps supply known
+    pricer.upsert("driver-3", PICKUP["latitude"], PICKUP["longitude"])
+
+    # 16 requests; 2 drivers sampled in one bucket and 4 in five
+    clock.now += 40
+    assert pricer.multiplier(PICKUP) == 2.6
+
+    # The first 8 requests and the 2-driver sample have left the window
+    clock.now += 10
+    assert pricer.multiplier(PICKUP) == 1.5
+
+    pricer.remove("driver-0")
+    clock.now += 120
+    assert pricer.multiplier(PICKUP) == 1.0
+
+
+def test_multipliers_are_capped_and_served_between_updates(backend):
+    clock = FakeClock(1000.0)
+    pricer = create_pricer(clock, max_multiplier=2.0)
+    pricer.upsert("driver-1", ELSEWHERE["latitude"], ELSEWHERE["longitude"])
+    assert pricer.multiplier(PICKUP) == 1.0
+    epoch = pricer.epoch
+
+    for _ in range(100):
+        pricer.record_request(PICKUP)
+    assert pricer.multiplier(PICKUP) == 1.0
+    assert pricer.epoch == epoch
+
+    clock.now += 5
+    assert pricer.multiplier(PICKUP) == 2.0
+    assert pricer.epoch == epoch + 1
+
+
+def test_demand_spills_over_into_neighbouring_cells(backend):
+    clock = FakeClock(1000.0)
+    pricer = create_pricer(clock, neighbour_weight=0.5)
+    i, j = pricer.cell_of(PICKUP["latitude"], PICKUP["longitude"])
+    neighbour = {
+        "latitude": (i + 1.5) * pricer.cell_size,
+        "longitude": (j + 0.5) * pricer.cell_size,
+    }
+    pricer.upsert("driver-1", neighbour["latitude"], neighbour["longitude"])
+    for _ in range(6):
+        pricer.record_request(PICKUP)
+    clock.now += 5
+
+    # Pickup cell: 6 requests for half a driver; neighbour: 3 for one
+    assert pricer.multiplier(PICKUP) == 3.0
+    assert pricer.multiplier(neighbour) == 2.0
+    assert pricer.multiplier(ELSEWHERE) == 1.0
+
+
+def test_unknown_supply_means_no_surge(backend):
+    clock = FakeClock(1000.0)
+    pricer = create_pricer(clock)
+    for _ in range(20):
+        pricer.record_request(PICKUP)
+    clock.now += 5
+
+    # No driver positions yet, as in a container the pings never reach
+    assert pricer.multiplier(PICKUP) == 1.0
+
+    pricer.upsert("driver-1", ELSEWHERE["latitude"], ELSEWHERE["longitude"])
+    pricer.update()
+    assert pricer.multiplier(PICKUP) == 3.0
+
+    # Nothing heard from drivers for a whole window
+    clock.now += 60
+    pricer.record_request(PICKUP)
+    assert pricer.multiplier(PICKUP) == 1.0
+
+
+def test_concurrent_requests_and_driver_updates_keep_counts_intact():
+    # The NumPy update holds views of the arrays that appends would break
+    pytest.importorskip("numpy")
+    pricer = create_pricer(FakeClock(1000.0), neighbour_weight=0.5)
+    rng = random.Random(11)
+    locations = [
+        {"latitude": rng.uniform(51.3, 51.7), "longitude": rng.uniform(-0.5, 0.3)}
+        for _ in range(500)
+    ]
+    errors = []
+
+    def run(work):
+        try:
+            for n, location in enumerate(locations):
+                work(n, location)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [
+        lambda n, location: pricer.record_request(location),
+        lambda n, location: pricer.upsert(
+            f"driver-{n}", location["latitude"], location["longitude"]
+        ),
+        lambda n, location: pricer.update(),
+    ]
+    threads = [threading.Thread(target=run, args=(work,)) for work in workers * 2]
+    # Switch threads often enough to land inside an update
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert sum(pricer.demand) == 2 * len(locations)
+    assert sum(pricer.available) == len(locations)
+
+
+def test_numpy_and_python_updates_agree():
+    pytest.importorskip("numpy")
+    rng = random.Random(5)
+    clock = FakeClock(1000.0)
+    pricer = create_pricer(clock, neighbour_weight=0.5)
+    locations = [
+        {"latitude": rng.uniform(51.4, 51.6), "longitude": rng.uniform(-0.3, 0.1)}
+        for _ in range(400)
+    ]
+    for _ in range(20):
+        clock.now += 3
+        for n in range(50):
+            location = rng.choice(locations)
+            pricer.upsert(f"driver-{n}", location["latitude"], location["longitude"])
+        for _ in range(100):
+            pricer.record_request(rng.choice(locations))
+
+    pricer.update()
+    vectorized = pricer.multipliers
+    pricer.numpy = None
+    pricer.update()
+
+    assert pricer.multipliers == vectorized
+    assert max(vectorized) > 1.0
+
+
+def test_ride_requests_count_as_demand_and_drivers_as_supply():
+    clock = FakeClock(1000.0)
+    pricer = create_pricer(clock)
+    handler = RideRequestHandler(
+        RequestValidator(),
+        RideRequestDynamoDBStorage(InMemoryDynamoDBClient()),
+        surge_pricer=pricer,
+    )
+    event = {
+        "body": json.dumps(
+            {
+                "customerId": "customer-1",
+                "pickupLocation": PICKUP,
+                "destinationLocation": ELSEWHERE,
+            }
+        )
+    }
+    ingestor = DriverLocationIngestor(driver_index=pricer)
+    ingestor.ingest(
+        [
+            {
+                "driverId": "driver-1",
+                "pings": [{**PICKUP, "timestamp": 1000}],
+            }
+        ]
+    )
+
+    results = [handler.handle(event, None) for _ in range(3)]
+    clock.now += 5
+
+    assert [result.data["surgeMultiplier"] for result in results] == [1.0] * 3
+    assert pricer.multiplier(PICKUP) == 2.0
+
+
+def test_surge_pricing_failures_do_not_fail_ride_requests():
+    class BrokenPricer:
+        def record_request(self, location):
+            raise ValueError("buffer is smaller than requested size")
+
+    handler = RideRequestHandler(
+        RequestValidator(),
+        RideRequestDynamoDBStorage(InMemoryDynamoDBClient()),
+        surge_pricer=BrokenPricer(),
+    )
+    event = {
+        "body": json.dumps(
+            {
+                "customerId": "customer-1",
+                "pickupLocation": PICKUP,
+                "destinationLocation": ELSEWHERE,
+            }
+        )
+    }
+
+    result = handler.handle(event, None)
+
+    assert result.status_code == 200
+    assert "surgeMultiplier" not in result.data
+
+
+def test_supply_table_sums_fresh_counts_of_every_writer():
+    client = InMemoryDynamoDBClient()
+    clock = FakeClock(1_700_000_000.0)
+    writers = [
+        SurgeSupplyTable(
+            client, writer_id=f"writer-{n}", max_age_seconds=60, clock=clock
+        )
+        for n in range(2)
+    ]
+    reader = SurgeSupplyTable(client, max_age_seconds=60, clock=clock)
+    pickup = (2575, -1)
+    # Across the Greenwich meridian, a region boundary, from pickup
+    neighbour = (2575, 0)
+    assert reader.region_of(pickup) != reader.region_of(neighbour)
+
+    assert reader.read([pickup]) is None
+    writers[0].publish({pickup: 2, neighbour: 1})
+    writers[1].publish({pickup: 3})
+
+    assert reader.read([pickup]) == {pickup: 5, neighbour: 1}
+
+    # Writer 1 stops; writer 0 only rewrites its unchanged counts on its
+    # heartbeat, every max_age_seconds / 3
+    clock.now += 30
+    writers[0].publish({pickup: 2, neighbour: 1})
+    clock.now += 31
+    assert reader.read([pickup]) == {pickup: 2, neighbour: 1}
+    assert client.call_counts["BatchWriteItem"] == 3
+
+
+def test_supply_source_failures_keep_the_last_counts(backend):
+    clock = FakeClock(1000.0)
+    reads = []
+
+    def supply_source(cells):
+        reads.append(cells)
+        if len(reads) > 1:
+            raise ConnectionError("connection reset")
+        return {pricer.cell_of(PICKUP["latitude"], PICKUP["longitude"]): 1}
+
+    pricer = create_pricer(clock, supply_source=supply_source)
+    for _ in range(4):
+        pricer.record_request(PICKUP)
+    clock.now += 5
+
+    # 4 requests for the 1 driver read before the failure
+    assert pricer.multiplier(PICKUP) == 2.5
+    assert len(reads) == 2
+    assert pricer.available_by_cell() == {
+        pricer.cell_of(PICKUP["latitude"], PICKUP["longitude"]): 1
+    }
+
+
+def test_supply_reaches_ride_requests_through_the_deployed_entry_points(
+    monkeypatch,
+):
+    # The driver stream's function and the ride request function run in
+    # separate containers that only share the DynamoDB tables
+    client = InMemoryDynamoDBClient()
+    monkeypatch.setattr(app_old_v11, "create_dynamodb_client", lambda: client)
+    monkeypatch.setenv("SURGE_UPDATE_SECONDS", "0")
+    supply_container = app_old_v11.register_resources(ResourceRegistry())
+    request_container = app_old_v11.register_resources(ResourceRegistry())
+    ping = {
+        "driverId": "driver-1",
+        "pings": [{**PICKUP, "timestamp": 1_700_000_000_000}],
+    }
+
+    monkeypatch.setattr(app_old_v11, "resources", supply_container)
+    result = app_old_v11.wrapped_surge_supply_handler(
+        {"Records": [{"messageId": "m1", "body": json.dumps(ping)}]}, None
+    )
+    assert result == {"batchItemFailures": []}
+
+    monkeypatch.setattr(app_old_v11, "resources", request_container)
+    event = ride_request_event()
+    event["body"] = json.dumps({**json.loads(event["body"]), "pickupLocation": PICKUP})
+    responses = [app_old_v11.wrapped_lambda_handler(event, None) for _ in range(4)]
+
+    # The first request creates the pickup's cell, whose supply the next
+    # update reads: then 1 driver for 1, 2 and 3 earlier requests
+    assert [
+        json.loads(response["body"])["surgeMultiplier"] for response in responses
+    ] == [1.0, 1.0, 1.5, 2.0]
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from common.validation import (
+    NumberField,
+    ObjectField,
+    StringField,
+    compile_validator,
+    validate_ride_request,
+)
+from ride_request.app_old_v11 import RequestValidator, RideRequestHandler
+
+
+def valid_body():
+    return {
+        "customerId": "customer-1",
+        "pickupLocation": {"latitude": 51.5074, "longitude": -0.1278},
+        "destinationLocation": {"latitude": 51.4700, "longitude": -0.4543},
+    }
+
+
+def test_valid_body_returns_none():
+    assert validate_ride_request(valid_body()) is None
+
+
+def test_all_errors_are_reported_at_once():
+    body = {
+        "customerId": "bad id!",
+        "pickupLocation": {"latitude": 91, "longitude": True},
+    }
+
+    errors = validate_ride_request(body)
+
+    assert errors == [
+        ("customerId", "must be an id of letters, digits, - or _"),
+        ("pickupLocation.latitude", "must be a number between -90 and 90"),
+        ("pickupLocation.longitude", "must be a number between -180 and 180"),
+        ("destinationLocation", "is required"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "body", [[], "text", {"customerId": "c", "pickupLocation": [], "x": 1}]
+)
+def test_wrong_shapes_are_rejected(body):
+    assert validate_ride_request(body)
+
+
+def test_nan_is_out_of_range():
+    body = valid_body()
+    body["pickupLocation"]["latitude"] = float("nan")
+
+    assert validate_ride_request(body) == [
+        ("pickupLocation.latitude", "must be a number between -90 and 90")
+    ]
+
+
+def test_compile_validator_rejects_unknown_fields():
+    with pytest.raises(TypeError):
+        compile_validator(ObjectField({"x": object()}))
+
+
+def test_compile_validator_plain_string_and_number():
+    validate = compile_validator(
+        ObjectField({"name": StringField(), "count": NumberField(0, 10)})
+    )
+
+    assert validate({"name": "a", "count": 3}) is None
+    assert validate({"name": 1, "count": 11}) == [
+        ("name", "must be a string"),
+        ("count", "must be a number between 0 and 10"),
+    ]
+
+
+def test_request_validator_messages():
+    validator = RequestValidator()
+
+    assert validator.validate(valid_body()) is RequestValidator.VALID
+    assert (
+        validator.validate({"customerId": "c"}).error_message
+        == "Missing required fields: pickupLocation, destinationLocation"
+    )
+
+
+def test_handler_rejects_oversized_and_invalid_bodies():
+    handler = RideRequestHandler(RequestValidator(max_body_length=100), None)
+
+    oversized = handler.handle({"body": json.dumps(valid_body())}, None)
+    invalid = handler.handle({"body": json.dumps({"customerId": 1})}, None)
+
+    assert oversized.status_code == 413
+    assert invalid.status_code == 400
@@ -0,0 +1,211 @@
+import json
+
+import pytest
+
+from common.in_memory_dynamodb import InMemoryDynamoDBClient, TableSchema
+from common.write_behind import FlushError, WriteBehindBuffer
+from ride_request.app_old_v11 import RideStatusBatchHandler
+from ride_request.ride_lifecycle import (
+    InvalidTransition,
+    RideLifecycle,
+    StaleStatus,
+    Transitioned,
+)
+from tests.unit.fakes import FakeClock
+
+TABLES = {"RideStatus": TableSchema("rideId"), "RideRequests": TableSchema("rideId")}
+
+
+def status_item(ride_id, status, reported_at):
+    return {
+        "rideId": {"S": ride_id},
+        "status": {"S": status},
+        "reportedAt": {"N": str(reported_at)},
+    }
+
+
+def status_record(message_id, ride_id, status, updated_at):
+    body = {"rideId": ride_id, "status": status, "updatedAt": updated_at}
+    return {"messageId": message_id, "body": json.dumps(body)}
+
+
+def stored_status(client, ride_id, table_name="RideStatus"):
+    item = client.get_item(TableName=table_name, Key={"rideId": {"S": ride_id}})
+    return item["Item"]["status"]["S"]
+
+
+def create_buffer(client, clock=None, **kwargs):
+    return WriteBehindBuffer(
+        client,
+        "RideStatus",
+        "rideId",
+        clock=clock or FakeClock(),
+        sleep=lambda delay: None,
+        **kwargs,
+    )
+
+
+def create_status_handler(client, ride_ids, **kwargs):
+    # Status events update rides in the ride table, through RideLifecycle
+    for ride_id in ride_ids:
+        client.put_item(
+            TableName="RideRequests", Item=status_item(ride_id, "requested", 0)
+        )
+    client.call_counts.clear()
+    lifecycle = RideLifecycle(client)
+    buffer = create_buffer(client, write_item=lifecycle.record_status, **kwargs)
+    return RideStatusBatchHandler(buffer)
+
+
+def test_updates_coalesce_to_the_latest_state_per_ride():
+    client = InMemoryDynamoDBClient(TABLES)
+    buffer = create_buffer(client)
+
+    for reported_at, status in enumerate(["requested", "matched", "arriving"]):
+        buffer.put(status_item("ride-1", status, reported_at), order=reported_at)
+    buffer.put(status_item("ride-2", "requested", 0), order=0)
+
+    assert buffer.flush() == 2
+    assert client.call_counts == {"BatchWriteItem": 1}
+    assert stored_status(client, "ride-1") == "arriving"
+    assert buffer.stats == {"received": 4, "coalesced": 2, "stale": 0, "written": 2}
+
+
+def test_stale_updates_are_dropped_even_after_a_flush():
+    client = InMemoryDynamoDBClient(TABLES)
+    buffer = create_buffer(client)
+
+    buffer.put(status_item("ride-1", "arriving", 20), order=20)
+    buffer.put(status_item("ride-1", "matched", 10), order=10)
+    buffer.flush()
+    buffer.put(status_item("ride-1", "requested", 5), order=5)
+    buffer.flush()
+
+    assert stored_status(client, "ride-1") == "arriving"
+    assert buffer.stats["stale"] == 2
+
+
+def test_flushes_when_full_or_when_the_oldest_item_is_too_old():
+    client = InMemoryDynamoDBClient(TABLES)
+    clock = FakeClock()
+    buffer = create_buffer(client, clock, max_items=3, max_age=1.0)
+
+    for index in range(3):
+        buffer.put(status_item(f"ride-{index}", "requested", 0))
+    assert len(buffer) == 0
+
+    buffer.put(status_item("ride-9", "requested", 0))
+    clock.now = 0.5
+    buffer.put(status_item("ride-10", "requested", 0))
+    assert len(buffer) == 2
+    clock.now = 1.0
+    buffer.put(status_item("ride-11", "requested", 0))
+    assert len(buffer) == 0
+    assert client.item_count("RideStatus") == 6
+
+
+def test_unwritten_items_are_dropped_once_reported():
+    client = InMemoryDynamoDBClient(TABLES, throttle_rate=1.0)
+    buffer = create_buffer(client, max_batch_retries=2)
+    buffer.put(status_item("ride-1", "matched", 2), order=2)
+
+    with pytest.raises(FlushError) as error:
+        buffer.flush()
+
+    assert error.value.keys == ["ride-1"]
+    assert len(buffer) == 0
+
+    # The redelivered record is written again, and nothing stale after it
+    client.throttle_rate = 0.0
+    buffer.put(status_item("ride-1", "matched", 2), order=2)
+    buffer.flush()
+    client.put_item(TableName="RideStatus", Item=status_item("ride-1", "arriving", 3))
+    assert buffer.flush() == 0
+    assert stored_status(client, "ride-1") == "arriving"
+
+
+def test_items_a_full_buffer_could_not_write_wait_for_the_final_flush():
+    client = InMemoryDynamoDBClient(TABLES, throttle_rate=1.0)
+    buffer = create_buffer(client, max_items=1, max_batch_retries=0)
+
+    buffer.put(status_item("ride-1", "matched", 1))
+
+    assert len(buffer) == 1
+    client.throttle_rate = 0.0
+    assert buffer.flush() == 1
+
+
+def test_status_batch_handler_writes_once_per_ride():
+    client = InMemoryDynamoDBClient(TABLES)
+    handler = create_status_handler(client, ["ride-1", "ride-2"])
+    records = [
+        status_record("m1", "ride-1", "requested", 1),
+        status_record("m2", "ride-1", "matched", 2),
+        status_record("m3", "ride-2", "requested", 1),
+        status_record("m4", "ride-1", "arriving", 3),
+        status_record("m5", "ride-1", "teleported", 4),
+        {"messageId": "m6", "body": "[]"},
+    ]
+
+    result = handler.handle({"Records": records}, None)
+
+    assert result == {"batchItemFailures": []}
+    assert client.call_counts == {"UpdateItem": 2}
+    assert stored_status(client, "ride-1", "RideRequests") == "arriving"
+    assert stored_status(client, "ride-2", "RideRequests") == "requested"
+
+
+def test_reported_statuses_never_roll_a_ride_back():
+    client = InMemoryDynamoDBClient(TABLES)
+    lifecycle = RideLifecycle(client, clock=lambda: 0.005)
+    client.put_item(
+        TableName="RideRequests", Item=status_item("ride-1", "requested", 0)
+    )
+
+    recorded = lifecycle.record_status(status_item("ride-1", "matched", 4))
+    repeated = lifecycle.record_status(status_item("ride-1", "matched", 4))
+    older = lifecycle.record_status(status_item("ride-1", "requested", 6))
+
+    assert isinstance(recorded, Transitioned)
+    assert isinstance(repeated, StaleStatus)
+    assert isinstance(older, InvalidTransition)
+    assert older.status == "matched" and older.version == 1
+
+
+def test_stale_status_after_a_cancel_is_rejected():
+    # The driver's app reports "arriving" with a clock ahead of the server,
+    # after the customer cancelled
+    client = InMemoryDynamoDBClient(TABLES)
+    lifecycle = RideLifecycle(client, clock=lambda: 0.005)
+    client.put_item(
+        TableName="RideRequests", Item=status_item("ride-1", "requested", 0)
+    )
+    lifecycle.record_status(status_item("ride-1", "matched", 2))
+
+    cancelled = lifecycle.cancel("ride-1")
+    late = lifecycle.record_status(status_item("ride-1", "arriving", 60_000))
+
+    assert isinstance(cancelled, Transitioned)
+    assert isinstance(late, InvalidTransition)
+    assert late.status == "cancelled" and late.version == 2
+    item = client.get_item(TableName="RideRequests", Key={"rideId": {"S": "ride-1"}})
+    assert item["Item"]["status"] == {"S": "cancelled"}
+    assert item["Item"]["updatedAt"] == {"N": "5"}
+    assert item["Item"]["reportedAt"] == {"N": "2"}
+
+
+def test_status_batch_handler_reports_records_of_unwritten_rides():
+    client = InMemoryDynamoDBClient(TABLES)
+    handler = create_status_handler(client, ["ride-1"], max_batch_retries=1)
+    client.throttle_rate = 1.0
+    records = [
+        status_record("m1", "ride-1", "requested", 1),
+        status_record("m2", "ride-1", "matched", 2),
+    ]
+
+    result = handler.handle({"Records": records}, None)
+
+    assert result == {
+        "batchItemFailures": [{"itemIdentifier": "m1"}, {"itemIdentifier": "m2"}]
+    }
+    assert len(handler.write_buffer) == 0